@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import asyncio
+import time
+import uuid
+import random
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+
+# Замер холодного старта бота: каждый прогон — новый интерпретатор в рабочем каталоге с синтетическим
+# белым списком и тикетами. Измеряются импорт пакета, сборка приложения и загрузка состояния (post_init).
+# Пример: python benchmark_startup.py --runs 5 --users 5000 --tickets 20000
+
+# Модули, которые не должны импортироваться при старте (создаются при первом обращении)
+LAZY_MODULES = ('googlemaps',)
+
+TICKET_PRIORITIES = ['Низкий', 'Средний', 'Высокий']
+TICKET_STATUSES = ['Ожидает ответа', 'В работе', 'Закрыт']
+
+def write_synthetic_state(workdir, users, tickets):
+    user_ids = list(range(1000000, 1000000 + users))
+    with open(os.path.join(workdir, 'whitelist.json'), 'w') as f:
+        json.dump(user_ids, f)
+    started = datetime.datetime.now() - datetime.timedelta(days=30)
+    data = []
+    for number in range(tickets):
+        data.append({
+            'id': str(uuid.uuid4()),
+            'user_id': random.choice(user_ids) if user_ids else number,
+            'user_name': f"user{number}",
+            'message': f"Обращение {number}",
+            'timestamp': (started + datetime.timedelta(minutes=number)).isoformat(),
+            'status': random.choice(TICKET_STATUSES),
+            'priority': random.choice(TICKET_PRIORITIES),
+            'admin_reply': None
+        })
+    with open(os.path.join(workdir, 'tickets.json'), 'w') as f:
+        json.dump(data, f)
+
+# Один прогон внутри нового интерпретатора: печатает JSON с длительностями этапов
+def child():
+    started = time.perf_counter()
+    from route_master import app
+    imported = time.perf_counter()
+    application = app.build_application()
+    built = time.perf_counter()
+    asyncio.run(app.load_state())
+    loaded = time.perf_counter()
+    print(json.dumps({
+        'import': imported - started,
+        'build_application': built - imported,
+        'load_state': loaded - built,
+        'eager_modules': [name for name in LAZY_MODULES if name in sys.modules],
+        'tickets': len(app.tickets),
+        'whitelist': len(app.whitelist),
+        'application': type(application).__name__,
+    }))
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='route-master-startup-')
+    write_synthetic_state(workdir, args.users, args.tickets)
+    env = dict(
+        os.environ,
+        # Каталог бота раньше каталога скрипта, чтобы можно было замерить другую копию пакета
+        PYTHONPATH=os.pathsep.join([os.path.abspath(args.bot_dir), os.path.dirname(os.path.abspath(__file__))]),
+        TELEGRAM_BOT_TOKEN='123456:STARTUP-BENCHMARK',
+        GOOGLE_MAPS_API_KEY=os.environ.get('GOOGLE_MAPS_API_KEY', 'AIzaStartupBenchmark'),
+    )
+    runs = []
+    for _ in range(args.runs):
+        launched = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', 'import benchmark_startup; benchmark_startup.child()'],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+        if result.returncode:
+            raise SystemExit(result.stderr)
+        measured = json.loads(result.stdout.strip().splitlines()[-1])
+        measured['process'] = time.perf_counter() - launched
+        runs.append(measured)
+
+    summary = {
+        'runs': args.runs,
+        'whitelist': runs[-1]['whitelist'],
+        'tickets': runs[-1]['tickets'],
+        'eager_modules': runs[-1]['eager_modules'],
+        'median_ms': {
+            stage: round(statistics.median(run[stage] for run in runs) * 1000, 1)
+            for stage in ('import', 'build_application', 'load_state', 'process')
+        },
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота")
+    parser.add_argument('--bot-dir', default=os.path.dirname(os.path.abspath(__file__)), help="каталог с пакетом route_master")
+    parser.add_argument('--workdir', help="рабочий каталог (по умолчанию — временный)")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--users', type=int, default=1000, help="пользователей в белом списке")
+    parser.add_argument('--tickets', type=int, default=5000)
+    run(parser.parse_args())
@@ -0,0 +1,342 @@
+import json
+import time
+import math
+import email
+import asyncio
+import argparse
+import itertools
+from collections import deque
+from urllib.parse import parse_qsl, urlsplit
+
+# Фиктивный сервер Telegram Bot API для нагрузочного тестирования бота: отдает обновления через
+# getUpdates или доставляет их на вебхук, записывает отправленные ботом сообщения и изменения
+# сообщений и, как настоящий Telegram, отвечает 429 (RetryAfter) при превышении лимитов частоты.
+# Бот направляется на сервер переменными окружения TELEGRAM_API_URL=http://<хост>:<порт>/bot
+# и TELEGRAM_FILE_URL=http://<хост>:<порт>/file/bot (скачивание файлов, отправленных пользователями)
+
+BOT_USER = {
+    'id': 100000, 'is_bot': True, 'first_name': 'Route Master', 'username': 'route_master_bot',
+    'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False
+}
+
+# Методы, на которые распространяются лимиты частоты (отправка и изменение сообщений)
+FLOOD_METHOD_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+# Текстовые параметры не декодируются из JSON, чтобы текст "123" остался строкой
+TEXT_PARAMS = ('text', 'caption', 'callback_query_id', 'url', 'secret_token')
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict', 429: 'Too Many Requests'}
+
+# Ведро токенов: rate запросов в секунду с запасом burst
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # 0, если запрос разрешен, иначе через сколько секунд появится токен
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class FakeTelegramServer:
+    def __init__(self, host='127.0.0.1', port=8081, chat_rate=1.0, chat_burst=3, global_rate=30.0):
+        self.host = host
+        self.port = port
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate) if global_rate else None
+        self.chat_buckets = {}
+        self.pending = deque()  # обновления, еще не подтвержденные ботом через offset
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.calls = []  # (время, метод, параметры) успешных вызовов
+        self.flood_errors = 0
+        self.last_messages = {}  # ID чата -> последнее сообщение бота (для callback_query)
+        self.replies = {}  # ID чата -> время каждого ответа бота
+        self.waiters = {}  # ID чата -> futures, ожидающие следующего ответа
+        self.webhook_url = None
+        self.webhook_queue = asyncio.Queue()
+        self.webhook_workers = []
+        self.bot_connected = asyncio.Event()
+        self.files = {}  # ID файла -> содержимое файлов, отправленных пользователями
+        self.server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def file_url(self):
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+
+    async def stop(self):
+        self.set_webhook(None)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    # Обновления от пользователей
+
+    def push_update(self, update):
+        update = dict(update, update_id=next(self.update_ids))
+        if self.webhook_url:
+            self.webhook_queue.put_nowait(update)
+        else:
+            self.pending.append(update)
+            self.new_updates.set()
+        return update
+
+    # Файл, который пользователь отправит боту: объект document для сообщения
+    def add_document(self, content, file_name):
+        file_id = f"upload-{len(self.files) + 1}"
+        self.files[file_id] = content
+        return {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name, 'file_size': len(content)}
+
+    # Ожидание, пока число ответов бота в чате не достигнет count; возвращает время всех ответов
+    async def wait_for_replies(self, chat_id, count):
+        replies = self.replies.setdefault(chat_id, [])
+        while len(replies) < count:
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.setdefault(chat_id, []).append(future)
+            await future
+        return replies
+
+    # HTTP
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                url = urlsplit(target)
+                if url.path.startswith('/file/'):
+                    # Скачивание файла: /file/bot<токен>/<file_path>
+                    content = self.files.get(url.path.rsplit('/', 1)[-1])
+                    status, content_type, payload = (200, 'application/octet-stream', content) if content is not None else (404, 'text/plain', b'')
+                else:
+                    params = parse_params(headers.get('content-type', ''), body, url.query)
+                    status, response = await self.call(url.path.rsplit('/', 1)[-1], params)
+                    content_type, payload = 'application/json', json.dumps(response, ensure_ascii=False).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Соединение закрыто клиентом или сервер остановлен во время долгого опроса
+            pass
+        finally:
+            writer.close()
+
+    # Методы Bot API
+
+    async def call(self, method, params):
+        method = method.lower()
+        if method.startswith(FLOOD_METHOD_PREFIXES):
+            retry_after = self.check_flood(params.get('chat_id'))
+            if retry_after:
+                self.flood_errors += 1
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {retry_after}",
+                    'parameters': {'retry_after': retry_after}
+                }
+
+        if method == 'getupdates':
+            if self.webhook_url:
+                return 409, {'ok': False, 'error_code': 409, 'description': "Conflict: can't use getUpdates method while webhook is active"}
+            self.bot_connected.set()
+            return 200, {'ok': True, 'result': await self.get_updates(params)}
+
+        self.calls.append((time.monotonic(), method, params))
+        if method == 'getme':
+            result = BOT_USER
+        elif method == 'setwebhook':
+            self.set_webhook(params.get('url') or None, int(params.get('max_connections') or 40))
+            self.bot_connected.set()
+            result = True
+        elif method == 'deletewebhook':
+            self.set_webhook(None)
+            result = True
+        elif method == 'getfile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}
+            result = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(self.files[file_id]), 'file_path': file_id}
+        elif method == 'getwebhookinfo':
+            result = {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': self.webhook_queue.qsize()}
+        elif method.startswith('send') or method.startswith('edit'):
+            result = self.record_message(method, params)
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def check_flood(self, chat_id):
+        waits = []
+        if self.global_bucket:
+            waits.append(self.global_bucket.take())
+        if self.chat_rate and chat_id is not None:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            waits.append(bucket.take())
+        wait = max(waits, default=0)
+        return math.ceil(wait) if wait else 0
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending and params.get('timeout'):
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.pending, limit))
+
+    def record_message(self, method, params):
+        chat_id = params.get('chat_id')
+        if method.startswith('edit') and chat_id is None:
+            # Сообщение, отправленное через встроенный режим
+            return True
+        message = {
+            'message_id': params.get('message_id') or next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if 'text' in params:
+            message['text'] = str(params['text'])
+        markup = params.get('reply_markup')
+        if isinstance(markup, dict) and 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        if method == 'senddocument':
+            message['document'] = {'file_id': f"document-{message['message_id']}", 'file_unique_id': str(message['message_id'])}
+        self.last_messages[chat_id] = message
+        self.replies.setdefault(chat_id, []).append(time.monotonic())
+        for future in self.waiters.pop(chat_id, []):
+            if not future.done():
+                future.set_result(None)
+        return message
+
+    # Доставка на вебхук: как Telegram, одновременно не более max_connections запросов
+
+    def set_webhook(self, url, max_connections=40):
+        for worker in self.webhook_workers:
+            worker.cancel()
+        self.webhook_workers = []
+        self.webhook_url = url
+        if url:
+            # Неподтвержденные обновления из очереди getUpdates переходят на вебхук
+            while self.pending:
+                self.webhook_queue.put_nowait(self.pending.popleft())
+            self.webhook_workers = [asyncio.create_task(self.deliver_webhooks()) for _ in range(max_connections)]
+
+    async def deliver_webhooks(self):
+        while True:
+            update = await self.webhook_queue.get()
+            for attempt in range(3):
+                try:
+                    status = await post_json(self.webhook_url, update)
+                    if status == 200:
+                        break
+                except (OSError, asyncio.IncompleteReadError):
+                    pass
+                await asyncio.sleep(1)
+
+    def summary(self):
+        methods = {}
+        for _, method, _ in self.calls:
+            methods[method] = methods.get(method, 0) + 1
+        return {'calls': methods, 'flood_errors': self.flood_errors}
+
+# Параметры запроса: форма (так их отправляет python-telegram-bot), JSON или multipart с файлами.
+# Вложенные объекты и числа в форме закодированы в JSON
+def parse_params(content_type, body, query=''):
+    params = dict(parse_qsl(query))
+    if content_type.startswith('application/json'):
+        params.update(json.loads(body or b'{}'))
+        return params
+    if content_type.startswith('multipart/form-data'):
+        message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = {'file_name': part.get_filename(), 'size': len(part.get_payload(decode=True))}
+            else:
+                params[name] = part.get_payload(decode=True).decode()
+    else:
+        params.update(parse_qsl(body.decode()))
+    for name, value in params.items():
+        if isinstance(value, str) and name not in TEXT_PARAMS:
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+# POST JSON на вебхук бота; возвращает HTTP-статус
+async def post_json(url, data):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        writer.write(
+            f"POST {parts.path or '/'} HTTP/1.1\r\nHost: {parts.netloc}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+async def serve(args):
+    server = FakeTelegramServer(args.host, args.port, args.chat_rate, args.chat_burst, args.global_rate)
+    await server.start()
+    print(f"Фиктивный Bot API: {server.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(server.summary(), ensure_ascii=False))
+
+def add_server_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--chat-rate', type=float, default=1.0, help="сообщений в секунду в один чат (0 — без лимита)")
+    parser.add_argument('--chat-burst', type=int, default=3, help="запас сообщений в один чат")
+    parser.add_argument('--global-rate', type=float, default=30.0, help="сообщений в секунду всего (0 — без лимита)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фиктивный сервер Telegram Bot API")
+    add_server_arguments(parser)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import itertools
+import tempfile
+from fake_telegram import FakeTelegramServer, add_server_arguments
+
+# Нагрузочный сценарий: запускает бота против фиктивного сервера Bot API, воспроизводит обновления
+# тысяч пользователей с заданной частотой и измеряет задержку от отправки обновления до первого ответа бота.
+# Пример: python load_scenario.py --users 2000 --rate 200 --scenario login --password <пароль пассажира>
+
+# Шаги сценариев: (тип обновления, значение, сколько ответов бота ждать)
+SCENARIOS = {
+    # Пользователь из белого списка без авторизации получает выбор роли
+    'start': lambda args: [('command', '/start', 1)],
+    # Полный вход пассажира через ConversationHandler и отправка местоположения
+    'login': lambda args: [
+        ('command', '/start', 1),
+        ('callback', 'role_пассажир', 1),
+        ('text', args.password, 2),
+        ('location', (51.16, 71.45), 1),
+    ],
+}
+
+FIRST_USER_ID = 1000000
+
+# Равномерная отправка обновлений: не чаще rate в секунду по всем пользователям
+class Pacer:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_slot = time.monotonic()
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.interval
+        await asyncio.sleep(slot - now)
+
+message_ids = itertools.count(1)
+
+def make_update(server, user_id, kind, value):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+    if kind == 'callback':
+        return {'callback_query': {
+            'id': str(next(message_ids)), 'from': user, 'chat_instance': str(user_id),
+            'data': value, 'message': server.last_messages.get(user_id)
+        }}
+    message = {
+        'message_id': next(message_ids), 'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'}, 'from': user
+    }
+    if kind == 'command':
+        message['text'] = value
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(value.split()[0])}]
+    elif kind == 'text':
+        message['text'] = value
+    elif kind == 'location':
+        message['location'] = {'latitude': value[0], 'longitude': value[1]}
+    elif kind == 'document':
+        message['document'] = value
+    return {'message': message}
+
+async def run_user(server, pacer, user_id, steps, timeout, results):
+    for kind, value, expected in steps:
+        await pacer.wait()
+        before = len(server.replies.get(user_id, []))
+        sent = time.monotonic()
+        server.push_update(make_update(server, user_id, kind, value))
+        try:
+            replies = await asyncio.wait_for(server.wait_for_replies(user_id, before + expected), timeout)
+        except asyncio.TimeoutError:
+            results['timeouts'] += 1
+            return
+        results['latencies'].append(replies[before] - sent)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def report(results, server, duration, startup):
+    latencies = sorted(results['latencies'])
+    summary = {
+        'startup_seconds': round(startup, 3),
+        'duration_seconds': round(duration, 3),
+        'steps_completed': len(latencies),
+        'timeouts': results['timeouts'],
+        'replies_per_second': round(len(latencies) / duration, 1) if duration else 0,
+        'latency_ms': {
+            name: round(value * 1000, 1) for name, value in (
+                ('p50', percentile(latencies, 0.5)), ('p90', percentile(latencies, 0.9)),
+                ('p99', percentile(latencies, 0.99)), ('max', latencies[-1] if latencies else 0.0),
+            )
+        },
+    }
+    summary.update(server.summary())
+    return summary
+
+async def run(args):
+    server = FakeTelegramServer(args.host, args.port, args.chat_rate, args.chat_burst, args.global_rate)
+    await server.start()
+
+    # Состояние бота (белый список, хранилища, журнал) — в отдельном рабочем каталоге
+    workdir = args.workdir or tempfile.mkdtemp(prefix='route-master-load-')
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    with open(os.path.join(workdir, 'whitelist.json'), 'w') as f:
+        json.dump(user_ids, f)
+
+    env = dict(
+        os.environ,
+        TELEGRAM_API_URL=server.base_url,
+        TELEGRAM_FILE_URL=server.file_url,
+        TELEGRAM_BOT_TOKEN='123456:LOAD-TEST',
+        GOOGLE_MAPS_API_KEY=os.environ.get('GOOGLE_MAPS_API_KEY', 'AIzaLoadTest'),
+    )
+    if args.webhook_port:
+        env['TELEGRAM_WEBHOOK_URL'] = f"http://127.0.0.1:{args.webhook_port}/webhook"
+        env['TELEGRAM_WEBHOOK_LISTEN'] = '127.0.0.1'
+        env['TELEGRAM_WEBHOOK_PORT'] = str(args.webhook_port)
+
+    launched = time.monotonic()
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(args.bot), cwd=workdir, env=env)
+    try:
+        connected = asyncio.create_task(server.bot_connected.wait())
+        exited = asyncio.create_task(process.wait())
+        await asyncio.wait([connected, exited], timeout=args.startup_timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not connected.done():
+            raise SystemExit("Бот не подключился к фиктивному серверу")
+        startup = time.monotonic() - launched
+
+        results = {'latencies': [], 'timeouts': 0}
+        pacer = Pacer(args.rate)
+        steps = SCENARIOS[args.scenario](args)
+        started = time.monotonic()
+        await asyncio.gather(*(run_user(server, pacer, user_id, steps, args.timeout, results) for user_id in user_ids))
+        summary = report(results, server, time.monotonic() - started, startup)
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), 30)
+            except asyncio.TimeoutError:
+                process.kill()
+        await server.stop()
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный сценарий бота на фиктивном сервере Bot API")
+    add_server_arguments(parser)
+    parser.add_argument('--bot', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'route-master.py'))
+    parser.add_argument('--workdir', help="рабочий каталог бота (по умолчанию — временный)")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='start')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=100.0, help="обновлений в секунду")
+    parser.add_argument('--password', default='', help="пароль роли для сценария login")
+    parser.add_argument('--timeout', type=float, default=30.0, help="ожидание ответа бота (секунды)")
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--webhook-port', type=int, help="доставлять обновления на вебхук бота на этом порту")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,2 @@
+# Telegram-бот для планирования маршрутов развозки: водители, пассажиры и поддержка.
+# Точка входа — route_master.app.main (скрипт route-master.py)
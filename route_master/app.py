@@ -0,0 +1,493 @@
+# Сборка приложения, загрузка состояния при запуске и режим нескольких воркеров
+import os
+import sys
+import asyncio
+import json
+import time
+import datetime
+import sqlite3
+import multiprocessing
+from urllib.parse import urlsplit
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, ConversationHandler, CallbackQueryHandler, filters,
+    PicklePersistence, PersistenceInput, BaseUpdateProcessor
+)
+from telegram import Bot, ReplyKeyboardRemove, Update
+from . import sync
+from .config import (
+    ADDING_USER, BROADCASTING, CHANGING_TICKET_STATUS, CHOOSING_ROLE, CONFIRMING_IMPORT,
+    CONTACTING_SUPPORT, EDITING_ROUTE, ENTERING_PASSWORD, IMPORTING_USERS, MAX_CONCURRENT_UPDATES,
+    PERSISTENCE_FILE, PERSISTENCE_FLUSH_INTERVAL, POST_REPLY_ACTION, REMOVING_USER,
+    REPLYING_TO_TICKET, ROUTE_EVICTION_INTERVAL, SELECTING_PRIORITY, SHARED_STORE_FILE,
+    SHIFT_START_TIMES, TELEGRAM_API_URL, TELEGRAM_FILE_URL, TELEGRAM_WEBHOOK_LISTEN,
+    TELEGRAM_WEBHOOK_PORT, TELEGRAM_WEBHOOK_URL, TICKET_ACTION, TRAVEL_MODEL_INTERVAL,
+    TRAVEL_TIME_REFRESH_HOUR, VIEWING_ROUTE_DETAILS, VIEWING_TICKET_DETAILS, WAITING_FOR_LOCATION,
+    WORKER_SYNC_INTERVAL, logger, telegram_bot_token
+)
+from .crypto import keyring
+from .sync import SharedStore
+from .storage import (
+    apply_ticket_data, load_tickets, load_whitelist, load_whitelist_roles, save_tickets, save_whitelist,
+    save_whitelist_roles, set_tickets, tickets, triage_queue, whitelist, whitelist_roles
+)
+from .stats import flush_stats, load_stats, stats
+from .maps import load_travel_time_fields, refresh_travel_time_fields, route_cache, travel_time_fields
+from .trips import learn_travel_model, travel_model
+from .gazetteer import gazetteer, load_gazetteer, save_gazetteer
+from .warmup import warm_up_before_shift, warmup_time
+from .profiling import control_profiler, profiler
+from .routes import apply_route_data, route_lifecycle, route_locks, routes
+from .handlers import (
+    add_user, admin_help, back_to_login, broadcast, changing_ticket_status, check_password,
+    choose_address, choose_role_login, contacting_support, edit_route, evict_idle_routes,
+    export_history, export_users, finish_route, generate_reports, handle_add_user,
+    handle_broadcast_message, handle_import_confirm, handle_import_file, handle_live_location,
+    handle_no_show, handle_page_callback, handle_remove_user, import_users, leave_route,
+    list_routes, login, next_ticket, no_show, post_reply_action, profile_command, remove_user,
+    reply_to_ticket, rotate_key, schedule_ticket_sla, search_tickets, selecting_priority, show_eta,
+    start, ticket_action, unauthorized, update_ordering_key, view_route_details,
+    view_ticket_details, view_tickets, waiting_for_location
+)
+
+# Применение изменений, опубликованных другими воркерами
+def apply_remote_change(kind, key, data):
+    if kind == 'route':
+        # Пока маршрут заблокирован здесь, другие воркеры его не меняют, а локальная копия новее журнала
+        if is_route_locked(int(key)):
+            return
+        if data is None:
+            route_lifecycle.forget(int(key))
+        else:
+            apply_route_data(data)
+    elif kind == 'ticket':
+        apply_ticket_data(data)
+        save_tickets(tickets)
+    elif kind == 'whitelist':
+        if data is None:
+            whitelist.discard(int(key))
+        else:
+            whitelist.add(data)
+        save_whitelist(whitelist)
+    elif kind == 'whitelist_roles':
+        if data is None:
+            whitelist_roles.pop(int(key), None)
+        else:
+            whitelist_roles[data[0]] = data[1]
+        save_whitelist_roles(whitelist_roles)
+    elif kind == 'stats':
+        stats.apply(data)
+    elif kind == 'keyring':
+        keyring.load()
+    elif kind == 'route_cache':
+        route_cache.load()
+    elif kind == 'travel_time_field':
+        travel_time_fields[data].load()
+    elif kind == 'travel_model':
+        travel_model.load(with_accuracy=False)
+    elif kind == 'eta_accuracy':
+        travel_model.apply_accuracy(data)
+    elif kind == 'gazetteer':
+        gazetteer.add(*data)
+        save_gazetteer()
+    elif kind == 'profiler':
+        control_profiler(*data)
+    elif kind == 'triage':
+        action, ticket_id, *admin_id = data
+        if action == 'claim':
+            triage_queue.claim(ticket_id, *admin_id)
+        else:
+            triage_queue.requeue(ticket_id)
+
+# Параллельная обработка обновлений: обновления разных чатов обрабатываются одновременно,
+# а обновления одного чата — строго по очереди, чтобы не нарушать переходы ConversationHandler.
+# Базовому классу передается неограниченное число слотов, а настоящий лимит max_concurrent_updates
+# соблюдается собственным семафором, который занимается только после блокировки чата: иначе обновления,
+# ждущие своей очереди в одном занятом чате, держали бы слоты и задерживали других пользователей
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(sys.maxsize)
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+        self._pending = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = update_ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._pending[key] = self._pending.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# Загрузка состояния из файлов при запуске: файлы читаются параллельно в потоках,
+# списки и индексы заполняются на месте
+async def load_state():
+    started = time.perf_counter()
+    loaded_whitelist, loaded_roles, loaded_tickets, *_ = await asyncio.gather(
+        asyncio.to_thread(load_whitelist),
+        asyncio.to_thread(load_whitelist_roles),
+        asyncio.to_thread(load_tickets),
+        asyncio.to_thread(load_stats, stats),
+        asyncio.to_thread(load_travel_time_fields),
+        asyncio.to_thread(route_cache.load),
+        asyncio.to_thread(travel_model.load),
+        asyncio.to_thread(load_gazetteer, gazetteer),
+    )
+    whitelist.clear()
+    whitelist.update(loaded_whitelist)
+    whitelist_roles.clear()
+    whitelist_roles.update(loaded_roles)
+    set_tickets(loaded_tickets)
+    stats.init_tickets(tickets)
+    logger.info(f"Состояние загружено за {time.perf_counter() - started:.3f} с")
+
+# Запуск приложения (Application.post_init): загрузка состояния и задачи, которые от него зависят
+async def post_init(application):
+    await load_state()
+    # Если полей времени в пути еще нет, они строятся вскоре после запуска (первым воркером) по точкам из архива
+    if not sync.worker_index and not all(field.available for field in travel_time_fields.values()):
+        application.job_queue.run_once(refresh_travel_time_fields, when=60)
+    # Сроки ответа на тикеты, открытые до запуска (новые тикеты планирует воркер, который их принял)
+    if not sync.worker_index:
+        for ticket in tickets:
+            schedule_ticket_sla(application.job_queue, ticket)
+
+# Остановка приложения (Application.post_shutdown): несохраненная статистика записывается в файл
+async def post_shutdown(application):
+    flush_stats()
+
+# Сборка приложения со всеми обработчиками
+def build_application(persistence_file=PERSISTENCE_FILE, with_updater=True):
+    # Сессии пользователей, состояния диалогов и bot_data переживают перезапуск;
+    # файл читается при первом обращении и записывается пакетно раз в PERSISTENCE_FLUSH_INTERVAL секунд
+    persistence = PicklePersistence(
+        filepath=persistence_file,
+        store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+        update_interval=PERSISTENCE_FLUSH_INTERVAL
+    )
+    builder = (
+        Application.builder()
+        .token(telegram_bot_token)
+        .base_url(TELEGRAM_API_URL)
+        .base_file_url(TELEGRAM_FILE_URL)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(persistence)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES))
+    )
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    # Обработчик
+    conv_handler = ConversationHandler(
+        name='main_conversation',
+        persistent=True,
+        entry_points=[
+            CommandHandler("start", start),
+            CommandHandler("login", login),
+            CommandHandler('broadcast', broadcast),
+            CommandHandler('add_user', add_user),
+            CommandHandler('remove_user', remove_user),
+            CommandHandler('import_users', import_users),
+            CommandHandler('help', admin_help),
+            CommandHandler('list_routes', list_routes),
+            CommandHandler("finish", finish_route),
+            CommandHandler("view_tickets", view_tickets),
+            CommandHandler("search_tickets", search_tickets),
+            CommandHandler("next_ticket", next_ticket),
+            CommandHandler('reports', generate_reports),
+        ],
+        states={
+            CHOOSING_ROLE: [
+                CallbackQueryHandler(choose_role_login, pattern='^role_.*$'),
+                CallbackQueryHandler(back_to_login, pattern='^back_to_login$'),
+            ],
+            ENTERING_PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, check_password)],
+            CONTACTING_SUPPORT: [MessageHandler(filters.TEXT & ~filters.COMMAND, contacting_support)],
+            SELECTING_PRIORITY: [CallbackQueryHandler(selecting_priority, pattern='^priority_.*$')],
+            WAITING_FOR_LOCATION: [
+                MessageHandler((filters.LOCATION | filters.TEXT) & ~filters.COMMAND, waiting_for_location),
+                CallbackQueryHandler(choose_address, pattern='^address_')
+            ],
+            BROADCASTING: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_message)],
+            ADDING_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_add_user)],
+            REMOVING_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_remove_user)],
+            IMPORTING_USERS: [MessageHandler((filters.Document.ALL | filters.TEXT) & ~filters.COMMAND, handle_import_file)],
+            CONFIRMING_IMPORT: [CallbackQueryHandler(handle_import_confirm, pattern='^whitelist_')],
+            VIEWING_TICKET_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, view_ticket_details)],
+            TICKET_ACTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, ticket_action)],
+            REPLYING_TO_TICKET: [MessageHandler(filters.TEXT & ~filters.COMMAND, reply_to_ticket)],
+            POST_REPLY_ACTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, post_reply_action)],
+            CHANGING_TICKET_STATUS: [MessageHandler(filters.TEXT & ~filters.COMMAND, changing_ticket_status)],
+            VIEWING_ROUTE_DETAILS: [MessageHandler(filters.TEXT & ~filters.COMMAND, view_route_details)],
+            EDITING_ROUTE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_route)],
+        },
+        fallbacks=[
+            CommandHandler("start", start),
+            CommandHandler("login", login),
+            # Следующий тикет можно взять, не выходя из разбора текущего
+            CommandHandler("next_ticket", next_ticket),
+            MessageHandler(filters.Regex('^(Отмена|Назад)$'), lambda update, context: update.message.reply_text("Действие отменено.", reply_markup=ReplyKeyboardRemove()))
+        ],
+    )
+
+    # Регистрация обработчиков
+    application.add_handler(conv_handler)
+
+    # Обработчик для сообщений с живым местоположением
+    application.add_handler(MessageHandler(filters.LOCATION & filters.ChatType.PRIVATE, handle_live_location))
+
+    # Выгрузка белого списка в файл
+    application.add_handler(CommandHandler('export_users', export_users))
+    application.add_handler(CommandHandler('export_history', export_history))
+
+    # Команда /show_eta для водителя
+    application.add_handler(CommandHandler('show_eta', show_eta))
+
+    # Отмена поездки пассажиром и отметка неявки водителем
+    application.add_handler(CommandHandler('leave', leave_route))
+    application.add_handler(CommandHandler('no_show', no_show))
+    application.add_handler(CallbackQueryHandler(handle_no_show, pattern='^noshow_'))
+
+    # Периодическое завершение простаивающих маршрутов
+    application.job_queue.run_repeating(evict_idle_routes, interval=ROUTE_EVICTION_INTERVAL, first=ROUTE_EVICTION_INTERVAL)
+
+    # Ночной пересчет полей времени в пути (в режиме нескольких воркеров — только первым воркером)
+    if not sync.worker_index:
+        application.job_queue.run_daily(refresh_travel_time_fields, time=datetime.time(hour=TRAVEL_TIME_REFRESH_HOUR))
+        # Обучение модели времени в пути на завершенных поездках
+        application.job_queue.run_repeating(learn_travel_model, interval=TRAVEL_MODEL_INTERVAL, first=TRAVEL_MODEL_INTERVAL)
+        # Прогрев кэша маршрутов и справочника адресов перед каждой сменой
+        for shift in SHIFT_START_TIMES:
+            application.job_queue.run_daily(warm_up_before_shift, time=warmup_time(shift), data=shift, name=f"warmup {shift}")
+
+    # Команда /rotate_key для главного администратора
+    application.add_handler(CommandHandler('rotate_key', rotate_key))
+
+    # Профилирование обработчиков по команде /profile главного администратора
+    application.add_handler(CommandHandler('profile', profile_command))
+
+    # Переключение страниц списков маршрутов и тикетов
+    application.add_handler(CallbackQueryHandler(handle_page_callback, pattern='^page_'))
+
+    # Обработчик для всех остальных сообщений
+    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, unauthorized))
+
+    # Обертка обработчиков для /profile: пока профилирование выключено, она только передает вызов
+    profiler.instrument(application)
+    return application
+
+# Режим нескольких воркеров: основной процесс получает обновления и распределяет их
+# по воркерам по ID чата, состояние воркеры синхронизируют через общее хранилище
+
+# Общее хранилище — источник истины для тикетов, белого списка и ролей: оставшееся в нем после прошлого
+# запуска (в том числе изменения, которые первый воркер не успел записать) объединяется с файлами,
+# и файлы перезаписываются. Белый список и роли в старом формате (один ключ '') тоже читаются
+def merge_shared_store(store):
+    for data in store.all('ticket'):
+        apply_ticket_data(data)
+    stored_whitelist = store.all('whitelist')
+    if stored_whitelist:
+        whitelist.clear()
+        for data in stored_whitelist:
+            whitelist.update(data if isinstance(data, list) else [data])
+    stored_roles = store.all('whitelist_roles')
+    if stored_roles:
+        whitelist_roles.clear()
+        for data in stored_roles:
+            if isinstance(data, dict):
+                whitelist_roles.update({int(user_id): role for user_id, role in data.items()})
+            else:
+                whitelist_roles[data[0]] = data[1]
+    save_tickets(tickets)
+    save_whitelist(whitelist)
+    save_whitelist_roles(whitelist_roles)
+
+# Заполнение общего хранилища текущими данными из файлов перед запуском воркеров
+def seed_shared_store(store):
+    for future in (
+        store.replace_all('route', []),
+        store.replace_all('ticket', [(ticket['id'], ticket) for ticket in tickets]),
+        store.replace_all('whitelist', [(user_id, user_id) for user_id in whitelist]),
+        store.replace_all('whitelist_roles', [(user_id, [user_id, role]) for user_id, role in whitelist_roles.items()]),
+        store.reset_workers(),
+    ):
+        future.result()
+
+# Чтение состояния из общего хранилища (в потоке)
+def read_shared_state():
+    store = sync.shared_store
+    return store.all('route'), store.all('ticket'), store.all('whitelist'), store.all('whitelist_roles')
+
+# Применение прочитанного состояния. Локальные маршруты, которых в хранилище уже нет, забываются;
+# маршруты, заблокированные здесь, не трогаются — их локальная копия новее
+def load_shared_state(state):
+    stored_routes, stored_tickets, stored_whitelist, stored_roles = state
+    stored_ids = {data['driver_id'] for data in stored_routes}
+    for driver_id in list(routes):
+        if driver_id not in stored_ids and not is_route_locked(driver_id):
+            route_lifecycle.forget(driver_id)
+    for data in stored_routes:
+        if not is_route_locked(data['driver_id']):
+            apply_route_data(data)
+    for data in stored_tickets:
+        apply_ticket_data(data)
+    whitelist.clear()
+    whitelist.update(stored_whitelist)
+    whitelist_roles.clear()
+    whitelist_roles.update(stored_roles)
+    stats.init_tickets(tickets)
+
+def is_route_locked(driver_id):
+    lock = route_locks.get(driver_id)
+    return lock is not None and lock.locked()
+
+# Воркер отстал от журнала дальше, чем журнал хранится (записи после его позиции удалены):
+# состояние перечитывается из файлов и общего хранилища целиком. Возвращает новую позицию в журнале
+async def resync_worker_state():
+    logger.warning(f"Воркер {sync.worker_index} отстал от журнала изменений, состояние перечитывается")
+    last_change_id = await asyncio.to_thread(sync.shared_store.last_change_id)
+    # Статистика перечитывается из файла, поэтому сначала записываются еще не сохраненные события
+    flush_stats()
+    await load_state()
+    if keyring.loaded:
+        keyring.load()
+    load_shared_state(await asyncio.to_thread(read_shared_state))
+    return last_change_id
+
+# Применение изменений других воркеров из журнала общего хранилища; прочитанная позиция
+# сообщается хранилищу, чтобы фронт удалял из журнала только прочитанные всеми записи
+async def sync_worker_state(last_change_id):
+    reported_change_id = last_change_id
+    while True:
+        await asyncio.sleep(WORKER_SYNC_INTERVAL)
+        try:
+            changes = await asyncio.to_thread(sync.shared_store.changes_since, last_change_id)
+            if changes is None:
+                last_change_id = await resync_worker_state()
+                changes = []
+        except sqlite3.Error:
+            logger.exception("Не удалось прочитать журнал изменений")
+            continue
+        for change_id, kind, key, data, worker in changes:
+            last_change_id = change_id
+            if worker == sync.worker_index:
+                continue
+            try:
+                apply_remote_change(kind, key, json.loads(data))
+            except Exception:
+                logger.exception(f"Не удалось применить изменение {change_id}")
+        if last_change_id != reported_change_id:
+            sync.shared_store.set_cursor(sync.worker_index, last_change_id)
+            reported_change_id = last_change_id
+
+async def worker_loop(application, worker_queue, last_change_id):
+    async with application:
+        # Без Updater приложение не вызывает post_init само; общее хранилище новее файлов
+        await post_init(application)
+        load_shared_state(await asyncio.to_thread(read_shared_state))
+        await application.start()
+        sync_task = asyncio.create_task(sync_worker_state(last_change_id))
+        try:
+            while True:
+                data = await asyncio.to_thread(worker_queue.get)
+                if data is None:
+                    break
+                await application.update_queue.put(Update.de_json(data, application.bot))
+        finally:
+            sync_task.cancel()
+            await application.stop()
+            flush_stats()
+
+def run_worker(index, worker_queue):
+    sync.worker_index = index
+    sync.shared_store = SharedStore(SHARED_STORE_FILE)
+    # Журнал читается с момента до загрузки состояния, чтобы не пропустить изменения
+    last_change_id = sync.shared_store.last_change_id()
+    sync.shared_store.set_cursor(index, last_change_id).result()
+    # Чаты закреплены за воркерами, поэтому у каждого воркера свой файл сессий
+    application = build_application(persistence_file=f"{PERSISTENCE_FILE}.{index}", with_updater=False)
+    asyncio.run(worker_loop(application, worker_queue, last_change_id))
+
+async def front_loop(store, worker_queues):
+    bot = Bot(telegram_bot_token, base_url=TELEGRAM_API_URL)
+    offset = None
+    last_prune = time.monotonic()
+    async with bot:
+        # Вебхук, оставшийся от прежнего запуска в режиме вебхука, блокирует getUpdates (ошибка Conflict)
+        await bot.delete_webhook()
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except Exception:
+                logger.exception("Ошибка при получении обновлений")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                key = update_ordering_key(update) or 0
+                worker_queues[abs(key) % len(worker_queues)].put(update.to_dict())
+            if time.monotonic() - last_prune > 60:
+                store.prune_changes(max_keep=100000)
+                last_prune = time.monotonic()
+
+def run_front(workers):
+    store = SharedStore(SHARED_STORE_FILE)
+    asyncio.run(load_state())
+    # Набор ключей создается до запуска воркеров, чтобы при первом запуске или переходе со старого ключа
+    # все воркеры прочитали один и тот же файл ключей
+    keyring.get()
+    merge_shared_store(store)
+    seed_shared_store(store)
+    worker_queues = [multiprocessing.Queue() for _ in range(workers)]
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(index, worker_queue), daemon=True)
+        for index, worker_queue in enumerate(worker_queues)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено воркеров: {workers}")
+    try:
+        asyncio.run(front_loop(store, worker_queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker_queue in worker_queues:
+            worker_queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
+
+# Главная функция
+def main():
+    workers = int(os.environ.get('BOT_WORKERS', 1))
+    # Фронт получает обновления только опросом getUpdates, поэтому вебхук с воркерами не поддерживается
+    if workers > 1 and TELEGRAM_WEBHOOK_URL:
+        raise SystemExit("Режим вебхука (TELEGRAM_WEBHOOK_URL) не поддерживается вместе с BOT_WORKERS > 1")
+    if workers > 1:
+        run_front(workers)
+    elif TELEGRAM_WEBHOOK_URL:
+        build_application().run_webhook(
+            listen=TELEGRAM_WEBHOOK_LISTEN,
+            port=TELEGRAM_WEBHOOK_PORT,
+            url_path=urlsplit(TELEGRAM_WEBHOOK_URL).path.lstrip('/'),
+            webhook_url=TELEGRAM_WEBHOOK_URL
+        )
+    else:
+        build_application().run_polling()
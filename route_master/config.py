@@ -0,0 +1,228 @@
+# Настройки бота: переменные окружения, константы и состояния диалогов
+import os
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    filename='bot_activity.log',
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Получение API ключей
+api_key = os.environ.get('GOOGLE_MAPS_API_KEY') or 'YOUR_GOOGLE_MAPS_API_KEY'
+telegram_bot_token = os.environ.get('TELEGRAM_BOT_TOKEN') or 'YOUR_TELEGRAM_BOT_TOKEN'
+
+if not api_key:
+    raise ValueError("Необходимо установить переменную окружения GOOGLE_MAPS_API_KEY.")
+
+if not telegram_bot_token:
+    raise ValueError("Необходимо установить переменную окружения TELEGRAM_BOT_TOKEN.")
+
+# Адреса Bot API и скачивания файлов (например, локальный сервер Bot API или фиктивный сервер для нагрузочного тестирования)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_FILE_URL = os.environ.get('TELEGRAM_FILE_URL', 'https://api.telegram.org/file/bot')
+# Вебхук: если адрес задан, обновления принимаются на нем вместо опроса getUpdates
+TELEGRAM_WEBHOOK_URL = os.environ.get('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_LISTEN = os.environ.get('TELEGRAM_WEBHOOK_LISTEN', '0.0.0.0')
+TELEGRAM_WEBHOOK_PORT = int(os.environ.get('TELEGRAM_WEBHOOK_PORT', 8443))
+
+# Таймауты клиента Google Maps (секунды): ограничивают время ожидания обработчиков
+MAPS_REQUEST_TIMEOUT = float(os.environ.get('MAPS_REQUEST_TIMEOUT', 5))
+MAPS_RETRY_TIMEOUT = float(os.environ.get('MAPS_RETRY_TIMEOUT', 10))
+
+# Максимальное число промежуточных точек в одном запросе Directions API и
+# число одновременных запросов при планировании больших маршрутов по частям
+MAPS_MAX_WAYPOINTS = int(os.environ.get('MAPS_MAX_WAYPOINTS', 25))
+MAPS_PARALLEL_REQUESTS = int(os.environ.get('MAPS_PARALLEL_REQUESTS', 4))
+
+# Настройки предохранителя (circuit breaker) для Google Maps
+MAPS_FAILURE_THRESHOLD = int(os.environ.get('MAPS_FAILURE_THRESHOLD', 3))
+MAPS_RESET_TIMEOUT = float(os.environ.get('MAPS_RESET_TIMEOUT', 60))
+
+# Параметры оценки времени в пути без Google Maps
+FALLBACK_SPEED_KMH = float(os.environ.get('FALLBACK_SPEED_KMH', 35))
+FALLBACK_DETOUR_FACTOR = float(os.environ.get('FALLBACK_DETOUR_FACTOR', 1.4))
+
+# Файлы ключей шифрования: прежний единственный ключ Fernet и версионированный набор ключей
+ENCRYPTION_KEY_FILE = 'encryption_key.key'
+ENCRYPTION_KEYS_FILE = os.environ.get('ENCRYPTION_KEYS_FILE', 'encryption_keys.json')
+# Алгоритм для новых ключей: aesgcm или chacha20poly1305
+ENCRYPTION_CIPHER = os.environ.get('ENCRYPTION_CIPHER', 'aesgcm')
+# Размер пакета при перешифровании сохраненных данных после смены ключа
+REENCRYPT_BATCH_SIZE = int(os.environ.get('REENCRYPT_BATCH_SIZE', 200))
+
+# Определение состояний
+(
+    CHOOSING_ROLE,
+    WAITING_FOR_LOCATION,
+    ENTERING_PASSWORD,
+    CONTACTING_SUPPORT,
+    SELECTING_PRIORITY,
+    BROADCASTING,
+    ADDING_USER,
+    REMOVING_USER,
+    VIEWING_TICKET_DETAILS,
+    TICKET_ACTION,
+    REPLYING_TO_TICKET,
+    POST_REPLY_ACTION,
+    CHANGING_TICKET_STATUS,
+    VIEWING_ROUTE_DETAILS,
+    EDITING_ROUTE,
+    SHARING_LOCATION,
+    IMPORTING_USERS,
+    CONFIRMING_IMPORT
+) = range(18)
+
+# Локация рабочего места (широта, долгота)
+workplace_location = "51.155406,71.4101"
+
+# Максимальная длительность маршрута (часы)
+MAX_ROUTE_HOURS = 2
+
+# Поля времени в пути: пункты назначения ("имя=широта,долгота;..."), зона обслуживания
+# ("мин. широта,мин. долгота,макс. широта,макс. долгота"), шаг сетки (метры),
+# временные интервалы (часы начала), час ночного пересчета и за сколько дней архива берутся точки.
+# Запрашиваются только ячейки, где за эти дни начинались маршруты или садились пассажиры:
+# стоимость пересчета — (число таких ячеек) x (число интервалов) платных элементов Distance Matrix
+# на пункт назначения за ночь. Вся зона по умолчанию (около 2200 ячеек по 1 км) стоила бы ~11 тыс. элементов
+TRAVEL_TIME_DESTINATIONS = dict(
+    item.split('=', 1) for item in os.environ.get('TRAVEL_TIME_DESTINATIONS', f"workplace={workplace_location}").split(';') if item
+)
+TRAVEL_TIME_AREA = [float(value) for value in os.environ.get('TRAVEL_TIME_AREA', '50.95,71.05,51.35,71.75').split(',')]
+TRAVEL_TIME_GRID_STEP = float(os.environ.get('TRAVEL_TIME_GRID_STEP', 1000))
+TRAVEL_TIME_BANDS = [int(hour) for hour in os.environ.get('TRAVEL_TIME_BANDS', '6,9,13,17,21').split(',')]
+TRAVEL_TIME_REFRESH_HOUR = int(os.environ.get('TRAVEL_TIME_REFRESH_HOUR', 3))
+TRAVEL_TIME_HISTORY_DAYS = int(os.environ.get('TRAVEL_TIME_HISTORY_DAYS', 30))
+TRAVEL_TIME_DIR = os.environ.get('TRAVEL_TIME_DIR', 'travel_time_fields')
+# Запас на неточность сетки: маршрут отклоняется сразу, если нижняя оценка больше лимита с учетом запаса
+TRAVEL_TIME_MARGIN = float(os.environ.get('TRAVEL_TIME_MARGIN', 0.9))
+
+# Кэш маршрутов: файл (заполняется прогревом перед сменой), срок годности записей (секунды),
+# максимальное число планов в памяти и число остановок, до которого порядок по кэшированному
+# времени в пути перебирается точно (для больших маршрутов — ближайший сосед)
+ROUTE_CACHE_FILE = os.environ.get('ROUTE_CACHE_FILE', 'route_cache.json')
+ROUTE_CACHE_TTL = float(os.environ.get('ROUTE_CACHE_TTL', 4 * 3600))
+ROUTE_CACHE_MAX_PLANS = 5000
+ROUTE_CACHE_EXACT_STOPS = 8
+
+# Прогрев перед сменой: начало смен (местное время "ЧЧ:ММ" через запятую), за сколько минут до смены
+# запускается прогрев, за сколько дней берутся маршруты из архива и ограничения на число элементов
+# Distance Matrix и геокодирований за один прогрев
+SHIFT_START_TIMES = [item.strip() for item in os.environ.get('SHIFT_START_TIMES', '07:00').split(',') if item.strip()]
+WARMUP_LEAD_MINUTES = int(os.environ.get('WARMUP_LEAD_MINUTES', 45))
+WARMUP_HISTORY_DAYS = int(os.environ.get('WARMUP_HISTORY_DAYS', 1))
+WARMUP_MAX_MATRIX_ELEMENTS = int(os.environ.get('WARMUP_MAX_MATRIX_ELEMENTS', 2000))
+WARMUP_MAX_GEOCODES = int(os.environ.get('WARMUP_MAX_GEOCODES', 200))
+
+# Модель времени в пути по записанным поездкам: каталог журналов поездок, файл модели,
+# размер ячейки (метры) и интервал обучения (секунды)
+TRIP_TRACES_DIR = os.environ.get('TRIP_TRACES_DIR', 'trip_traces')
+TRAVEL_MODEL_FILE = os.environ.get('TRAVEL_MODEL_FILE', 'travel_model.json')
+TRAVEL_MODEL_CELL_SIZE = float(os.environ.get('TRAVEL_MODEL_CELL_SIZE', 500))
+TRAVEL_MODEL_INTERVAL = float(os.environ.get('TRAVEL_MODEL_INTERVAL', 3600))
+# Отрезки между отметками: максимальный разрыв (секунды) и допустимая скорость (м/с),
+# стоянки и выбросы GPS не учитываются
+TRAVEL_MODEL_MAX_GAP = 120
+TRAVEL_MODEL_SPEED_RANGE = (1.0, 40.0)
+# Скорость ячейки используется, если по ней набрано не меньше минуты езды
+TRAVEL_MODEL_MIN_SECONDS = 60
+# Модель заменяет Distance Matrix, если ее ячейки покрывают большую часть пути, а средняя ошибка
+# ее прогнозов по фактическим прибытиям не больше порога (секунды)
+TRAVEL_MODEL_MIN_COVERAGE = float(os.environ.get('TRAVEL_MODEL_MIN_COVERAGE', 0.8))
+TRAVEL_MODEL_MIN_ARRIVALS = int(os.environ.get('TRAVEL_MODEL_MIN_ARRIVALS', 30))
+TRAVEL_MODEL_MAX_ERROR = float(os.environ.get('TRAVEL_MODEL_MAX_ERROR', 180))
+
+# Справочник адресов: файл с адресами, успешно найденными через геокодирование,
+# необязательный файл для импорта (строки "адрес;широта,долгота"; адреса без координат
+# геокодируются при прогреве перед сменой) и число подсказок
+GAZETTEER_FILE = os.environ.get('GAZETTEER_FILE', 'gazetteer.json')
+GAZETTEER_IMPORT_FILE = os.environ.get('GAZETTEER_IMPORT_FILE')
+GAZETTEER_SUGGESTIONS = 5
+
+# Профилирование обработчиков по команде /profile: каталог результатов, доля профилируемых
+# обновлений в режиме cProfile и интервал снятия стеков в режиме выборки (секунды)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.1))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+
+# Пароли для ролей
+ROLE_PASSWORDS = {
+    'администратор': '',  # Замените на ваш пароль администратора
+    'водитель': '',      # Замените на пароль для водителей
+    'пассажир': ''    # Замените на пароль для пассажиров
+}
+
+# ID главного администратора
+MAIN_ADMIN_ID =   # Замените на ваш Telegram ID
+
+# Файл для хранения белого списка
+WHITELIST_FILE = 'whitelist.json'
+# Файл ролей, назначенных пользователям при массовом импорте белого списка
+WHITELIST_ROLES_FILE = os.environ.get('WHITELIST_ROLES_FILE', 'whitelist_roles.json')
+# Максимальный размер файла для импорта белого списка (байты)
+WHITELIST_IMPORT_MAX_SIZE = 1024 * 1024
+# Написания ролей в файле импорта
+ROLE_ALIASES = {
+    'администратор': 'администратор', 'админ': 'администратор', 'admin': 'администратор',
+    'водитель': 'водитель', 'driver': 'водитель',
+    'пассажир': 'пассажир', 'passenger': 'пассажир',
+}
+
+# Файл для хранения тикетов поддержки
+TICKETS_FILE = 'tickets.json'
+
+# Максимальное количество одновременно обрабатываемых обновлений
+MAX_CONCURRENT_UPDATES = int(os.environ.get('MAX_CONCURRENT_UPDATES', 64))
+
+# Режим нескольких воркеров: общее хранилище состояния и период синхронизации (секунды)
+SHARED_STORE_FILE = os.environ.get('SHARED_STORE_FILE', 'shared_state.db')
+WORKER_SYNC_INTERVAL = float(os.environ.get('WORKER_SYNC_INTERVAL', 0.2))
+# Каталог архива завершенных маршрутов
+ROUTE_ARCHIVE_DIR = os.environ.get('ROUTE_ARCHIVE_DIR', 'route_archive')
+# Выгрузка истории для аналитики (/export_history): период по умолчанию (дни) и каталог временных файлов
+EXPORT_DEFAULT_DAYS = int(os.environ.get('EXPORT_DEFAULT_DAYS', 30))
+EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+# Максимальный размер документа, который бот может отправить через Bot API (байты)
+TELEGRAM_DOCUMENT_MAX_SIZE = 50 * 1024 * 1024
+# Маршрут без изменений дольше этого времени (секунды) завершается и уходит в архив
+ROUTE_IDLE_TTL = float(os.environ.get('ROUTE_IDLE_TTL', 6 * 3600))
+# Период проверки простаивающих маршрутов (секунды)
+ROUTE_EVICTION_INTERVAL = float(os.environ.get('ROUTE_EVICTION_INTERVAL', 300))
+# Радиус (метры), в пределах которого соседние точки посадки объединяются в одну остановку
+STOP_CLUSTER_RADIUS = float(os.environ.get('STOP_CLUSTER_RADIUS', 150))
+
+# Расстояние до пункта назначения (метры), на котором маршрут считается выполненным
+ROUTE_ARRIVAL_RADIUS = float(os.environ.get('ROUTE_ARRIVAL_RADIUS', 200))
+
+# Максимальное время удержания межпроцессной блокировки маршрута (секунды)
+ROUTE_LEASE_TIMEOUT = float(os.environ.get('ROUTE_LEASE_TIMEOUT', 60))
+
+# Файл для хранения сессий пользователей и состояний диалогов между перезапусками
+PERSISTENCE_FILE = os.environ.get('PERSISTENCE_FILE', 'bot_persistence.pickle')
+# Интервал (секунды) периодической записи сессий на диск
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get('PERSISTENCE_FLUSH_INTERVAL', 60))
+
+# Файл для хранения статистики для отчетов
+STATS_FILE = 'stats.json'
+
+# Сколько хранить почасовые и посуточные агрегаты статистики
+STATS_HOURLY_RETENTION = 7 * 24
+STATS_DAILY_RETENTION = 180
+
+# Возможные статусы и приоритеты тикетов
+TICKET_STATUSES = ['Ожидает ответа', 'В работе', 'Закрыт']
+TICKET_PRIORITIES = ['Низкий', 'Средний', 'Высокий']
+
+# Количество элементов на одной странице списков
+PAGE_SIZE = 10
+
+# Очередь разбора тикетов: через сколько секунд тикет, взятый администратором через /next_ticket,
+# возвращается в очередь, и сроки ответа (секунды) по приоритетам, после которых тикет без ответа
+# передается главному администратору
+TRIAGE_CLAIM_TIMEOUT = float(os.environ.get('TRIAGE_CLAIM_TIMEOUT', 1800))
+TICKET_SLA = {'Высокий': float(os.environ.get('TICKET_SLA_HIGH', 1800))}
+
+# Максимальное количество результатов поиска по тикетам
+SEARCH_MAX_RESULTS = 200
@@ -0,0 +1,167 @@
+# Шифрование данных: версионированный набор ключей
+import os
+import base64
+import json
+import fcntl
+import struct
+import contextlib
+from .config import ENCRYPTION_CIPHER, ENCRYPTION_KEYS_FILE, ENCRYPTION_KEY_FILE
+from .lazy import Lazy
+
+# Алгоритмы AEAD, доступные для новых ключей (cryptography импортируется при первом обращении к ключам)
+def aead_ciphers():
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+    return {
+        'aesgcm': (AESGCM, lambda: AESGCM.generate_key(bit_length=256)),
+        'chacha20poly1305': (ChaCha20Poly1305, ChaCha20Poly1305.generate_key),
+    }
+
+# Набор версионированных ключей. Новые данные шифруются текущим ключом в формате "v<версия>.<данные>",
+# старые токены Fernet без версии расшифровываются всеми ключами Fernet через MultiFernet
+class KeyRing:
+    VERSION = struct.Struct('<I')
+
+    def __init__(self, path, legacy_path, cipher):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.cipher = cipher
+        self.load()
+
+    # Межпроцессная блокировка файла ключей: воркеры, одновременно создающие набор или добавляющие ключ,
+    # иначе получили бы разные ключи с одним номером версии
+    @contextlib.contextmanager
+    def locked(self):
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            with self.locked():
+                # Набор мог создать другой процесс, пока ожидали блокировку
+                if not os.path.exists(self.path):
+                    self.create()
+        self.read()
+        self._build()
+
+    def read(self):
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        self.keys = {int(version): key for version, key in data['keys'].items()}
+        self.current = data['current']
+
+    # Первый запуск с набором ключей: прежний ключ Fernet становится версией 1
+    def create(self):
+        self.keys = {}
+        self.current = 0
+        if os.path.exists(self.legacy_path):
+            with open(self.legacy_path, 'rb') as f:
+                self.keys[1] = {'algorithm': 'fernet', 'key': f.read().decode()}
+            self.current = 1
+        self.add_key()
+
+    def _build(self):
+        from cryptography.fernet import Fernet, MultiFernet
+        ciphers = aead_ciphers()
+        self.aeads = {}
+        fernets = []
+        for version, key in sorted(self.keys.items(), reverse=True):
+            if key['algorithm'] == 'fernet':
+                fernets.append(Fernet(key['key'].encode()))
+            else:
+                cipher_class, _ = ciphers[key['algorithm']]
+                self.aeads[version] = cipher_class(base64.urlsafe_b64decode(key['key']))
+        self.legacy = MultiFernet(fernets) if fernets else None
+
+    def save(self):
+        data = {'current': self.current, 'keys': {str(version): key for version, key in self.keys.items()}}
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.chmod(temp_path, 0o600)
+        os.replace(temp_path, self.path)
+
+    def add_key(self):
+        _, generate_key = aead_ciphers()[self.cipher]
+        version = max(self.keys, default=0) + 1
+        self.keys[version] = {'algorithm': self.cipher, 'key': base64.urlsafe_b64encode(generate_key()).decode()}
+        self.current = version
+        self.save()
+        return version
+
+    # Добавление нового ключа; он сразу становится текущим. Номер версии выбирается по файлу,
+    # перечитанному под блокировкой, — ключ мог добавить другой процесс
+    def rotate(self):
+        with self.locked():
+            self.read()
+            version = self.add_key()
+        self._build()
+        return version
+
+    def encrypt(self, data):
+        nonce = os.urandom(12)
+        prefix = f"v{self.current}"
+        ciphertext = self.aeads[self.current].encrypt(nonce, data, prefix.encode())
+        return f"{prefix}.{base64.urlsafe_b64encode(nonce + ciphertext).decode()}"
+
+    # Двоичный формат для компактных журналов: версия ключа (4 байта), nonce и шифротекст без base64
+    def encrypt_bytes(self, data):
+        nonce = os.urandom(12)
+        header = self.VERSION.pack(self.current)
+        return header + nonce + self.aeads[self.current].encrypt(nonce, data, header)
+
+    # Шифр для версии ключа; неизвестная даже после перечитывания файла версия — такая же ошибка,
+    # как и поврежденный токен
+    def aead(self, version):
+        from cryptography.fernet import InvalidToken
+        if version not in self.aeads:
+            # Ключ мог быть добавлен другим процессом
+            self.load()
+        if version not in self.aeads:
+            raise InvalidToken(f"Неизвестная версия ключа шифрования: {version}")
+        return self.aeads[version]
+
+    def decrypt_bytes(self, frame):
+        header, nonce, ciphertext = frame[:4], frame[4:16], frame[16:]
+        (version,) = self.VERSION.unpack(header)
+        return self.aead(version).decrypt(nonce, ciphertext, header)
+
+    def decrypt(self, token):
+        from cryptography.fernet import InvalidToken
+        prefix, separator, payload = token.partition('.')
+        if not separator:
+            if self.legacy is None:
+                raise InvalidToken("Токен без версии, а старых ключей Fernet нет")
+            return self.legacy.decrypt(token.encode())
+        if not prefix[1:].isdigit():
+            raise InvalidToken(f"Некорректная версия ключа шифрования: {prefix}")
+        version = int(prefix[1:])
+        raw = base64.urlsafe_b64decode(payload)
+        return self.aead(version).decrypt(raw[:12], raw[12:], prefix.encode())
+
+    def is_current(self, token):
+        return token.startswith(f"v{self.current}.")
+
+# Набор ключей читается (или создается) при первом шифровании или расшифровке
+keyring = Lazy(lambda: KeyRing(ENCRYPTION_KEYS_FILE, ENCRYPTION_KEY_FILE, ENCRYPTION_CIPHER))
+
+# Функция шифрования данных
+def encrypt_data(data):
+    if data:
+        return keyring.encrypt(data.encode())
+    return None
+
+def decrypt_data(encrypted_data):
+    if encrypted_data:
+        return keyring.decrypt(encrypted_data).decode()
+    return None
+
+# Шифрование набора связанных значений одной записью (например, всех точек маршрута)
+def encrypt_record(record):
+    return keyring.encrypt(json.dumps(record).encode())
+
+def decrypt_record(token):
+    return json.loads(keyring.decrypt(token))
@@ -0,0 +1,110 @@
+# Выгрузка истории маршрутов и тикетов для аналитики: записи читаются генераторами
+# и сразу пишутся в CSV внутри zip-архива, поэтому в памяти одновременно одна запись
+import io
+import os
+import csv
+import zipfile
+import datetime
+from .config import EXPORT_DEFAULT_DAYS
+from .routes import route_archive
+
+ROUTE_COLUMNS = [
+    'driver_id', 'created_at', 'finished_at', 'completed_at', 'arrived_at', 'status', 'passengers', 'stops',
+    'planned_duration_min', 'actual_duration_min'
+]
+STOP_COLUMNS = ['driver_id', 'created_at', 'stop_number', 'latitude', 'longitude', 'passengers', 'passenger_ids', 'eta']
+TICKET_COLUMNS = [
+    'id', 'timestamp', 'user_id', 'user_name', 'priority', 'status', 'escalated', 'message', 'admin_reply'
+]
+
+def parse_date(text):
+    for date_format in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    raise ValueError(text)
+
+# Период выгрузки из аргументов команды: [с] [по] (включительно); по умолчанию — последние EXPORT_DEFAULT_DAYS дней.
+# Возвращает полуинтервал [начало, конец)
+def parse_date_range(args):
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    start = parse_date(args[0]) if args else today - datetime.timedelta(days=EXPORT_DEFAULT_DAYS - 1)
+    end = parse_date(args[1]) if len(args) > 1 else today
+    if end < start:
+        raise ValueError(args)
+    return start, end + datetime.timedelta(days=1)
+
+def minutes_between(start, end):
+    if not start or not end:
+        return ''
+    seconds = (datetime.datetime.fromisoformat(end) - datetime.datetime.fromisoformat(start)).total_seconds()
+    return round(seconds / 60, 1)
+
+# Фактическая длительность — от завершения набора до прибытия в пункт назначения; у маршрутов,
+# завершенных по простою или администратором (и у архивных записей без времени прибытия), она пустая
+def route_row(data):
+    return [
+        data['driver_id'], data['created_at'], data.get('finished_at') or '', data['completed_at'],
+        data.get('arrived_at') or '', data['status'], len(data['passenger_ids']), len(data['stops']),
+        round(data['planned_duration'] / 60, 1) if data.get('planned_duration') else '',
+        minutes_between(data.get('finished_at'), data.get('arrived_at')),
+    ]
+
+def stop_rows(data):
+    for number, stop in enumerate(data['stops'], 1):
+        latitude, longitude = stop['location'].split(',')
+        yield [
+            data['driver_id'], data['created_at'], number, latitude, longitude, len(stop['passenger_ids']),
+            ' '.join(map(str, stop['passenger_ids'])), data['eta'].get(stop['location']) or '',
+        ]
+
+def iter_ticket_rows(tickets, start, end):
+    for ticket in tickets:
+        if not start <= datetime.datetime.fromisoformat(ticket['timestamp']) < end:
+            continue
+        yield [
+            ticket['id'], ticket['timestamp'], ticket['user_id'], ticket.get('user_name') or '',
+            ticket.get('priority') or '', ticket['status'], 'да' if ticket.get('escalated') else '',
+            ticket['message'], ticket.get('admin_reply') or '',
+        ]
+
+# CSV-файл внутри архива, записываемый потоково (UTF-8 с BOM, чтобы Excel открыл кириллицу)
+def open_csv(archive, name, columns):
+    stream = io.TextIOWrapper(archive.open(name, 'w'), encoding='utf-8-sig', newline='')
+    writer = csv.writer(stream)
+    writer.writerow(columns)
+    return stream, writer
+
+# Запись выгрузки в zip-файл: routes.csv (маршрут на строку), route_stops.csv (остановка на строку)
+# и tickets.csv. Маршруты читаются из архива один раз: маршрут и его остановки пишутся в два файла сразу,
+# поэтому файлы внутри zip сжимаются во временные файлы на диске, а не в память
+def write_history_export(path, start, end, tickets):
+    counts = {'routes': 0, 'stops': 0, 'tickets': 0, 'skipped': []}
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        routes_path, stops_path = f"{path}.routes.csv", f"{path}.stops.csv"
+        try:
+            with open(routes_path, 'w', encoding='utf-8-sig', newline='') as routes_file, \
+                    open(stops_path, 'w', encoding='utf-8-sig', newline='') as stops_file:
+                routes_writer, stops_writer = csv.writer(routes_file), csv.writer(stops_file)
+                routes_writer.writerow(ROUTE_COLUMNS)
+                stops_writer.writerow(STOP_COLUMNS)
+                for data in route_archive.iter_routes(start, end, counts['skipped']):
+                    routes_writer.writerow(route_row(data))
+                    counts['routes'] += 1
+                    for row in stop_rows(data):
+                        stops_writer.writerow(row)
+                        counts['stops'] += 1
+            archive.write(routes_path, 'routes.csv')
+            archive.write(stops_path, 'route_stops.csv')
+        finally:
+            for temp_path in (routes_path, stops_path):
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        stream, writer = open_csv(archive, 'tickets.csv', TICKET_COLUMNS)
+        with stream:
+            for row in iter_ticket_rows(tickets, start, end):
+                writer.writerow(row)
+                counts['tickets'] += 1
+    return counts
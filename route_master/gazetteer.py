@@ -0,0 +1,150 @@
+# Справочник адресов
+import re
+import json
+from . import sync
+from .config import GAZETTEER_FILE, GAZETTEER_IMPORT_FILE, GAZETTEER_SUGGESTIONS, logger
+from .crypto import decrypt_record, encrypt_record
+from .geo import parse_coordinates
+from .sync import publish_change
+from .storage import write_json_atomic
+
+# Слова в адресах: сокращения приводятся к одному написанию, тип улицы и "дом" отбрасываются
+# (адрес часто вводят без них)
+ADDRESS_ABBREVIATIONS = {
+    'улица': '', 'ул': '', 'проспект': '', 'просп': '', 'пр': '', 'переулок': '', 'пер': '',
+    'бульвар': '', 'шоссе': '', 'дом': '', 'д': '',
+    'микрорайон': 'мкр', 'мкрн': 'мкр', 'жилой': 'жк', 'комплекс': '',
+}
+
+# Нормализация адреса: нижний регистр, без знаков препинания, сокращения в едином виде
+def normalize_address(address):
+    text = address.lower().replace('ё', 'е').replace('пр-т', 'проспект')
+    words = [ADDRESS_ABBREVIATIONS.get(word, word) for word in re.findall(r'[0-9a-zа-я]+', text)]
+    return ' '.join(word for word in words if word)
+
+# Справочник адресов: префиксное дерево по нормализованным адресам с поиском по префиксу
+# и с учетом опечаток (расстояние Левенштейна). Файл справочника зашифрован одной записью
+class Gazetteer:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # нормализованный адрес -> [адрес, координаты]
+        self.root = {}  # узел: символ -> дочерний узел, '' -> нормализованный адрес
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = decrypt_record(json.load(f)['record'])
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = {}
+        for key, (address, location) in entries.items():
+            self.add(address, location, key)
+
+    def save(self):
+        write_json_atomic(self.path, {'record': encrypt_record(self.entries)})
+
+    # Импорт списка адресов; возвращает число добавленных адресов
+    def import_file(self, path):
+        added = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                address, separator, location = line.strip().rpartition(';')
+                if separator and address and normalize_address(address) not in self.entries:
+                    parse_coordinates(location)
+                    self.add(address, location.strip())
+                    added += 1
+        return added
+
+    # Адреса из файла импорта без координат, которых еще нет в справочнике
+    def pending_addresses(self, path):
+        pending = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                address = line.strip()
+                if address and ';' not in address and normalize_address(address) not in self.entries:
+                    pending.append(address)
+        return list(dict.fromkeys(pending))
+
+    def add(self, address, location, key=None):
+        key = key or normalize_address(address)
+        if not key:
+            return
+        self.entries[key] = [address, location]
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[''] = key
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    # Адреса, начинающиеся с префикса
+    def prefix(self, key, limit):
+        node = self.root
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                return []
+        found, stack = [], [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            if '' in node:
+                found.append(node[''])
+            stack.extend(reversed([child for char, child in node.items() if char]))
+        return found
+
+    # Адреса на расстоянии Левенштейна не больше max_distance: строки таблицы расстояний считаются
+    # при обходе дерева, ветви, где все значения строки больше порога, отсекаются
+    def fuzzy(self, key, max_distance):
+        found = []
+        stack = [(child, char, list(range(len(key) + 1))) for char, child in self.root.items() if char]
+        while stack:
+            node, char, previous_row = stack.pop()
+            row = [previous_row[0] + 1]
+            for column in range(1, len(key) + 1):
+                row.append(min(row[column - 1] + 1, previous_row[column] + 1, previous_row[column - 1] + (key[column - 1] != char)))
+            if row[-1] <= max_distance and '' in node:
+                found.append((row[-1], node['']))
+            if min(row) <= max_distance:
+                stack.extend((child, next_char, row) for next_char, child in node.items() if next_char)
+        return [candidate for _, candidate in sorted(found)]
+
+    # Поиск адреса: (координаты, None) при однозначном совпадении, иначе (None, варианты для подсказки).
+    # Опечатка исправляется автоматически, только если номера домов совпадают
+    def resolve(self, address):
+        key = normalize_address(address)
+        if key in self.entries:
+            return self.entries[key][1], []
+        numbers = re.findall(r'\d+', key)
+        typos = self.fuzzy(key, 1 if len(key) <= 5 else 2)
+        same_numbers = [candidate for candidate in typos if re.findall(r'\d+', candidate) == numbers]
+        if len(same_numbers) == 1:
+            return self.entries[same_numbers[0]][1], []
+        candidates = list(dict.fromkeys(same_numbers + self.prefix(key, GAZETTEER_SUGGESTIONS) + typos))
+        return None, candidates[:GAZETTEER_SUGGESTIONS]
+
+def load_gazetteer(gazetteer):
+    gazetteer.load()
+    if GAZETTEER_IMPORT_FILE:
+        try:
+            added = gazetteer.import_file(GAZETTEER_IMPORT_FILE)
+            logger.info(f"Импортировано адресов в справочник: {added}")
+        except (OSError, ValueError):
+            logger.exception("Не удалось импортировать справочник адресов")
+
+# Запоминание адреса, найденного через геокодирование; в режиме нескольких воркеров
+# адрес рассылается остальным процессам, а файл пишет только первый воркер
+def remember_address(address, location):
+    gazetteer.add(address, location)
+    save_gazetteer()
+    publish_change('gazetteer', None, [address, location])
+
+def save_gazetteer():
+    if sync.worker_index:
+        return
+    try:
+        gazetteer.save()
+    except OSError:
+        logger.exception("Не удалось сохранить справочник адресов")
+
+# Справочник (загружается при запуске, см. load_state)
+gazetteer = Gazetteer(GAZETTEER_FILE)
@@ -0,0 +1,50 @@
+# Геометрия: координаты, расстояния, сетки и ссылки на карты
+import math
+from .config import FALLBACK_DETOUR_FACTOR, FALLBACK_SPEED_KMH, STOP_CLUSTER_RADIUS
+
+# Ячейка сетки для кластеризации точек посадки: размер ячейки равен радиусу кластеризации
+def grid_cell(location):
+    latitude, longitude = parse_coordinates(location)
+    lat_step = max(STOP_CLUSTER_RADIUS, 1) / 111320
+    lng_step = lat_step / math.cos(math.radians(latitude))
+    return int(latitude // lat_step), int(longitude // lng_step)
+
+# Центр остановки — среднее координат точек посадки
+def centroid(points):
+    coordinates = [parse_coordinates(point) for point in points]
+    latitude = sum(lat for lat, _ in coordinates) / len(coordinates)
+    longitude = sum(lng for _, lng in coordinates) / len(coordinates)
+    return f"{latitude:.6f},{longitude:.6f}"
+
+# Преобразование строки "широта,долгота" в пару чисел
+def parse_coordinates(location_str):
+    latitude, longitude = location_str.split(',')
+    return float(latitude), float(longitude)
+
+# Расстояние между двумя точками по прямой (метры)
+def haversine_distance(point_a, point_b):
+    lat1, lng1 = parse_coordinates(point_a)
+    lat2, lng2 = parse_coordinates(point_b)
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+# Оценка времени в пути без Google Maps: расстояние по прямой с поправкой на извилистость дорог
+def estimate_travel_time(point_a, point_b):
+    distance = haversine_distance(point_a, point_b) * FALLBACK_DETOUR_FACTOR
+    return int(distance / (FALLBACK_SPEED_KMH * 1000 / 3600))
+
+# Функция для генерации ссылки на Яндекс.Карты с оптимизированными точками
+def generate_yandex_maps_link(origin, destination, pickup_locations):
+    points = [origin] + pickup_locations + [destination]
+    points_formatted = [point.replace(',', '%2C') for point in points]
+    points_str = '~'.join(points_formatted)
+    link = f"https://yandex.ru/maps/?rtext={points_str}&rtt=auto"
+    return link
+
+# Ссылка на точку на Яндекс.Картах
+def generate_point_link(location):
+    latitude, longitude = parse_coordinates(location)
+    return f"https://yandex.ru/maps/?pt={longitude},{latitude}&z=17&l=map"
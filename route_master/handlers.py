@@ -0,0 +1,1757 @@
+# Обработчики команд и сообщений Telegram
+import io
+import os
+import asyncio
+import json
+import uuid
+import math
+import itertools
+import time
+import datetime
+from telegram.ext import ConversationHandler
+from telegram import (
+    ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, Update
+)
+from telegram.constants import ParseMode
+from . import sync
+from .config import (
+    ADDING_USER, BROADCASTING, CHANGING_TICKET_STATUS, CHOOSING_ROLE, CONFIRMING_IMPORT,
+    CONTACTING_SUPPORT, EDITING_ROUTE, ENTERING_PASSWORD, EXPORT_DEFAULT_DAYS, EXPORT_DIR,
+    IMPORTING_USERS, MAIN_ADMIN_ID, MAX_ROUTE_HOURS, PAGE_SIZE, POST_REPLY_ACTION,
+    REENCRYPT_BATCH_SIZE, REMOVING_USER, REPLYING_TO_TICKET, ROLE_PASSWORDS, ROUTE_ARRIVAL_RADIUS,
+    ROUTE_IDLE_TTL, SEARCH_MAX_RESULTS, SELECTING_PRIORITY, TELEGRAM_DOCUMENT_MAX_SIZE,
+    TICKET_ACTION, TICKET_SLA, TICKET_STATUSES, TRAVEL_TIME_MARGIN, VIEWING_ROUTE_DETAILS,
+    VIEWING_TICKET_DETAILS, WAITING_FOR_LOCATION, WHITELIST_IMPORT_MAX_SIZE, logger,
+    workplace_location
+)
+from .crypto import decrypt_record, encrypt_record, keyring
+from .geo import estimate_travel_time, generate_point_link, generate_yandex_maps_link, haversine_distance
+from .sync import publish_change, publish_ticket
+from .storage import (
+    apply_whitelist_import, format_whitelist_csv, index_ticket, needs_triage, open_tickets_index,
+    parse_whitelist_file, save_tickets, ticket_search, tickets, tickets_by_id, triage_queue,
+    unindex_open_ticket, update_whitelist, update_whitelist_roles, whitelist, whitelist_diff, whitelist_roles
+)
+from .stats import flush_stats, stats
+from .maps import (
+    MapsUnavailable, call_maps, get_coordinates, gmaps, optimize_route, plan_route,
+    route_duration_lower_bound
+)
+from .trips import travel_model, trip_recorder
+from .gazetteer import gazetteer, remember_address
+from .profiling import control_profiler, profiler
+from .export import parse_date_range, write_history_export
+from .routes import (
+    ROUTE_ACTIVE, ROUTE_STATUS_NAMES, Route, get_route_lock, route_archive, route_lifecycle, routes
+)
+
+# Функция логирования действий
+def log_action(user_id, action):
+    logger.info(f"Пользователь {user_id}: {action}")
+
+# Обработчики команд
+
+# Команда /start
+async def start(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту. Обратитесь к администратору для получения доступа.")
+        return ConversationHandler.END
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    if not is_authorized:
+        await login(update, context)
+        return CHOOSING_ROLE
+
+    user_role = context.user_data.get('role')
+    if user_role == 'водитель':
+        await update.message.reply_text(
+            "Пожалуйста, отправьте ваше местоположение или введите адрес для начала маршрута.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return WAITING_FOR_LOCATION
+    elif user_role == 'пассажир':
+        await update.message.reply_text(
+            "Пожалуйста, отправьте ваше местоположение или введите адрес для присоединения к маршруту.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return WAITING_FOR_LOCATION
+    elif user_role == 'администратор':
+        await update.message.reply_text(
+            "Вы вошли как администратор. Используйте команды для управления ботом.",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return ConversationHandler.END
+
+# Авторизация пользователя
+async def login(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту. Обратитесь к администратору для получения доступа.")
+        return ConversationHandler.END
+
+    keyboard = [
+        [InlineKeyboardButton("Админ", callback_data='role_администратор')],
+        [InlineKeyboardButton("Водитель", callback_data='role_водитель')],
+        [InlineKeyboardButton("Пассажир", callback_data='role_пассажир')],
+        [InlineKeyboardButton("Написать поддержке", callback_data='role_support')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(
+        "Выберите роль, под которой хотите войти:",
+        reply_markup=reply_markup
+    )
+    return CHOOSING_ROLE
+
+# Выбор роли и запрос пароля
+async def choose_role_login(update, context):
+    query = update.callback_query
+    await query.answer()
+    data = query.data
+    if data == 'role_support':
+        await query.edit_message_text(
+            "Пожалуйста, опишите вашу проблему, и мы свяжемся с вами как можно скорее.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data='back_to_login')]])
+        )
+        return CONTACTING_SUPPORT
+    else:
+        role = data.split('_')[1]
+        if role not in ROLE_PASSWORDS:
+            await query.edit_message_text("Роль введена некорректно. Попробуйте снова.")
+            return CHOOSING_ROLE
+        assigned_role = whitelist_roles.get(update.effective_user.id)
+        if assigned_role and role != assigned_role and update.effective_user.id != MAIN_ADMIN_ID:
+            await query.edit_message_text(
+                f"Вам назначена роль '{assigned_role}'.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(assigned_role.capitalize(), callback_data=f'role_{assigned_role}')]])
+            )
+            return CHOOSING_ROLE
+        context.user_data['role'] = role
+        await query.edit_message_text(
+            f"Введите пароль для роли '{role}':",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Назад", callback_data='back_to_login')]])
+        )
+        return ENTERING_PASSWORD
+
+# Обработка нажатия "Назад"
+async def back_to_login(update, context):
+    await login(update, context)
+    return CHOOSING_ROLE
+
+# Проверка пароля и завершение авторизации
+async def check_password(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        return await login(update, context)
+    else:
+        user_role = context.user_data.get('role')
+        password = user_input
+        if password == ROLE_PASSWORDS[user_role]:
+            context.user_data['is_authorized'] = True
+            user_id = update.effective_user.id
+            if user_id == MAIN_ADMIN_ID and user_role == 'администратор':
+                context.user_data['is_main_admin'] = True
+                await update.message.reply_text("Вы успешно вошли как главный администратор!", reply_markup=ReplyKeyboardRemove())
+            else:
+                context.user_data['is_main_admin'] = False
+                await update.message.reply_text(f"Вы успешно вошли как '{user_role}'.", reply_markup=ReplyKeyboardRemove())
+            log_action(user_id, f"Вошел как {user_role}")
+            return await start(update, context)
+        else:
+            await update.message.reply_text("Неверный пароль. Попробуйте снова.")
+            return ENTERING_PASSWORD
+
+# Обработка обращения в поддержку
+async def contacting_support(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        return await login(update, context)
+    else:
+        context.user_data['support_message'] = user_input
+        keyboard = [
+            [InlineKeyboardButton("Низкий", callback_data='priority_Низкий')],
+            [InlineKeyboardButton("Средний", callback_data='priority_Средний')],
+            [InlineKeyboardButton("Высокий", callback_data='priority_Высокий')],
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text("Выберите приоритет вашего обращения:", reply_markup=reply_markup)
+        return SELECTING_PRIORITY
+
+# Выбор приоритета тикета
+async def selecting_priority(update, context):
+    query = update.callback_query
+    await query.answer()
+    priority = query.data.split('_')[1]
+    user = update.effective_user
+    ticket_id = str(uuid.uuid4())
+    timestamp = datetime.datetime.now().isoformat()
+    ticket = {
+        'id': ticket_id,
+        'user_id': user.id,
+        'user_name': user.username,
+        'message': context.user_data['support_message'],
+        'timestamp': timestamp,
+        'status': 'Ожидает ответа',
+        'priority': priority,
+        'admin_reply': None
+    }
+    tickets.append(ticket)
+    save_tickets(tickets)
+    index_ticket(ticket)
+    ticket_search.add(ticket)
+    publish_ticket(ticket)
+    stats.ticket_created()
+    schedule_ticket_sla(context.job_queue, ticket)
+    admin_id = MAIN_ADMIN_ID
+    try:
+        await context.bot.send_message(
+            chat_id=admin_id,
+            text=f"Новое обращение в поддержку с приоритетом '{priority}'. Используйте команду /view_tickets для просмотра."
+        )
+        await query.edit_message_text(
+            "Спасибо! Ваше сообщение отправлено в поддержку."
+        )
+        log_action(user.id, f"Отправил обращение в поддержку с приоритетом '{priority}'")
+    except Exception as e:
+        logger.error(f"Не удалось отправить уведомление администратору: {e}")
+        await query.edit_message_text(
+            "Произошла ошибка при отправке вашего сообщения. Пожалуйста, попробуйте позже."
+        )
+    return ConversationHandler.END
+
+# Обработка местоположения пользователя
+async def waiting_for_location(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту. Обратитесь к администратору для получения доступа.")
+        return ConversationHandler.END
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    if not is_authorized:
+        await unauthorized(update, context)
+        return ConversationHandler.END
+
+    if update.message.location:
+        latitude = update.message.location.latitude
+        longitude = update.message.location.longitude
+        location_str = f"{latitude},{longitude}"
+    elif update.message.text:
+        address = update.message.text
+        # Сначала справочник адресов, геокодирование — только для новых адресов
+        location_str, candidates = gazetteer.resolve(address)
+        if candidates:
+            context.user_data['address_query'] = address
+            context.user_data['address_candidates'] = candidates
+            keyboard = [[InlineKeyboardButton(gazetteer.get(key)[0], callback_data=f"address_{index}")] for index, key in enumerate(candidates)]
+            keyboard.append([InlineKeyboardButton("Другой адрес (искать на карте)", callback_data="address_geocode")])
+            await update.message.reply_text("Уточните адрес:", reply_markup=InlineKeyboardMarkup(keyboard))
+            return WAITING_FOR_LOCATION
+        if not location_str:
+            location_str = await geocode_address(address)
+        if not location_str:
+            await update.message.reply_text("Не удалось получить координаты по указанному адресу. Пожалуйста, попробуйте еще раз.")
+            return WAITING_FOR_LOCATION
+    else:
+        await update.message.reply_text("Пожалуйста, отправьте ваше местоположение или введите адрес.")
+        return WAITING_FOR_LOCATION
+
+    return await dispatch_location(update, context, location_str)
+
+# Геокодирование нового адреса; найденный адрес попадает в справочник
+async def geocode_address(address):
+    location_str = await asyncio.to_thread(get_coordinates, address)
+    if location_str:
+        remember_address(address, location_str)
+    return location_str
+
+# Выбор адреса из подсказок справочника
+async def choose_address(update, context):
+    query = update.callback_query
+    await query.answer()
+    address = context.user_data.pop('address_query', None)
+    candidates = context.user_data.pop('address_candidates', [])
+    if address is None:
+        return WAITING_FOR_LOCATION
+    await query.edit_message_reply_markup(reply_markup=None)
+
+    choice = query.data[len('address_'):]
+    if choice == 'geocode':
+        location_str = await geocode_address(address)
+    else:
+        location_str = gazetteer.get(candidates[int(choice)])[1]
+    if not location_str:
+        await query.message.reply_text("Не удалось получить координаты по указанному адресу. Пожалуйста, попробуйте еще раз.")
+        return WAITING_FOR_LOCATION
+    return await dispatch_location(update, context, location_str)
+
+# Передача точки обработчику роли
+async def dispatch_location(update, context, location_str):
+    user_role = context.user_data.get('role')
+    if user_role == 'водитель':
+        await handle_driver_location(update, context, location_str)
+    elif user_role == 'пассажир':
+        await handle_passenger_location(update, context, location_str)
+    elif user_role == 'администратор':
+        await update.effective_message.reply_text("Администратор не может использовать эту команду.")
+        return ConversationHandler.END
+    else:
+        await update.effective_message.reply_text("Произошла ошибка. Попробуйте начать сначала с команды /start.")
+        return ConversationHandler.END
+
+    return ConversationHandler.END
+
+# Обработка местоположения водителя
+async def handle_driver_location(update, context, location_str):
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    user_id = update.effective_user.id
+    if not is_authorized or user_role != 'водитель':
+        await unauthorized(update, context)
+        return
+
+    driver_id = user_id
+    route = Route(driver_id=driver_id, origin=location_str)
+    async with get_route_lock(driver_id):
+        route_lifecycle.create(route)
+
+    await update.effective_message.reply_text(
+        "Вы создали маршрут и ожидаете пассажиров.\n"
+        "Когда будете готовы, отправьте команду /finish, чтобы завершить набор пассажиров и получить маршрут."
+    )
+    log_action(user_id, "Создал новый маршрут")
+
+# Обработка местоположения пассажира
+async def handle_passenger_location(update, context, location_str):
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    user_id = update.effective_user.id
+    if not is_authorized or user_role != 'пассажир':
+        await unauthorized(update, context)
+        return
+
+    route = route_lifecycle.first_open()
+    if not route:
+        await update.effective_message.reply_text("В данный момент нет доступных маршрутов.")
+        return
+
+    # Заведомо невыполнимое добавление отклоняем по полю времени в пути, без запроса к Google Maps
+    lower_bound = route_duration_lower_bound([route.origin, location_str])
+    if lower_bound and lower_bound * TRAVEL_TIME_MARGIN > MAX_ROUTE_HOURS * 3600:
+        await update.effective_message.reply_text(f"К сожалению, добавление вашего местоположения увеличит время маршрута более чем до {MAX_ROUTE_HOURS} часов. Вы не можете быть добавлены в этот маршрут.")
+        return
+
+    async with get_route_lock(route.driver_id) as lock:
+        # Маршрут мог быть закрыт, завершен или заменен, пока ожидали блокировку
+        if lock.route is not route or not route.is_open:
+            await update.effective_message.reply_text("В данный момент нет доступных маршрутов.")
+            return
+
+        # Соседние точки посадки объединяются в одну остановку
+        temp_stop_locations = route.stop_locations_with(location_str)
+
+        _, total_duration = await asyncio.to_thread(
+            optimize_route,
+            origin=route.origin,
+            destination=workplace_location,
+            pickup_locations=temp_stop_locations
+        )
+
+        if total_duration:
+            total_duration_hours = total_duration / 3600
+            if total_duration_hours > MAX_ROUTE_HOURS:
+                await update.effective_message.reply_text(f"К сожалению, добавление вашего местоположения увеличит время маршрута более чем до {MAX_ROUTE_HOURS} часов. Вы не можете быть добавлены в этот маршрут.")
+                return
+            else:
+                route.add_passenger(location_str, user_id)
+                await update.effective_message.reply_text("Вы успешно добавлены в маршрут. Чтобы отменить поездку, отправьте /leave.")
+                log_action(user_id, f"Присоединился к маршруту {route.driver_id}")
+        else:
+            await update.effective_message.reply_text("Не удалось определить длительность маршрута. Пожалуйста, попробуйте позже.")
+
+# Завершение маршрута водителем
+async def finish_route(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту. Обратитесь к администратору для получения доступа.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+
+    if user_role != 'водитель':
+        await no_permissions(update, context)
+        return
+
+    driver_id = user_id
+
+    if driver_id in routes:
+        async with get_route_lock(driver_id) as lock:
+            # Маршрут мог быть завершен или заменен, пока ожидали блокировку
+            route = lock.route
+            if route and route.is_open:
+                route_lifecycle.finish(route)
+
+                # Оптимизируем маршрут по остановкам и получаем оптимизированный порядок
+                plan = await asyncio.to_thread(
+                    plan_route,
+                    origin=route.origin,
+                    destination=workplace_location,
+                    pickup_locations=route.stop_locations
+                )
+                waypoint_order = plan['order']
+                total_duration = plan['duration']
+
+                # Сохраняем порядок; остановки и списки пассажиров переставляются в порядке маршрута
+                route.reorder_stops(waypoint_order)
+                route.pickup_order = waypoint_order
+                route.planned_polyline = plan['polyline']
+                route.next_stop_index = 0  # Начинаем с первой остановки в порядке
+
+                route.planned_duration = total_duration
+                stats.route_finished(route, total_duration)
+
+                if total_duration:
+                    total_duration_hours = total_duration / 3600
+                    duration_str = f"Общая длительность маршрута: {total_duration_hours:.2f} часов."
+                else:
+                    duration_str = "Не удалось определить общую длительность маршрута."
+
+                yandex_maps_link = generate_yandex_maps_link(
+                    origin=route.origin,
+                    destination=workplace_location,
+                    pickup_locations=route.stop_locations
+                )
+
+                await update.message.reply_text(
+                    f"Вы завершили набор пассажиров. {duration_str}\nВот ваш оптимизированный маршрут на Яндекс.Картах:\n{yandex_maps_link}\n\n"
+                    "Пожалуйста, поделитесь вашим живым местоположением, чтобы мы могли рассчитывать ожидаемое время прибытия.\n"
+                    "Если пассажир не пришел на остановку, отправьте /no_show."
+                )
+
+                for stop in route.stops:
+                    text = "Маршрут сформирован. Водитель скоро свяжется с вами."
+                    if len(stop['passenger_ids']) > 1:
+                        # Общая остановка может не совпадать с точкой, которую указал пассажир
+                        text += f"\nТочка сбора: {generate_point_link(stop['location'])}"
+                    for passenger_id in stop['passenger_ids']:
+                        try:
+                            await context.bot.send_message(chat_id=passenger_id, text=text)
+                        except Exception as e:
+                            logger.error(f"Не удалось отправить сообщение пассажиру {passenger_id}: {e}")
+                log_action(user_id, "Завершил маршрут")
+            elif route:
+                await update.message.reply_text("Вы уже завершили набор пассажиров.")
+            else:
+                await update.message.reply_text("У вас нет активного маршрута.")
+    else:
+        await update.message.reply_text("У вас нет активного маршрута.")
+
+# Исключение пассажира из маршрута (вызывается под блокировкой маршрута): удаление остановки,
+# локальная доводка порядка, сброс ETA затронутых остановок и пересчет ETA до следующей остановки.
+# Возвращает новую ссылку на Яндекс.Карты для водителя или None, если набор еще идет
+async def drop_passenger(route, passenger_id, context):
+    index, removed = route.remove_passenger(passenger_id)
+    if route.is_open:
+        return None
+    stats.passenger_removed()
+
+    changed_from = index
+    if removed:
+        repaired = route.repair_order(index, workplace_location)
+        if repaired is not None:
+            changed_from = min(changed_from, repaired)
+    for stop in route.stops[changed_from:]:
+        route.eta.pop(stop['location'], None)
+    if route.current_location and changed_from <= route.next_stop_index:
+        await update_driver_eta(route, context)
+
+    return generate_yandex_maps_link(
+        origin=route.current_location or route.origin,
+        destination=workplace_location,
+        pickup_locations=route.stop_locations[route.next_stop_index:]
+    )
+
+# Команда /leave: пассажир отменяет поездку
+async def leave_route(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту. Обратитесь к администратору для получения доступа.")
+        return
+
+    if not context.user_data.get('is_authorized', False):
+        await unauthorized(update, context)
+        return
+    if context.user_data.get('role') != 'пассажир':
+        await no_permissions(update, context)
+        return
+
+    route = next((route for route in routes.values() if user_id in route.passenger_ids), None)
+    if not route:
+        await update.message.reply_text("Вы не состоите ни в одном маршруте.")
+        return
+
+    async with get_route_lock(route.driver_id) as lock:
+        index = route.stop_index_of(user_id) if lock.route is route else None
+        if index is None:
+            await update.message.reply_text("Вы не состоите ни в одном маршруте.")
+            return
+        if index < route.next_stop_index:
+            await update.message.reply_text("Водитель уже забрал вас, отменить поездку нельзя.")
+            return
+        link = await drop_passenger(route, user_id, context)
+
+    await update.message.reply_text("Вы покинули маршрут.")
+    text = f"Пассажир {user_id} отменил поездку."
+    if link:
+        text += f"\nОбновленный маршрут на Яндекс.Картах:\n{link}"
+    try:
+        await context.bot.send_message(chat_id=route.driver_id, text=text)
+    except Exception as e:
+        logger.error(f"Не удалось отправить сообщение водителю {route.driver_id}: {e}")
+    log_action(user_id, f"Покинул маршрут {route.driver_id}")
+
+# Команда /no_show: водитель отмечает пассажиров следующей остановки, которые не пришли
+async def no_show(update, context):
+    user_id = update.effective_user.id
+    if not context.user_data.get('is_authorized', False):
+        await unauthorized(update, context)
+        return
+    if context.user_data.get('role') != 'водитель':
+        await no_permissions(update, context)
+        return
+
+    route = routes.get(user_id)
+    if not route or route.is_open:
+        await update.message.reply_text("Команда доступна после завершения набора пассажиров.")
+        return
+    if route.next_stop_index >= len(route.stops):
+        await update.message.reply_text("Все пассажиры уже забраны.")
+        return
+
+    stop = route.stops[route.next_stop_index]
+    keyboard = [
+        [InlineKeyboardButton(f"Пассажир {passenger_id} не пришел", callback_data=f"noshow_{passenger_id}")]
+        for passenger_id in stop['passenger_ids']
+    ]
+    await update.message.reply_text("Отметьте пассажиров, которые не пришли:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def handle_no_show(update, context):
+    query = update.callback_query
+    await query.answer()
+    driver_id = query.from_user.id
+    passenger_id = int(query.data[len('noshow_'):])
+
+    route = routes.get(driver_id)
+    if not route:
+        await query.edit_message_text("У вас нет активного маршрута.")
+        return
+    async with get_route_lock(driver_id) as lock:
+        if lock.route is not route:
+            await query.edit_message_text("У вас нет активного маршрута.")
+            return
+        index = route.stop_index_of(passenger_id)
+        if index is None or index < route.next_stop_index:
+            await query.edit_message_text("Пассажир уже не ожидает в этом маршруте.")
+            return
+        link = await drop_passenger(route, passenger_id, context)
+
+    text = f"Пассажир {passenger_id} отмечен как не пришедший."
+    if link:
+        text += f"\nОбновленный маршрут на Яндекс.Картах:\n{link}"
+    await query.edit_message_text(text)
+    try:
+        await context.bot.send_message(chat_id=passenger_id, text="Водитель не дождался вас на остановке. Вы исключены из маршрута.")
+    except Exception as e:
+        logger.error(f"Не удалось отправить сообщение пассажиру {passenger_id}: {e}")
+    log_action(driver_id, f"Отметил неявку пассажира {passenger_id}")
+
+# Обработчик для неавторизованных пользователей
+async def unauthorized(update, context):
+    await update.effective_message.reply_text(
+        "Вы не авторизованы. Пожалуйста, используйте команду /login для авторизации.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+
+# Обработчик для недостатка прав
+async def no_permissions(update, context):
+    await update.message.reply_text(
+        "У вас нет прав для использования этой команды.",
+        reply_markup=ReplyKeyboardRemove()
+    )
+
+# Обработчик для получения живого местоположения водителя
+async def handle_live_location(update, context):
+    user_id = update.effective_user.id
+    user_role = context.user_data.get('role')
+
+    if user_role != 'водитель':
+        return  # Обрабатываем только сообщения от водителей
+
+    current_location = None
+
+    if update.message and update.message.location:
+        # Первое сообщение с местоположением или обновление
+        current_location = update.message.location
+    elif update.edited_message and update.edited_message.location:
+        # Обновление живого местоположения
+        current_location = update.edited_message.location
+
+    if current_location:
+        route = routes.get(user_id)
+        if route:
+            async with get_route_lock(route.driver_id) as lock:
+                # Маршрут мог быть завершен или заменен новым, пока ожидали блокировку
+                route = lock.route
+                if not route:
+                    return
+                route.current_location = f"{current_location.latitude},{current_location.longitude}"
+                route_lifecycle.activate(route)
+                trip_recorder.record(route, current_location.latitude, current_location.longitude)
+                await update_driver_eta(route, context)
+        else:
+            await update.effective_chat.send_message("У вас нет активного маршрута.")
+    else:
+        # Игнорируем другие сообщения
+        pass
+
+
+# Функция для обновления ETA и уведомления пассажиров (вызывается под блокировкой маршрута)
+async def update_driver_eta(route, context):
+    if not route.current_location:
+        return  # Нет текущего местоположения водителя
+
+    # Проверяем, есть ли еще остановки
+    if route.next_stop_index >= len(route.stops):
+        # Все пассажиры уже забраны: по прибытии в пункт назначения маршрут выполнен
+        if route.status == ROUTE_ACTIVE and haversine_distance(route.current_location, workplace_location) <= ROUTE_ARRIVAL_RADIUS:
+            route_lifecycle.complete(route, arrived=True)
+            try:
+                await context.bot.send_message(chat_id=route.driver_id, text="Вы прибыли в пункт назначения. Маршрут завершен.")
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение водителю {route.driver_id}: {e}")
+            log_action(route.driver_id, "Маршрут выполнен")
+        return
+
+    # Берем следующую остановку
+    next_stop = route.stops[route.next_stop_index]
+    next_pickup_coordinates = next_stop['location']
+    stop_passenger_ids = next_stop['passenger_ids']
+
+    eta_seconds, distance_meters, source = await asyncio.to_thread(get_eta_to_point, route, next_pickup_coordinates)
+    if eta_seconds is None:
+        route.eta[next_pickup_coordinates] = None
+        return
+
+    try:
+        eta_time = datetime.datetime.now() + datetime.timedelta(seconds=eta_seconds)
+        # Сохраняем ETA
+        route.eta[next_pickup_coordinates] = eta_time.isoformat()
+        track_eta_prediction(route, eta_time, source)
+
+        if distance_meters <= 50:  # Расстояние менее 50 метров
+            # Считаем, что пассажиры остановки забраны
+            record_eta_accuracy(route)
+            route.next_stop_index += 1
+            route.notified_passengers.difference_update(stop_passenger_ids)
+            # Опционально: Уведомить водителя, что пассажиры забраны
+            await context.bot.send_message(
+                chat_id=route.driver_id,
+                text=f"Вы прибыли к остановке пассажиров {', '.join(map(str, stop_passenger_ids))}. Переходим к следующей остановке."
+            )
+        elif eta_seconds <= 300:
+            # Уведомляем пассажиров остановки, которых еще не предупредили
+            minutes = eta_seconds // 60
+            for passenger_id in stop_passenger_ids:
+                if passenger_id not in route.notified_passengers:
+                    await context.bot.send_message(
+                        chat_id=passenger_id,
+                        text=f"Водитель прибудет через {minutes} минут(ы). Пожалуйста, готовьтесь выйти."
+                    )
+                    route.notified_passengers.add(passenger_id)
+    except Exception as e:
+        logger.exception("Ошибка при обновлении ETA")
+
+# Первый прогноз прибытия к следующей остановке. Оценка модели поездок сохраняется и тогда,
+# когда ETA взято из другого источника, чтобы сравнивать точность источников
+def track_eta_prediction(route, eta_time, source):
+    key = str(route.next_stop_index)
+    if key in route.eta_predictions:
+        return
+    predictions = {source: eta_time.isoformat()}
+    if source != 'model':
+        model_seconds = travel_model.covered_estimate(route.current_location, route.stops[route.next_stop_index]['location'])
+        if model_seconds is not None:
+            predictions['model'] = (datetime.datetime.now() + datetime.timedelta(seconds=model_seconds)).isoformat()
+    route.eta_predictions[key] = predictions
+
+# Прибытие к остановке: ошибка первого прогноза каждого источника
+def record_eta_accuracy(route):
+    predictions = route.eta_predictions.pop(str(route.next_stop_index), {})
+    now = datetime.datetime.now()
+    for source, predicted in predictions.items():
+        error = (now - datetime.datetime.fromisoformat(predicted)).total_seconds()
+        travel_model.record_accuracy(source, error)
+
+# Расчет ETA, расстояния до точки и источника оценки: по модели поездок, если она покрывает путь
+# и подтвердила точность, иначе через Google Maps Distance Matrix API,
+# а в резервном режиме — по последнему известному ETA или локальной оценке
+def get_eta_to_point(route, target):
+    if travel_model.trusted:
+        model_seconds = travel_model.covered_estimate(route.current_location, target)
+        if model_seconds is not None:
+            return model_seconds, haversine_distance(route.current_location, target), 'model'
+
+    try:
+        distance_matrix = call_maps(
+            gmaps.distance_matrix,
+            origins=[route.current_location],
+            destinations=[target],
+            mode="driving",
+            departure_time="now"
+        )
+
+        if distance_matrix['status'] == 'OK':
+            element = distance_matrix['rows'][0]['elements'][0]
+            if element['status'] == 'OK':
+                return element['duration_in_traffic']['value'], element['distance']['value'], 'maps'
+            return None, None, None
+        logger.error("Ошибка при получении Distance Matrix")
+    except MapsUnavailable:
+        pass
+    except Exception as e:
+        logger.exception("Ошибка при получении Distance Matrix")
+
+    distance_meters = haversine_distance(route.current_location, target)
+    last_eta = route.eta.get(target)
+    if last_eta:
+        remaining = (datetime.datetime.fromisoformat(last_eta) - datetime.datetime.now()).total_seconds()
+        if remaining > 0:
+            return int(remaining), distance_meters, 'fallback'
+    return estimate_travel_time(route.current_location, target), distance_meters, 'fallback'
+
+# Команда /show_eta для водителя
+async def show_eta(update, context):
+    user_id = update.effective_user.id
+    user_role = context.user_data.get('role')
+
+    if user_role != 'водитель':
+        await update.message.reply_text("Эта команда доступна только водителям.")
+        return
+
+    route = routes.get(user_id)
+    if not route:
+        await update.message.reply_text("У вас нет активного маршрута.")
+        return
+
+    if not route.current_location:
+        await update.message.reply_text("ETA еще не рассчитано.")
+        return
+
+    # К следующей остановке — последний рассчитанный ETA, дальше по цепочке — оценка модели поездок
+    # на время прибытия к предыдущей точке (без запросов к API)
+    arrival = datetime.datetime.now()
+    previous = route.current_location
+    next_eta = route.eta.get(route.stops[route.next_stop_index]['location']) if route.next_stop_index < len(route.stops) else None
+    message = "Ожидаемое время прибытия к точкам:\n"
+    for index, stop in enumerate(route.stops):
+        passengers = ', '.join(map(str, stop['passenger_ids']))
+        if index < route.next_stop_index:
+            message += f"Пассажиры {passengers}: забраны\n"
+            continue
+        if index == route.next_stop_index and next_eta:
+            arrival = max(arrival, datetime.datetime.fromisoformat(next_eta))
+        else:
+            arrival += datetime.timedelta(seconds=travel_model.estimate(previous, stop['location'], arrival)[0])
+        previous = stop['location']
+        message += f"Пассажиры {passengers}: {arrival.strftime('%H:%M:%S')}\n"
+
+    # Добавляем ETA до места назначения
+    arrival += datetime.timedelta(seconds=travel_model.estimate(previous, workplace_location, arrival)[0])
+    message += f"Пункт назначения: {arrival.strftime('%H:%M:%S')}\n"
+
+    await update.message.reply_text(message)
+
+# Команды администратора
+async def admin_help(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    help_text = (
+        "Доступные команды администратора:\n"
+        "/list_routes - Показать все текущие маршруты\n"
+        "/broadcast - Отправить сообщение всем пользователям\n"
+        "/add_user - Добавить пользователя в белый список\n"
+        "/remove_user - Удалить пользователя из белого списка\n"
+        "/import_users - Загрузить белый список из файла\n"
+        "/export_users - Выгрузить белый список в файл\n"
+        "/view_tickets - Просмотреть обращения в поддержку\n"
+        "/search_tickets - Найти обращения по тексту\n"
+        "/next_ticket - Взять самое срочное обращение из очереди\n"
+        "/reports - Создать отчет\n"
+        "/export_history - Выгрузить историю маршрутов и обращений (только главный администратор)\n"
+        "/rotate_key - Сменить ключ шифрования (только главный администратор)\n"
+        "/profile - Профилирование обработчиков (только главный администратор)\n"
+        "/help - Показать это сообщение"
+    )
+    await update.message.reply_text(help_text)
+
+# Форматирование агрегатов статистики за период
+def format_stats_period(period):
+    average_duration = (
+        f"{period['duration_sum'] / period['duration_count'] / 3600:.2f} ч"
+        if period['duration_count'] else "нет данных"
+    )
+    average_response = (
+        f"{period['response_sum'] / period['response_count'] / 60:.0f} мин"
+        if period['response_count'] else "нет данных"
+    )
+    return (
+        f"Создано маршрутов: {period['routes_created']}, завершено: {period['routes_finished']}\n"
+        f"Перевезено пассажиров: {period['passengers']}\n"
+        f"Средняя плановая длительность: {average_duration}\n"
+        f"Новых тикетов: {period['tickets_created']}, закрыто: {period['tickets_closed']}\n"
+        f"Среднее время ответа на тикет: {average_response}"
+    )
+
+ETA_SOURCE_NAMES = {'maps': 'Google Maps', 'model': 'Модель поездок', 'fallback': 'Резервная оценка'}
+
+# Средняя ошибка и смещение прогнозов по источникам ETA (смещение > 0 — водитель приезжает позже прогноза)
+def format_eta_accuracy():
+    lines = []
+    for source, name in ETA_SOURCE_NAMES.items():
+        count, abs_sum, error_sum = travel_model.accuracy.get(source, (0, 0, 0))
+        if count:
+            lines.append(
+                f"{name}: ошибка {abs_sum / count / 60:.1f} мин, смещение {error_sum / count / 60:+.1f} мин, прибытий: {count}"
+            )
+    if not lines:
+        return "Нет данных"
+    if travel_model.trusted:
+        lines.append("Модель поездок используется вместо Distance Matrix")
+    return '\n'.join(lines)
+
+# Создание отчета
+async def generate_reports(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    total_tickets = stats.tickets_total
+    open_tickets = stats.tickets_open
+    closed_tickets = total_tickets - open_tickets
+
+    # Выполненные маршруты хранятся в архиве и учитываются в агрегатах по периодам
+    total_routes = len(routes)
+    open_routes = len(route_lifecycle.open_routes)
+    in_progress_routes = total_routes - open_routes
+
+    report_message = (
+        f"📊 **Отчет**\n\n"
+        f"**Тикеты поддержки**:\n"
+        f"Всего тикетов: {total_tickets}\n"
+        f"Открытые тикеты: {open_tickets}\n"
+        f"Закрытые тикеты: {closed_tickets}\n\n"
+        f"**Маршруты**:\n"
+        f"Текущие маршруты: {total_routes}\n"
+        f"Идет набор пассажиров: {open_routes}\n"
+        f"Набор завершен или в пути: {in_progress_routes}\n\n"
+        f"**За последние 24 часа**:\n"
+        f"{format_stats_period(stats.last_hours(24))}\n\n"
+        f"**По неделям**:\n"
+    )
+    for week in range(4):
+        title = "Текущая неделя" if week == 0 else f"{week} нед. назад"
+        report_message += f"{title}:\n{format_stats_period(stats.last_days(7, offset=week * 7))}\n"
+
+    report_message += f"\n**Точность ETA** (первый прогноз прибытия к остановке):\n{format_eta_accuracy()}\n"
+
+    await update.message.reply_text(report_message, parse_mode=ParseMode.MARKDOWN)
+
+# Постраничный вывод списков: отрисовывается только запрошенная страница,
+# навигация — инлайн-кнопками с редактированием того же сообщения
+class Paginator:
+    def __init__(self, name, title, count, fetch, format_item, page_size=PAGE_SIZE):
+        self.name = name
+        self.title = title
+        self.count = count  # Количество элементов
+        self.fetch = fetch  # Элементы в диапазоне [start, stop)
+        self.format_item = format_item
+        self.page_size = page_size
+
+    def render(self, page):
+        total = self.count()
+        pages = max(1, math.ceil(total / self.page_size))
+        page = min(max(page, 0), pages - 1)
+        start = page * self.page_size
+        items = self.fetch(start, start + self.page_size)
+        text = f"{self.title} ({start + 1}–{start + len(items)} из {total}):\n\n"
+        text += "\n\n".join(self.format_item(item) for item in items)
+
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️", callback_data=f"page_{self.name}_{page - 1}"))
+        buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="page_noop"))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton("▶️", callback_data=f"page_{self.name}_{page + 1}"))
+        return text, InlineKeyboardMarkup([buttons])
+
+def format_route_item(item):
+    driver_id, route = item
+    return f"ID маршрута: {driver_id}\nВодитель: {driver_id}\nПассажиров: {len(route.passenger_ids)}\nСтатус: {ROUTE_STATUS_NAMES[route.status]}"
+
+def format_ticket_item(ticket):
+    return f"ID: {ticket['id']}\nОт: @{ticket.get('user_name', 'NoUsername')}\nПриоритет: {ticket.get('priority', 'Не указан')}\nВремя: {ticket['timestamp']}"
+
+PAGINATORS = {
+    'routes': Paginator(
+        'routes', "Текущие маршруты",
+        count=lambda: len(routes),
+        fetch=lambda start, stop: list(itertools.islice(routes.items(), start, stop)),
+        format_item=format_route_item
+    ),
+    'tickets': Paginator(
+        'tickets', "Открытые тикеты",
+        count=lambda: len(open_tickets_index),
+        fetch=lambda start, stop: [tickets_by_id[key[2]] for key in open_tickets_index[start:stop]],
+        format_item=format_ticket_item
+    ),
+}
+
+def format_search_item(ticket):
+    message = ticket['message'] if len(ticket['message']) <= 100 else ticket['message'][:100] + "…"
+    return f"{format_ticket_item(ticket)}\nСтатус: {ticket['status']}\nСообщение: {message}"
+
+# Результаты поиска у каждого администратора свои: запрос и найденные ID хранятся в user_data
+def search_paginator(user_data):
+    query, ticket_ids = user_data.get('ticket_search', ('', []))
+    return Paginator(
+        'search', f"Результаты поиска «{query}»",
+        count=lambda: len(ticket_ids),
+        fetch=lambda start, stop: [tickets_by_id[ticket_id] for ticket_id in ticket_ids[start:stop] if ticket_id in tickets_by_id],
+        format_item=format_search_item
+    )
+
+# Переключение страниц списков
+async def handle_page_callback(update, context):
+    query = update.callback_query
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized or user_role != 'администратор':
+        await query.answer("У вас нет прав для использования этой команды.")
+        return
+
+    await query.answer()
+    if query.data == 'page_noop':
+        return
+    _, name, page = query.data.split('_')
+    paginator = search_paginator(context.user_data) if name == 'search' else PAGINATORS[name]
+    text, reply_markup = paginator.render(int(page))
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Не удалось обновить страницу списка: {e}")
+
+# Просмотр маршрутов
+async def list_routes(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    if routes:
+        text, reply_markup = PAGINATORS['routes'].render(0)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+        await update.message.reply_text(
+            "Введите ID маршрута для просмотра деталей или 'Назад' для возврата:",
+            reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+        )
+        return VIEWING_ROUTE_DETAILS
+    else:
+        await update.message.reply_text("Нет активных маршрутов.")
+
+# Просмотр деталей маршрута
+async def view_route_details(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        await update.message.reply_text("Возврат в главное меню.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+
+    try:
+        route_id = int(user_input)
+    except ValueError:
+        await update.message.reply_text("Некорректный ID маршрута. Пожалуйста, введите числовой ID или 'Назад' для возврата.")
+        return VIEWING_ROUTE_DETAILS
+
+    route = routes.get(route_id)
+    if not route:
+        await update.message.reply_text("Маршрут с таким ID не найден. Пожалуйста, введите корректный ID или 'Назад' для возврата.")
+        return VIEWING_ROUTE_DETAILS
+
+    route_info = (
+        f"ID маршрута: {route_id}\n"
+        f"Водитель: {route.driver_id}\n"
+        f"Пассажиры: {', '.join(map(str, route.passenger_ids))}\n"
+        f"Статус: {ROUTE_STATUS_NAMES[route.status]}\n"
+    )
+
+    reply_keyboard = [['Завершить маршрут', 'Назад']]
+    await update.message.reply_text(
+        route_info + "\n\nВыберите действие:",
+        reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
+    )
+    context.user_data['current_route_id'] = route_id
+    return EDITING_ROUTE
+
+# Редактирование маршрута
+async def edit_route(update, context):
+    user_input = update.message.text
+    route = routes.get(context.user_data.get('current_route_id'))
+    if user_input.lower() == 'назад':
+        return await list_routes(update, context)
+    elif not route:
+        await update.message.reply_text("Маршрут больше не существует.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    elif user_input == 'Завершить маршрут':
+        async with get_route_lock(route.driver_id) as lock:
+            if lock.route is route:
+                route_lifecycle.complete(route)
+        await update.message.reply_text("Маршрут завершен.", reply_markup=ReplyKeyboardRemove())
+        log_action(update.effective_user.id, f"Завершил маршрут {route.driver_id}")
+        return ConversationHandler.END
+    else:
+        await update.message.reply_text("Некорректный выбор. Пожалуйста, выберите действие из предложенных.")
+        return EDITING_ROUTE
+
+# Обработчики тикетов поддержки
+async def view_tickets(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    if not open_tickets_index:
+        await update.message.reply_text("Нет открытых тикетов.")
+        return ConversationHandler.END
+
+    text, reply_markup = PAGINATORS['tickets'].render(0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+    await update.message.reply_text(
+        "Введите ID тикета для просмотра деталей или 'Назад' для возврата:",
+        reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+    )
+    return VIEWING_TICKET_DETAILS
+
+# Команда /next_ticket: самый срочный тикет из очереди разбора закрепляется за администратором
+async def next_ticket(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    # Тикет, взятый ранее и не разобранный, возвращается в очередь
+    release_triage_ticket(context)
+    ticket = triage_queue.pop(user_id)
+    if not ticket:
+        await update.message.reply_text("Очередь пуста: все открытые тикеты получили ответ.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    publish_change('triage', None, ['claim', ticket['id'], user_id])
+    return await show_triage_ticket(update, context, ticket)
+
+async def show_triage_ticket(update, context, ticket):
+    context.user_data['current_ticket_id'] = ticket['id']
+    context.user_data['triage_ticket_id'] = ticket['id']
+    waiting = datetime.datetime.now() - datetime.datetime.fromisoformat(ticket['timestamp'])
+    reply_keyboard = [['Ответить', 'Изменить статус'], ['Пропустить', 'Назад']]
+    await update.message.reply_text(
+        f"{format_ticket_details(ticket)}\n\n"
+        f"Ожидает ответа: {format_duration(waiting.total_seconds())}. В очереди еще: {len(triage_queue)}\n\n"
+        "Выберите действие:",
+        reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
+    )
+    return TICKET_ACTION
+
+# Возврат в очередь тикета, взятого администратором через /next_ticket
+def release_triage_ticket(context):
+    ticket_id = context.user_data.pop('triage_ticket_id', None)
+    if ticket_id:
+        triage_queue.requeue(ticket_id)
+        publish_change('triage', None, ['requeue', ticket_id])
+
+def format_duration(seconds):
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин"
+
+# Срок ответа (SLA) на тикет: задача JobQueue проверяет тикет, когда срок истекает
+def schedule_ticket_sla(job_queue, ticket):
+    sla = TICKET_SLA.get(ticket.get('priority'))
+    if sla is None or not needs_triage(ticket) or ticket.get('escalated'):
+        return
+    waiting = (datetime.datetime.now() - datetime.datetime.fromisoformat(ticket['timestamp'])).total_seconds()
+    job_queue.run_once(check_ticket_sla, when=max(sla - waiting, 1), data=ticket['id'], name=f"sla_{ticket['id']}")
+
+# Тикет, не получивший ответа в срок, передается главному администратору (один раз)
+async def check_ticket_sla(context):
+    ticket = tickets_by_id.get(context.job.data)
+    if not ticket or not needs_triage(ticket) or ticket.get('escalated'):
+        return
+    waiting = (datetime.datetime.now() - datetime.datetime.fromisoformat(ticket['timestamp'])).total_seconds()
+    try:
+        await context.bot.send_message(
+            chat_id=MAIN_ADMIN_ID,
+            text=(
+                f"⚠️ Тикет с приоритетом '{ticket['priority']}' ждет ответа {format_duration(waiting)}\n\n"
+                f"{format_ticket_item(ticket)}\n\nИспользуйте /next_ticket или /view_tickets."
+            )
+        )
+    except Exception as e:
+        logger.error(f"Не удалось отправить напоминание о тикете {ticket['id']}: {e}")
+        return
+    ticket['escalated'] = True
+    save_tickets(tickets)
+    publish_ticket(ticket)
+    logger.info(f"Тикет {ticket['id']} передан главному администратору по истечении срока ответа")
+
+# Команда /search_tickets <запрос>: поиск тикетов по тексту сообщения, ответу и имени пользователя
+async def search_tickets(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    query = " ".join(context.args)
+    if not query:
+        await update.message.reply_text("Использование: /search_tickets <запрос>, например /search_tickets автобус опоздал")
+        return
+
+    started = time.perf_counter()
+    ticket_ids = ticket_search.search(query, SEARCH_MAX_RESULTS)
+    elapsed = time.perf_counter() - started
+    if not ticket_ids:
+        await update.message.reply_text(f"По запросу «{query}» ничего не найдено.")
+        return ConversationHandler.END
+
+    context.user_data['ticket_search'] = (query, ticket_ids)
+    text, reply_markup = search_paginator(context.user_data).render(0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+    await update.message.reply_text(
+        f"Поиск занял {elapsed * 1000:.1f} мс. Введите ID тикета для просмотра деталей или 'Назад' для возврата:",
+        reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+    )
+    return VIEWING_TICKET_DETAILS
+
+def format_ticket_details(ticket):
+    ticket_info = (
+        f"ID: {ticket['id']}\n"
+        f"От: @{ticket.get('user_name', 'NoUsername')}\n"
+        f"ID пользователя: {ticket['user_id']}\n"
+        f"Время: {ticket['timestamp']}\n"
+        f"Приоритет: {ticket['priority']}\n"
+        f"Статус: {ticket['status']}\n"
+        f"Сообщение: {ticket['message']}"
+    )
+    if ticket['admin_reply']:
+        ticket_info += f"\nОтвет администратора: {ticket['admin_reply']}"
+    return ticket_info
+
+async def view_ticket_details(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        await update.message.reply_text("Возврат в главное меню.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+
+    ticket_id = user_input.strip()
+    ticket = tickets_by_id.get(ticket_id)
+    if not ticket:
+        await update.message.reply_text("Тикет с таким ID не найден. Пожалуйста, введите корректный ID тикета или 'Назад' для возврата.")
+        return VIEWING_TICKET_DETAILS
+
+    reply_keyboard = [['Ответить', 'Изменить статус', 'Назад']]
+    await update.message.reply_text(
+        format_ticket_details(ticket) + "\n\nВыберите действие:",
+        reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
+    )
+    context.user_data['current_ticket_id'] = ticket['id']
+    return TICKET_ACTION
+
+async def ticket_action(update, context):
+    user_input = update.message.text
+    ticket = tickets_by_id.get(context.user_data.get('current_ticket_id'))
+    if user_input.lower() == 'назад':
+        release_triage_ticket(context)
+        return await view_tickets(update, context)
+    elif user_input == 'Пропустить' and context.user_data.get('triage_ticket_id'):
+        # Следующий тикет берется до возврата текущего, иначе очередь снова выдала бы текущий
+        next_ticket = triage_queue.pop(update.effective_user.id)
+        if not next_ticket:
+            await update.message.reply_text("Других тикетов в очереди нет.")
+            return TICKET_ACTION
+        publish_change('triage', None, ['claim', next_ticket['id'], update.effective_user.id])
+        release_triage_ticket(context)
+        return await show_triage_ticket(update, context, next_ticket)
+    elif user_input == 'Ответить':
+        await update.message.reply_text(
+            "Введите ваш ответ пользователю:",
+            reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+        )
+        return REPLYING_TO_TICKET
+    elif user_input == 'Изменить статус':
+        reply_keyboard = [['Ожидает ответа', 'В работе', 'Закрыт'], ['Назад']]
+        await update.message.reply_text(
+            "Выберите новый статус тикета:",
+            reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
+        )
+        return CHANGING_TICKET_STATUS
+    else:
+        await update.message.reply_text("Некорректный выбор. Пожалуйста, выберите действие из предложенных.")
+        return TICKET_ACTION
+
+async def changing_ticket_status(update, context):
+    new_status = update.message.text
+    ticket = tickets_by_id.get(context.user_data.get('current_ticket_id'))
+    if new_status.lower() == 'назад':
+        return await view_ticket_details(update, context)
+    elif new_status not in TICKET_STATUSES:
+        await update.message.reply_text("Некорректный статус. Пожалуйста, выберите из предложенных вариантов.")
+        return CHANGING_TICKET_STATUS
+    elif new_status == 'Закрыт':
+        if not ticket.get('admin_reply'):
+            await update.message.reply_text(
+                "Вы не можете закрыть тикет без ответа пользователю. Пожалуйста, сначала ответьте на тикет.",
+                reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+            )
+            return CHANGING_TICKET_STATUS
+        else:
+            unindex_open_ticket(ticket)
+            stats.ticket_status_changed(ticket['status'], new_status)
+            ticket['status'] = new_status
+            index_ticket(ticket)
+            save_tickets(tickets)
+            publish_ticket(ticket)
+            await update.message.reply_text(f"Статус тикета обновлен на '{new_status}'.", reply_markup=ReplyKeyboardRemove())
+            log_action(update.effective_user.id, f"Изменил статус тикета {ticket['id']} на '{new_status}'")
+            return ConversationHandler.END
+    else:
+        # Для других статусов разрешаем изменение без ограничений
+        unindex_open_ticket(ticket)
+        stats.ticket_status_changed(ticket['status'], new_status)
+        ticket['status'] = new_status
+        index_ticket(ticket)
+        save_tickets(tickets)
+        publish_ticket(ticket)
+        await update.message.reply_text(f"Статус тикета обновлен на '{new_status}'.", reply_markup=ReplyKeyboardRemove())
+        log_action(update.effective_user.id, f"Изменил статус тикета {ticket['id']} на '{new_status}'")
+        return ConversationHandler.END
+
+
+async def reply_to_ticket(update, context):
+    user_input = update.message.text
+    ticket = tickets_by_id.get(context.user_data.get('current_ticket_id'))
+    if user_input.lower() == 'назад':
+        return await view_ticket_details(update, context)
+    else:
+        if not ticket['admin_reply']:
+            stats.ticket_answered(ticket)
+        ticket['admin_reply'] = user_input
+        ticket_search.add(ticket)
+        triage_queue.update(ticket)
+        save_tickets(tickets)
+        publish_ticket(ticket)
+        try:
+            await context.bot.send_message(
+                chat_id=ticket['user_id'],
+                text=f"Ответ администратора на ваше обращение:\n{user_input}"
+            )
+            await update.message.reply_text(
+                "Ответ отправлен пользователю. Хотите изменить статус тикета?",
+                reply_markup=ReplyKeyboardMarkup([['Изменить статус', 'Назад']], one_time_keyboard=True, resize_keyboard=True)
+            )
+            log_action(update.effective_user.id, f"Ответил на тикет {ticket['id']}")
+            return POST_REPLY_ACTION
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение пользователю {ticket['user_id']}: {e}")
+            await update.message.reply_text("Не удалось отправить ответ пользователю.", reply_markup=ReplyKeyboardRemove())
+            return ConversationHandler.END
+
+async def post_reply_action(update, context):
+    user_input = update.message.text
+    if user_input == 'Изменить статус':
+        reply_keyboard = [['Ожидает ответа', 'В работе', 'Закрыт'], ['Назад']]
+        await update.message.reply_text(
+            "Выберите новый статус тикета:",
+            reply_markup=ReplyKeyboardMarkup(reply_keyboard, one_time_keyboard=True, resize_keyboard=True)
+        )
+        return CHANGING_TICKET_STATUS
+    elif user_input.lower() == 'назад':
+        await update.message.reply_text("Возврат в главное меню.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    else:
+        await update.message.reply_text("Пожалуйста, выберите действие из предложенных.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+
+# Команда /broadcast
+async def broadcast(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return ConversationHandler.END
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return ConversationHandler.END
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "Пожалуйста, введите сообщение для рассылки всем пользователям:",
+        reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+    )
+    return BROADCASTING
+
+async def handle_broadcast_message(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        await update.message.reply_text("Рассылка отменена.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    message_to_send = user_input
+    user_ids = whitelist.copy()
+    user_ids.add(MAIN_ADMIN_ID)
+    if user_ids:
+        for user_id in user_ids:
+            try:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=message_to_send
+                )
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+        await update.message.reply_text("Сообщение отправлено всем пользователям.", reply_markup=ReplyKeyboardRemove())
+        log_action(update.effective_user.id, "Выполнил рассылку")
+    else:
+        await update.message.reply_text("Нет пользователей для отправки сообщения.", reply_markup=ReplyKeyboardRemove())
+    return ConversationHandler.END
+
+# Добавление и удаление пользователей из белого списка
+async def add_user(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return ConversationHandler.END
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return ConversationHandler.END
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "Введите ID пользователя, которого вы хотите добавить в белый список:",
+        reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+    )
+    return ADDING_USER
+
+async def handle_add_user(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        await update.message.reply_text("Добавление пользователя отменено.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    try:
+        user_id = int(user_input)
+        update_whitelist(added=[user_id])
+        await update.message.reply_text(f"Пользователь {user_id} добавлен в белый список.", reply_markup=ReplyKeyboardRemove())
+        log_action(update.effective_user.id, f"Добавил пользователя {user_id} в белый список")
+    except ValueError:
+        await update.message.reply_text("Некорректный ID пользователя. Пожалуйста, введите числовой ID или 'Назад' для возврата.")
+        return ADDING_USER
+    return ConversationHandler.END
+
+# Удаление пользователя из белого списка
+async def remove_user(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return ConversationHandler.END
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return ConversationHandler.END
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "Введите ID пользователя, которого вы хотите удалить из белого списка:",
+        reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+    )
+    return REMOVING_USER
+
+async def handle_remove_user(update, context):
+    user_input = update.message.text
+    if user_input.lower() == 'назад':
+        await update.message.reply_text("Удаление пользователя отменено.", reply_markup=ReplyKeyboardRemove())
+        return ConversationHandler.END
+    try:
+        user_id = int(user_input)
+        if user_id == MAIN_ADMIN_ID:
+            await update.message.reply_text("Невозможно удалить главного администратора из белого списка.", reply_markup=ReplyKeyboardRemove())
+            return ConversationHandler.END
+        update_whitelist(removed=[user_id])
+        update_whitelist_roles({user_id: None})
+        await update.message.reply_text(f"Пользователь {user_id} удален из белого списка.", reply_markup=ReplyKeyboardRemove())
+        log_action(update.effective_user.id, f"Удалил пользователя {user_id} из белого списка")
+    except ValueError:
+        await update.message.reply_text("Некорректный ID пользователя. Пожалуйста, введите числовой ID или 'Назад' для возврата.")
+        return REMOVING_USER
+    return ConversationHandler.END
+
+# Массовый импорт белого списка из CSV или текстового файла
+async def import_users(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return ConversationHandler.END
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return ConversationHandler.END
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "Отправьте CSV или текстовый файл: по одной строке на пользователя в формате 'ID' или 'ID,роль' "
+        "(роль: администратор, водитель или пассажир). Перед применением будет показано, что изменится.",
+        reply_markup=ReplyKeyboardMarkup([['Назад']], one_time_keyboard=True, resize_keyboard=True)
+    )
+    return IMPORTING_USERS
+
+def format_user_ids(user_ids, limit=20):
+    text = ", ".join(map(str, user_ids[:limit]))
+    if len(user_ids) > limit:
+        text += f" и еще {len(user_ids) - limit}"
+    return text
+
+async def handle_import_file(update, context):
+    if update.message.text:
+        if update.message.text.lower() == 'назад':
+            await update.message.reply_text("Импорт отменен.", reply_markup=ReplyKeyboardRemove())
+            return ConversationHandler.END
+        await update.message.reply_text("Пожалуйста, отправьте файл или 'Назад' для отмены.")
+        return IMPORTING_USERS
+
+    document = update.message.document
+    if document.file_size and document.file_size > WHITELIST_IMPORT_MAX_SIZE:
+        await update.message.reply_text("Файл слишком большой. Пожалуйста, отправьте файл меньшего размера.")
+        return IMPORTING_USERS
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    entries, errors = parse_whitelist_file(data)
+    if not entries:
+        await update.message.reply_text("В файле не найдено ни одного ID пользователя. Отправьте другой файл или 'Назад' для отмены.")
+        return IMPORTING_USERS
+
+    added, removed, role_changes, roles_cleared = whitelist_diff(entries)
+    context.user_data['whitelist_import'] = {user_id: role for user_id, role in entries.items()}
+    text = (
+        f"В файле пользователей: {len(entries)}\n"
+        f"Будут добавлены: {len(added)}\n"
+        f"Будут удалены (только при замене списка): {len(removed)}\n"
+        f"Изменится роль: {len(role_changes)}\n"
+        f"Роль будет снята (только при замене списка, в файле роль не указана): {len(roles_cleared)}"
+    )
+    if added:
+        text += f"\n\nДобавляемые: {format_user_ids(added)}"
+    if removed:
+        text += f"\n\nУдаляемые: {format_user_ids(removed)}"
+    if roles_cleared:
+        text += f"\n\nРоль будет снята: {format_user_ids(roles_cleared)}"
+    if errors:
+        text += f"\n\nПропущены строки с ошибками: {format_user_ids(errors)}"
+    keyboard = [
+        [InlineKeyboardButton("Заменить белый список", callback_data='whitelist_replace')],
+        [InlineKeyboardButton("Только добавить", callback_data='whitelist_add')],
+        [InlineKeyboardButton("Отмена", callback_data='whitelist_cancel')],
+    ]
+    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return CONFIRMING_IMPORT
+
+async def handle_import_confirm(update, context):
+    query = update.callback_query
+    await query.answer()
+    entries = context.user_data.pop('whitelist_import', None)
+    if query.data == 'whitelist_cancel' or not entries:
+        await query.edit_message_text("Импорт отменен.")
+        return ConversationHandler.END
+
+    # Разница пересчитывается: белый список мог измениться, пока администратор смотрел предпросмотр
+    added, removed, _, _ = whitelist_diff(entries)
+    replace = query.data == 'whitelist_replace'
+    if not replace:
+        removed = []
+    apply_whitelist_import(entries, removed, replace)
+    await query.edit_message_text(f"Белый список обновлен: добавлено {len(added)}, удалено {len(removed)}.")
+    log_action(update.effective_user.id, f"Импортировал белый список: добавлено {len(added)}, удалено {len(removed)}")
+    return ConversationHandler.END
+
+# Выгрузка белого списка с ролями в CSV
+async def export_users(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID and user_id not in whitelist:
+        await update.message.reply_text("Вы не имеете доступа к боту.")
+        return
+
+    is_authorized = context.user_data.get('is_authorized', False)
+    user_role = context.user_data.get('role')
+    if not is_authorized:
+        await unauthorized(update, context)
+        return
+    if user_role != 'администратор':
+        await no_permissions(update, context)
+        return
+
+    document = io.BytesIO(format_whitelist_csv().encode('utf-8'))
+    await update.message.reply_document(document, filename='whitelist.csv', caption=f"Пользователей в белом списке: {len(whitelist)}")
+    log_action(user_id, "Выгрузил белый список")
+
+# Команда /export_history [с] [по]: выгрузка архива маршрутов и тикетов за период в zip с CSV-файлами
+# (только главный администратор: в выгрузке расшифрованные координаты). Архив пишется потоково
+# во временный файл в отдельном потоке и отправляется с диска
+async def export_history(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID or not context.user_data.get('is_main_admin', False):
+        await no_permissions(update, context)
+        return
+
+    try:
+        start, end = parse_date_range(context.args)
+    except ValueError:
+        await update.message.reply_text(
+            "Использование: /export_history [с] [по], даты в формате ДД.ММ.ГГГГ или ГГГГ-ММ-ДД.\n"
+            f"Без дат выгружаются последние {EXPORT_DEFAULT_DAYS} дн., без второй даты — по сегодня."
+        )
+        return
+
+    period = f"{start:%d.%m.%Y} — {end - datetime.timedelta(days=1):%d.%m.%Y}"
+    await update.message.reply_text(f"Готовлю выгрузку за {period}...")
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    filename = f"history-{start:%Y%m%d}-{end - datetime.timedelta(days=1):%Y%m%d}.zip"
+    path = os.path.join(EXPORT_DIR, f"{uuid.uuid4().hex}-{filename}")
+    try:
+        # Снимок списка тикетов: обработчики могут добавлять тикеты, пока идет запись
+        counts = await asyncio.to_thread(write_history_export, path, start, end, list(tickets))
+        size = os.path.getsize(path)
+        if size > TELEGRAM_DOCUMENT_MAX_SIZE:
+            await update.message.reply_text(
+                f"Выгрузка занимает {size / 1024 / 1024:.0f} МБ, больше допустимого размера документа. "
+                "Укажите более короткий период."
+            )
+            return
+        caption = (
+            f"Период: {period}\nМаршрутов: {counts['routes']}, остановок: {counts['stops']}, "
+            f"обращений: {counts['tickets']}"
+        )
+        if counts['skipped']:
+            caption += f"\nНе удалось расшифровать маршрутов: {len(counts['skipped'])}"
+        with open(path, 'rb') as f:
+            await update.message.reply_document(f, filename=filename, caption=caption)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    log_action(user_id, f"Выгрузил историю маршрутов и тикетов за {period}")
+
+# Ключ упорядочивания обновления: чат, а если его нет — пользователь
+def update_ordering_key(update):
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+    return None
+
+# Периодическое завершение простаивающих маршрутов (JobQueue); заодно записывается изменившаяся статистика
+async def evict_idle_routes(context):
+    flush_stats()
+    deadline = time.time() - ROUTE_IDLE_TTL
+    for route in list(routes.values()):
+        if route.last_activity >= deadline:
+            continue
+        async with get_route_lock(route.driver_id) as lock:
+            # Маршрут могли изменить, завершить или заменить, пока ожидали блокировку
+            if lock.route is route and route.last_activity < deadline:
+                route_lifecycle.complete(route)
+                log_action(route.driver_id, "Маршрут завершен по истечении времени простоя")
+
+# Перешифрование сохраненных записей текущим ключом после смены ключа: пакетами, в фоне;
+# запись, которую успели изменить, пропускается — она уже зашифрована новым ключом
+async def reencrypt_stored_data():
+    reencrypted = 0
+    if sync.shared_store:
+        last_key = ''
+        while rows := await asyncio.to_thread(sync.shared_store.raw_batch, 'route', last_key, REENCRYPT_BATCH_SIZE):
+            updates = []
+            for key, payload in rows:
+                data = reencrypt_route_record(json.loads(payload))
+                if data is not None:
+                    updates.append((key, payload, json.dumps(data)))
+            reencrypted += await asyncio.wrap_future(sync.shared_store.compare_and_set('route', updates))
+            last_key = rows[-1][0]
+    for path in route_archive.files():
+        reencrypted += await asyncio.to_thread(route_archive.rewrite, path, reencrypt_route_record)
+    return reencrypted
+
+def reencrypt_route_record(data):
+    if keyring.is_current(data['record']):
+        return None
+    data['record'] = encrypt_record(decrypt_record(data['record']))
+    return data
+
+async def run_reencryption(chat_id, context):
+    try:
+        reencrypted = await reencrypt_stored_data()
+        await context.bot.send_message(chat_id=chat_id, text=f"Перешифрование завершено. Обновлено записей: {reencrypted}.")
+    except Exception as e:
+        logger.exception("Ошибка при перешифровании данных")
+        await context.bot.send_message(chat_id=chat_id, text="Ошибка при перешифровании данных. Подробности в журнале.")
+
+# Команда /rotate_key: смена ключа шифрования (только главный администратор)
+async def rotate_key(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID or not context.user_data.get('is_main_admin', False):
+        await no_permissions(update, context)
+        return
+
+    version = keyring.rotate()
+    publish_change('keyring', None, version)
+    await update.message.reply_text(
+        f"Создан новый ключ шифрования (версия {version}). Перешифрование сохраненных данных запущено в фоне."
+    )
+    log_action(user_id, f"Сменил ключ шифрования на версию {version}")
+    context.application.create_task(run_reencryption(update.effective_chat.id, context))
+
+PROFILE_USAGE = (
+    "/profile on [доля] - cProfile для доли обновлений (например, 0.1)\n"
+    "/profile sample [мс] - выборка стеков с заданным интервалом\n"
+    "/profile off - выключить\n"
+    "/profile dump - сводка и файлы результатов (pstats и свернутые стеки)\n"
+    "/profile reset - сбросить накопленные данные"
+)
+
+# Команда /profile: профилирование обработчиков (только главный администратор).
+# Команда применяется во всех воркерах; сводку и файлы присылает воркер, получивший команду
+async def profile_command(update, context):
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID or not context.user_data.get('is_main_admin', False):
+        await no_permissions(update, context)
+        return
+
+    action = context.args[0].lower() if context.args else 'status'
+    value = None
+    if action in ('on', 'sample') and len(context.args) > 1:
+        try:
+            value = float(context.args[1].replace(',', '.'))
+        except ValueError:
+            value = 0
+        valid = 0 < value <= 1 if action == 'on' else value > 0
+        if not valid:
+            await update.message.reply_text(f"Неверное значение.\n{PROFILE_USAGE}")
+            return
+        if action == 'sample':
+            value /= 1000
+
+    if action in ('on', 'sample'):
+        mode = 'cprofile' if action == 'on' else 'sample'
+        control_profiler(mode, value)
+        publish_change('profiler', None, [mode, value])
+        await update.message.reply_text(profiler.summary())
+        log_action(user_id, f"Включил профилирование ({mode})")
+    elif action in ('off', 'reset'):
+        control_profiler(action)
+        publish_change('profiler', None, [action, None])
+        await update.message.reply_text("Профилирование выключено." if action == 'off' else "Данные профилирования сброшены.")
+        log_action(user_id, "Выключил профилирование" if action == 'off' else "Сбросил данные профилирования")
+    elif action == 'dump':
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        files = await asyncio.to_thread(control_profiler, 'dump', stamp)
+        publish_change('profiler', None, ['dump', stamp])
+        await update.message.reply_text(
+            f"{profiler.summary()}\n\nФайлы: {os.path.dirname(files[0]) if files else 'нет данных'}"
+        )
+        for path in files:
+            if os.path.basename(path) in ('all.pstats', 'stacks.collapsed'):
+                with open(path, 'rb') as f:
+                    await update.message.reply_document(f, filename=os.path.basename(path))
+    elif action == 'status':
+        await update.message.reply_text(f"{profiler.summary()}\n\n{PROFILE_USAGE}")
+    else:
+        await update.message.reply_text(PROFILE_USAGE)
@@ -0,0 +1,23 @@
+import threading
+
+# Отложенное создание тяжелых объектов (клиент Google Maps, набор ключей): фабрика вызывается
+# при первом обращении к атрибуту, а не при импорте
+class Lazy:
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,566 @@
+# Google Maps: предохранитель, планирование маршрутов, поля времени в пути и геокодирование
+import os
+import asyncio
+import json
+import math
+import time
+import datetime
+import threading
+import mmap
+import array
+import concurrent.futures
+from .config import (
+    MAPS_FAILURE_THRESHOLD, MAPS_MAX_WAYPOINTS, MAPS_PARALLEL_REQUESTS, MAPS_REQUEST_TIMEOUT,
+    MAPS_RESET_TIMEOUT, MAPS_RETRY_TIMEOUT, ROUTE_CACHE_EXACT_STOPS, ROUTE_CACHE_FILE,
+    ROUTE_CACHE_MAX_PLANS, ROUTE_CACHE_TTL, TRAVEL_TIME_AREA, TRAVEL_TIME_BANDS,
+    TRAVEL_TIME_DESTINATIONS, TRAVEL_TIME_DIR, TRAVEL_TIME_GRID_STEP, TRAVEL_TIME_HISTORY_DAYS, api_key,
+    logger, workplace_location
+)
+from .lazy import Lazy
+from .crypto import decrypt_record, encrypt_record
+from .geo import estimate_travel_time, grid_cell, haversine_distance, parse_coordinates
+from .sync import publish_change
+from .storage import write_json_atomic
+from .routes import route_archive
+
+# Клиент Google Maps создается при первом запросе
+def create_maps_client():
+    import googlemaps
+    return googlemaps.Client(key=api_key, timeout=MAPS_REQUEST_TIMEOUT, retry_timeout=MAPS_RETRY_TIMEOUT)
+
+gmaps = Lazy(create_maps_client)
+
+# Исключение, которое возникает, когда Google Maps недоступен (предохранитель разомкнут)
+class MapsUnavailable(Exception):
+    pass
+
+# Предохранитель для вызовов Google Maps: после серии сбоев размыкается,
+# и запросы сразу уходят в резервный режим, пока фоновая проверка не подтвердит восстановление
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout, probe=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe  # Лёгкий запрос для проверки доступности сервиса
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                threading.Thread(target=self._run_probe, daemon=True).start()
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Google Maps снова доступен, предохранитель замкнут")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Google Maps недоступен, предохранитель разомкнут")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    # Фоновая проверка в полуоткрытом состоянии, обработчики её не ждут
+    def _run_probe(self):
+        try:
+            self.probe()
+        except Exception:
+            logger.warning("Проверка доступности Google Maps не удалась")
+            self.record_failure()
+        else:
+            self.record_success()
+
+# Ошибки, которые говорят о недоступности сервиса, а не о некорректном запросе
+MAPS_OUTAGE_API_STATUSES = {'OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT', 'UNKNOWN_ERROR'}
+
+def is_maps_outage(error):
+    import googlemaps
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status in MAPS_OUTAGE_API_STATUSES
+    return isinstance(error, (
+        googlemaps.exceptions.Timeout,
+        googlemaps.exceptions.TransportError,
+        googlemaps.exceptions.HTTPError
+    ))
+
+maps_breaker = CircuitBreaker(
+    failure_threshold=MAPS_FAILURE_THRESHOLD,
+    reset_timeout=MAPS_RESET_TIMEOUT,
+    probe=lambda: call_maps(gmaps.reverse_geocode, workplace_location, probe=True)
+)
+
+# Единая точка вызова Google Maps через предохранитель
+def call_maps(method, *args, probe=False, **kwargs):
+    if not probe and not maps_breaker.allow_request():
+        raise MapsUnavailable()
+    try:
+        result = method(*args, **kwargs)
+    except Exception as e:
+        if is_maps_outage(e):
+            if not probe:
+                maps_breaker.record_failure()
+        raise
+    if not probe:
+        maps_breaker.record_success()
+    return result
+
+# Локальный порядок остановок (ближайший сосед) и оценка длительности маршрута
+def estimate_route(origin, destination, waypoints):
+    remaining = list(range(len(waypoints)))
+    order = []
+    current = origin
+    total_duration = 0
+    while remaining:
+        nearest = min(remaining, key=lambda i: haversine_distance(current, waypoints[i]))
+        remaining.remove(nearest)
+        order.append(nearest)
+        total_duration += estimate_travel_time(current, waypoints[nearest])
+        current = waypoints[nearest]
+    total_duration += estimate_travel_time(current, destination)
+    return order, total_duration
+
+# Функция для оптимизации маршрута с помощью Google Maps API
+def optimize_route(origin, destination, pickup_locations):
+    optimized_waypoints, total_duration, _ = optimize_route_with_order(origin, destination, pickup_locations)
+    return optimized_waypoints, total_duration
+
+def optimize_route_with_order(origin, destination, pickup_locations):
+    plan = plan_route(origin, destination, pickup_locations, with_polyline=False)
+    optimized_waypoints = [pickup_locations[i] for i in plan['order']]
+    return optimized_waypoints, plan['duration'], plan['order']
+
+# Планирование маршрута: порядок точек, длительность (секунды) и полилиния маршрута.
+# Сначала кэш маршрутов (если полилиния не нужна — и порядок по кэшированному времени в пути),
+# затем Google Maps; маршруты больше лимита Directions API планируются по частям
+def plan_route(origin, destination, pickup_locations, with_polyline=True):
+    plan = route_cache.get_plan(origin, destination, pickup_locations)
+    if plan is None and not with_polyline:
+        plan = route_cache.plan_from_legs(origin, destination, pickup_locations)
+    route_cache.count(plan is not None)
+    if plan is not None:
+        return plan
+
+    if len(pickup_locations) > MAPS_MAX_WAYPOINTS:
+        plan = plan_large_route(origin, destination, pickup_locations)
+    else:
+        plan = plan_directions(origin, destination, pickup_locations)
+    # Полилиния есть только у плана, полностью полученного от Google Maps; локальные оценки не кэшируются
+    if plan['polyline'] is not None:
+        route_cache.put_plan(origin, destination, pickup_locations, plan)
+    return plan
+
+def plan_directions(origin, destination, waypoints):
+    try:
+        directions_result = call_maps(
+            gmaps.directions,
+            origin=origin,
+            destination=destination,
+            waypoints=waypoints,
+            optimize_waypoints=True
+        )
+
+        if directions_result and len(directions_result) > 0:
+            route = directions_result[0]
+            return {
+                'order': route['waypoint_order'],  # Индексы оптимизированного порядка
+                'duration': sum(leg['duration']['value'] for leg in route['legs']),
+                'polyline': route['overview_polyline']['points'],
+            }
+        else:
+            logger.error("Не удалось получить направления от Google Maps API.")
+            return {'order': list(range(len(waypoints))), 'duration': None, 'polyline': None}
+    except MapsUnavailable:
+        logger.info("Google Maps недоступен, маршрут рассчитан локально")
+    except Exception as e:
+        logger.exception("Ошибка при оптимизации маршрута")
+
+    # Резервный режим: локальный порядок и оценка длительности
+    order, duration = estimate_route(origin, destination, waypoints)
+    return {'order': order, 'duration': duration, 'polyline': None}
+
+# Большой маршрут: точки упорядочиваются локально (ближайший сосед), тур режется на
+# последовательные, географически связные части, части запрашиваются параллельно и сшиваются.
+# Последняя точка каждой части фиксирована и служит началом следующей
+def plan_large_route(origin, destination, pickup_locations):
+    tour, _ = estimate_route(origin, destination, pickup_locations)
+    chunks = []
+    start = 0
+    while len(tour) - start > MAPS_MAX_WAYPOINTS:
+        chunks.append(tour[start:start + MAPS_MAX_WAYPOINTS])
+        start += MAPS_MAX_WAYPOINTS
+    chunks.append(tour[start:])
+
+    requests = []
+    for number, chunk in enumerate(chunks):
+        chunk_origin = origin if number == 0 else pickup_locations[chunks[number - 1][-1]]
+        if number == len(chunks) - 1:
+            requests.append((chunk_origin, destination, chunk))
+        else:
+            requests.append((chunk_origin, pickup_locations[chunk[-1]], chunk[:-1]))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(requests), MAPS_PARALLEL_REQUESTS)) as executor:
+        plans = list(executor.map(
+            lambda request: plan_directions(request[0], request[1], [pickup_locations[i] for i in request[2]]),
+            requests
+        ))
+
+    order = []
+    duration = 0
+    polylines = []
+    for chunk, (chunk_origin, chunk_destination, waypoint_indexes), plan in zip(chunks, requests, plans):
+        order.extend(waypoint_indexes[i] for i in plan['order'])
+        if len(waypoint_indexes) < len(chunk):
+            order.append(chunk[-1])
+        if plan['duration'] is None:
+            # Часть без ответа от Google оцениваем локально, чтобы не терять длительность всего маршрута
+            _, chunk_duration = estimate_route(chunk_origin, chunk_destination, [pickup_locations[i] for i in waypoint_indexes])
+            duration += chunk_duration
+        else:
+            duration += plan['duration']
+        polylines.append(plan['polyline'])
+
+    return {'order': order, 'duration': duration, 'polyline': stitch_polylines(polylines)}
+
+# Сшивка полилиний частей маршрута в одну (если для какой-то части полилинии нет — None)
+def stitch_polylines(polylines):
+    import googlemaps
+    if not polylines or any(polyline is None for polyline in polylines):
+        return None
+    points = []
+    for polyline in polylines:
+        decoded = googlemaps.convert.decode_polyline(polyline)
+        if points and decoded and points[-1] == decoded[0]:
+            decoded = decoded[1:]
+        points.extend(decoded)
+    return googlemaps.convert.encode_polyline(points)
+
+# Кэш маршрутов для пиковых минут перед сменой: планы (порядок остановок, длительность, полилиния)
+# и время в пути между точками. Точки сравниваются по ячейкам сетки кластеризации остановок,
+# поэтому план вчерашних остановок подходит сегодняшним с теми же пассажирами.
+# Записи старше ROUTE_CACHE_TTL не используются. Файл кэша (зашифрован одной записью) пишет прогрев
+class RouteCache:
+    def __init__(self, path):
+        self.path = path
+        self.plans = {}  # ключ маршрута -> {'order': ячейки остановок по порядку, 'duration', 'polyline', 'at'}
+        self.legs = {}  # "ячейка>ячейка" -> [секунды, время записи]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = decrypt_record(json.load(f)['record'])
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {'plans': {}, 'legs': {}}
+        with self._lock:
+            self.plans, self.legs = data['plans'], data['legs']
+
+    def save(self):
+        with self._lock:
+            data = {
+                'plans': {key: plan for key, plan in self.plans.items() if self.fresh(plan['at'])},
+                'legs': {key: leg for key, leg in self.legs.items() if self.fresh(leg[1])},
+            }
+        write_json_atomic(self.path, {'record': encrypt_record(data)})
+
+    @staticmethod
+    def fresh(at):
+        return time.time() - at < ROUTE_CACHE_TTL
+
+    @staticmethod
+    def cell(location):
+        return '%d:%d' % grid_cell(location)
+
+    # Ключ маршрута: ячейки начала и конца и набор ячеек остановок; если две остановки в одной ячейке — None
+    def plan_key(self, origin, destination, waypoints):
+        cells = [self.cell(point) for point in waypoints]
+        if len(set(cells)) < len(cells):
+            return None
+        return '|'.join([self.cell(origin), self.cell(destination)] + sorted(cells))
+
+    def get_plan(self, origin, destination, waypoints):
+        key = self.plan_key(origin, destination, waypoints)
+        with self._lock:
+            plan = self.plans.get(key)
+        if plan is None or not self.fresh(plan['at']):
+            return None
+        positions = {self.cell(point): index for index, point in enumerate(waypoints)}
+        return {'order': [positions[cell] for cell in plan['order']], 'duration': plan['duration'], 'polyline': plan['polyline']}
+
+    def put_plan(self, origin, destination, waypoints, plan):
+        key = self.plan_key(origin, destination, waypoints)
+        if key is None:
+            return
+        entry = {
+            'order': [self.cell(waypoints[index]) for index in plan['order']],
+            'duration': plan['duration'], 'polyline': plan['polyline'], 'at': time.time()
+        }
+        with self._lock:
+            self.plans.pop(key, None)
+            self.plans[key] = entry
+            # Вытесняются самые старые планы
+            while len(self.plans) > ROUTE_CACHE_MAX_PLANS:
+                del self.plans[next(iter(self.plans))]
+
+    # Время в пути между точками (секунды) или None; точки в одной ячейке считаются одним местом
+    def get_leg(self, point_a, point_b):
+        cell_a, cell_b = self.cell(point_a), self.cell(point_b)
+        if cell_a == cell_b:
+            return 0
+        leg = self.legs.get(f"{cell_a}>{cell_b}")
+        if leg is None or not self.fresh(leg[1]):
+            return None
+        return leg[0]
+
+    def put_leg(self, point_a, point_b, seconds):
+        with self._lock:
+            self.legs[f"{self.cell(point_a)}>{self.cell(point_b)}"] = [seconds, time.time()]
+
+    # План по кэшированному времени в пути (без полилинии), если известны все участки: порядок остановок
+    # перебирается точно (динамическое программирование по подмножествам), для больших маршрутов —
+    # ближайший сосед
+    def plan_from_legs(self, origin, destination, waypoints):
+        points = [origin] + list(waypoints) + [destination]
+        count = len(waypoints)
+        legs = {}
+        for start in range(count + 1):
+            for end in range(1, count + 2):
+                if start != end:
+                    leg = self.get_leg(points[start], points[end])
+                    if leg is None:
+                        return None
+                    legs[start, end] = leg
+
+        if count > ROUTE_CACHE_EXACT_STOPS:
+            order, current, duration = [], 0, 0
+            remaining = set(range(1, count + 1))
+            while remaining:
+                nearest = min(remaining, key=lambda point: legs[current, point])
+                remaining.remove(nearest)
+                duration += legs[current, nearest]
+                order.append(nearest - 1)
+                current = nearest
+            return {'order': order, 'duration': duration + legs[current, count + 1], 'polyline': None}
+
+        # best[(набор остановок, последняя остановка)] = (длительность от начала, предыдущая остановка)
+        best = {(1 << point, point): (legs[0, point + 1], None) for point in range(count)}
+        for visited in range(1, 1 << count):
+            for last in range(count):
+                if (visited, last) not in best:
+                    continue
+                duration = best[visited, last][0]
+                for point in range(count):
+                    if visited & (1 << point):
+                        continue
+                    key = (visited | (1 << point), point)
+                    candidate = duration + legs[last + 1, point + 1]
+                    if key not in best or candidate < best[key][0]:
+                        best[key] = (candidate, last)
+        if not count:
+            return {'order': [], 'duration': legs[0, 1], 'polyline': None}
+        visited = (1 << count) - 1
+        last = min(range(count), key=lambda point: best[visited, point][0] + legs[point + 1, count + 1])
+        duration = best[visited, last][0] + legs[last + 1, count + 1]
+        order = []
+        while last is not None:
+            order.append(last)
+            visited, last = visited & ~(1 << last), best[visited, last][1]
+        return {'order': order[::-1], 'duration': duration, 'polyline': None}
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # Попадания и промахи с прошлого вызова
+    def take_counters(self):
+        with self._lock:
+            counters, self.hits, self.misses = (self.hits, self.misses), 0, 0
+        return counters
+
+# Кэш маршрутов (загружается при запуске, см. load_state)
+route_cache = RouteCache(ROUTE_CACHE_FILE)
+
+# Поле времени в пути до пункта назначения: сетка над зоной обслуживания по временным интервалам.
+# Значения (секунды, uint16) лежат в бинарном файле, который читается через mmap,
+# параметры сетки — в соседнем JSON-файле
+class TravelTimeField:
+    UNKNOWN = 0xFFFF
+
+    def __init__(self, name):
+        self.name = name
+        self.meta_path = os.path.join(TRAVEL_TIME_DIR, f"{name}.json")
+        self.data_path = os.path.join(TRAVEL_TIME_DIR, f"{name}.bin")
+        self.meta = None
+        self.values = None
+        self._mmap = None
+
+    def load(self):
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.data_path)):
+            return
+        with open(self.meta_path, 'r') as f:
+            meta = json.load(f)
+        with open(self.data_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.meta, self.values, self._mmap = meta, memoryview(mapped).cast('H'), mapped
+
+    @property
+    def available(self):
+        return self.meta is not None
+
+    # Время в пути (секунды) от точки до пункта назначения или None, если точка вне сетки
+    def lookup(self, location, moment=None):
+        if not self.available:
+            return None
+        meta = self.meta
+        latitude, longitude = parse_coordinates(location)
+        row = int((latitude - meta['lat_min']) / meta['lat_step'])
+        column = int((longitude - meta['lng_min']) / meta['lng_step'])
+        if not (0 <= row < meta['rows'] and 0 <= column < meta['cols']):
+            return None
+        band = travel_time_band(meta['bands'], moment or datetime.datetime.now())
+        value = self.values[(band * meta['rows'] + row) * meta['cols'] + column]
+        return None if value == self.UNKNOWN else value
+
+# Индекс временного интервала: последний интервал, начавшийся не позже указанного времени
+def travel_time_band(bands, moment):
+    band = len(bands) - 1
+    for index, hour in enumerate(bands):
+        if hour <= moment.hour:
+            band = index
+    return band
+
+# Точки, где за последние TRAVEL_TIME_HISTORY_DAYS дней начинались маршруты и садились пассажиры
+def recent_stop_points():
+    now = datetime.datetime.now()
+    for data in route_archive.iter_routes(now - datetime.timedelta(days=TRAVEL_TIME_HISTORY_DAYS), now):
+        yield data['origin']
+        for stop in data['stops']:
+            yield from stop['points']
+
+# Построение поля времени в пути через Distance Matrix API (по 25 точек сетки в запросе).
+# Запрашиваются только ячейки с точками из points, остальные остаются неизвестными (проверка
+# по полю для них не выполняется). Возвращает число запрошенных элементов (0 — точек нет, поле не строилось)
+def build_travel_time_field(name, destination, points):
+    lat_min, lng_min, lat_max, lng_max = TRAVEL_TIME_AREA
+    lat_step = TRAVEL_TIME_GRID_STEP / 111320
+    lng_step = lat_step / math.cos(math.radians((lat_min + lat_max) / 2))
+    rows = math.ceil((lat_max - lat_min) / lat_step)
+    cols = math.ceil((lng_max - lng_min) / lng_step)
+    cells = set()
+    for point in points:
+        latitude, longitude = parse_coordinates(point)
+        row, column = int((latitude - lat_min) / lat_step), int((longitude - lng_min) / lng_step)
+        if 0 <= row < rows and 0 <= column < cols:
+            cells.add(row * cols + column)
+    if not cells:
+        return 0
+    cells = sorted(cells)
+    centers = [
+        f"{lat_min + (cell // cols + 0.5) * lat_step:.6f},{lng_min + (cell % cols + 0.5) * lng_step:.6f}"
+        for cell in cells
+    ]
+    values = array.array('H', [TravelTimeField.UNKNOWN]) * (len(TRAVEL_TIME_BANDS) * rows * cols)
+    now = datetime.datetime.now()
+    for band, hour in enumerate(TRAVEL_TIME_BANDS):
+        departure = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if departure <= now:
+            departure += datetime.timedelta(days=1)
+        for start in range(0, len(centers), 25):
+            result = call_maps(
+                gmaps.distance_matrix,
+                origins=centers[start:start + 25],
+                destinations=[destination],
+                mode="driving",
+                departure_time=departure
+            )
+            for offset, row in enumerate(result['rows']):
+                element = row['elements'][0]
+                if element['status'] == 'OK':
+                    duration = element.get('duration_in_traffic', element['duration'])['value']
+                    values[band * rows * cols + cells[start + offset]] = min(duration, TravelTimeField.UNKNOWN - 1)
+
+    os.makedirs(TRAVEL_TIME_DIR, exist_ok=True)
+    field = travel_time_fields[name]
+    temp_path = f"{field.data_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        values.tofile(f)
+    os.replace(temp_path, field.data_path)
+    write_json_atomic(field.meta_path, {
+        'destination': destination, 'lat_min': lat_min, 'lng_min': lng_min,
+        'lat_step': lat_step, 'lng_step': lng_step, 'rows': rows, 'cols': cols,
+        'bands': TRAVEL_TIME_BANDS, 'cells': len(cells), 'built_at': now.isoformat()
+    })
+    field.load()
+    return len(cells) * len(TRAVEL_TIME_BANDS)
+
+# Ночной пересчет полей времени в пути (JobQueue). Точки из архива читаются один раз на все пункты назначения
+async def refresh_travel_time_fields(context):
+    try:
+        points = await asyncio.to_thread(lambda: list(recent_stop_points()))
+    except Exception:
+        logger.exception("Не удалось прочитать архив маршрутов для полей времени в пути")
+        return
+    for name, destination in TRAVEL_TIME_DESTINATIONS.items():
+        try:
+            elements = await asyncio.to_thread(build_travel_time_field, name, destination, points)
+        except Exception:
+            logger.exception(f"Не удалось обновить поле времени в пути '{name}'")
+            continue
+        if not elements:
+            logger.info(f"Поле времени в пути '{name}' не построено: в архиве нет маршрутов за {TRAVEL_TIME_HISTORY_DAYS} дн.")
+            continue
+        publish_change('travel_time_field', None, name)
+        logger.info(f"Поле времени в пути '{name}' обновлено, запрошено элементов Distance Matrix: {elements}")
+
+# Нижняя оценка длительности маршрута по полю: из любой точки маршрута еще нужно доехать до пункта назначения
+def route_duration_lower_bound(points, destination=workplace_location, moment=None):
+    field = next((travel_time_fields[name] for name, location in TRAVEL_TIME_DESTINATIONS.items() if location == destination), None)
+    if not field:
+        return None
+    estimates = [field.lookup(point, moment) for point in points]
+    estimates = [estimate for estimate in estimates if estimate is not None]
+    return max(estimates) if estimates else None
+
+# Поля времени в пути (файлы отображаются в память при запуске, см. load_state)
+travel_time_fields = {name: TravelTimeField(name) for name in TRAVEL_TIME_DESTINATIONS}
+
+def load_travel_time_fields():
+    for field in travel_time_fields.values():
+        field.load()
+
+# Функция для получения координат из адреса
+def get_coordinates(address):
+    try:
+        geocode_result = call_maps(gmaps.geocode, address)
+        if geocode_result and len(geocode_result) > 0:
+            location = geocode_result[0]['geometry']['location']
+            latitude = location['lat']
+            longitude = location['lng']
+            return f"{latitude},{longitude}"
+        else:
+            return None
+    except MapsUnavailable:
+        logger.info("Google Maps недоступен, геокодирование пропущено")
+        return None
+    except Exception as e:
+        logger.exception("Ошибка при получении координат из адреса")
+        return None
@@ -0,0 +1,217 @@
+# Профилирование обработчиков по команде главного администратора
+import os
+import re
+import sys
+import time
+import random
+import pstats
+import cProfile
+import threading
+from telegram.ext import ConversationHandler
+from . import sync
+from .config import PROFILE_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_SAMPLE_RATE
+
+# Накопленные данные одного обработчика: число вызовов и их длительность, профили cProfile
+# и свернутые стеки из выборок
+class HandlerProfile:
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.profiled = 0
+        self.stats = None
+        self.samples = {}  # свернутый стек -> число выборок
+
+# Профилировщик обработчиков. Режимы:
+# cprofile — cProfile для заданной доли обновлений (одновременно не больше одного профиля; пока обработчик
+# ждет ввода-вывода, в профиль попадает и работа других обработчиков в том же цикле событий);
+# sample — отдельный поток с заданным интервалом снимает стек цикла событий и относит его к выполняемому
+# обработчику (учитывается только время процессора, ожидание ввода-вывода в стеки не попадает).
+# Выключенный профилировщик добавляет к вызову обработчика одну проверку
+class Profiler:
+    def __init__(self):
+        self.mode = None
+        self.fraction = PROFILE_SAMPLE_RATE
+        self.interval = PROFILE_SAMPLE_INTERVAL
+        self.started = None
+        self.handlers = {}
+        self.codes = {}  # код функции обработчика -> имя обработчика
+        self._lock = threading.Lock()
+        self._active = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    # Обертка функций всех обработчиков приложения, включая обработчики внутри ConversationHandler
+    def instrument(self, application):
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    nested = list(handler.entry_points) + list(handler.fallbacks)
+                    for state_handlers in handler.states.values():
+                        nested.extend(state_handlers)
+                    for conversation_handler in nested:
+                        self.wrap(conversation_handler)
+                else:
+                    self.wrap(handler)
+
+    def wrap(self, handler):
+        callback = handler.callback
+        name = getattr(callback, '__name__', type(handler).__name__)
+        if hasattr(callback, '__code__'):
+            self.codes[callback.__code__] = name
+
+        def profiled(update, context):
+            if self.mode is None:
+                return callback(update, context)
+            return self.run(name, callback, update, context)
+
+        handler.callback = profiled
+
+    # Включение режима; value — доля обновлений для cprofile или интервал (секунды) для sample.
+    # Вызывается в потоке цикла событий: его стек и снимает поток выборки
+    def start(self, mode, value=None):
+        self.stop()
+        if mode == 'cprofile':
+            self.fraction = PROFILE_SAMPLE_RATE if value is None else value
+        else:
+            self.interval = PROFILE_SAMPLE_INTERVAL if value is None else value
+            self._stop.clear()
+            self._sampler = threading.Thread(
+                target=self._sample, args=(threading.get_ident(),), name='profiler-sampler', daemon=True
+            )
+            self._sampler.start()
+        self.mode = mode
+        self.started = time.time()
+
+    def stop(self):
+        self.mode = None
+        if self._sampler:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+
+    def reset(self):
+        with self._lock:
+            self.handlers = {}
+
+    async def run(self, name, callback, update, context):
+        profile = None
+        if self.mode == 'cprofile' and self._active is None and random.random() < self.fraction:
+            profile = self._active = cProfile.Profile()
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile:
+                profile.disable()
+                self._active = None
+            with self._lock:
+                entry = self.handlers.setdefault(name, HandlerProfile())
+                entry.calls += 1
+                entry.total += elapsed
+                entry.max = max(entry.max, elapsed)
+                if profile:
+                    entry.profiled += 1
+                    if entry.stats is None:
+                        entry.stats = pstats.Stats(profile)
+                    else:
+                        entry.stats.add(profile)
+
+    # Поток выборки: стек относится к самому внешнему обработчику в нем, стеки вне обработчиков пропускаются
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            for position in range(len(codes) - 1, -1, -1):
+                name = self.codes.get(codes[position])
+                if name:
+                    break
+            else:
+                continue
+            stack = ';'.join([name] + [frame_label(code) for code in reversed(codes[:position])])
+            with self._lock:
+                samples = self.handlers.setdefault(name, HandlerProfile()).samples
+                samples[stack] = samples.get(stack, 0) + 1
+
+    # Запись результатов в каталог: профиль cProfile каждого обработчика и общий (pstats),
+    # свернутые стеки для flamegraph.pl / speedscope; возвращает список файлов
+    def dump(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        # Под блокировкой: профили не меняются, пока записываются
+        with self._lock:
+            entries = sorted(self.handlers.items())
+            combined = None
+            for name, entry in entries:
+                if entry.stats is None:
+                    continue
+                path = os.path.join(directory, f"{re.sub(r'[^A-Za-z0-9_]+', '_', name)}.pstats")
+                entry.stats.dump_stats(path)
+                files.append(path)
+                if combined is None:
+                    combined = pstats.Stats(path)
+                else:
+                    combined.add(entry.stats)
+            if combined is not None:
+                path = os.path.join(directory, 'all.pstats')
+                combined.dump_stats(path)
+                files.append(path)
+            lines = [f"{stack} {count}" for _, entry in entries for stack, count in entry.samples.items()]
+
+        if lines:
+            path = os.path.join(directory, 'stacks.collapsed')
+            with open(path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            files.append(path)
+        return files
+
+    # Текстовая сводка: обработчики с наибольшим суммарным временем
+    def summary(self, limit=15):
+        if self.mode == 'cprofile':
+            header = f"Профилирование: cProfile, доля обновлений {self.fraction:g}"
+        elif self.mode == 'sample':
+            header = f"Профилирование: выборка стеков каждые {self.interval * 1000:g} мс"
+        else:
+            header = "Профилирование выключено"
+        if self.mode and self.started:
+            header += f" (с {time.strftime('%d.%m %H:%M:%S', time.localtime(self.started))})"
+        with self._lock:
+            entries = sorted(self.handlers.items(), key=lambda item: item[1].total, reverse=True)
+        lines = [header]
+        for name, entry in entries[:limit]:
+            line = f"{name}: {entry.calls} выз."
+            if entry.calls:
+                line += f", среднее {entry.total / entry.calls * 1000:.1f} мс, макс. {entry.max * 1000:.1f} мс"
+            if entry.profiled:
+                line += f", профилей {entry.profiled}"
+            if entry.samples:
+                line += f", выборок {sum(entry.samples.values())}"
+            lines.append(line)
+        if not entries:
+            lines.append("Данных пока нет.")
+        return "\n".join(lines)
+
+# Каталог результатов одного сброса; у каждого воркера свой
+def profile_directory(stamp):
+    return os.path.join(PROFILE_DIR, f"{stamp}-worker{sync.worker_index or 0}")
+
+# Команда профилировщику: от главного администратора или от другого воркера
+def control_profiler(action, value=None):
+    if action == 'off':
+        profiler.stop()
+    elif action == 'reset':
+        profiler.reset()
+    elif action == 'dump':
+        return profiler.dump(profile_directory(value))
+    else:
+        profiler.start(action, value)
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+profiler = Profiler()
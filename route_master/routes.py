@@ -0,0 +1,414 @@
+# Маршруты: модель, блокировки, архив и жизненный цикл
+import os
+import asyncio
+import json
+import glob
+import fcntl
+import time
+import datetime
+import contextlib
+import concurrent.futures
+from . import sync
+from .config import ROUTE_ARCHIVE_DIR, ROUTE_LEASE_TIMEOUT, STOP_CLUSTER_RADIUS, logger
+from .crypto import decrypt_record, encrypt_record
+from .geo import centroid, grid_cell, haversine_distance
+from .sync import publish_change, publish_route
+from .stats import stats
+from .trips import trip_recorder
+
+# Этапы жизненного цикла маршрута: набор пассажиров, набор завершен, водитель в пути, маршрут выполнен
+ROUTE_OPEN = 'open'
+ROUTE_FINISHED = 'finished'
+ROUTE_ACTIVE = 'active'
+ROUTE_COMPLETED = 'completed'
+
+ROUTE_STATUS_NAMES = {
+    ROUTE_OPEN: 'Открыт',
+    ROUTE_FINISHED: 'Набор завершен',
+    ROUTE_ACTIVE: 'В пути',
+    ROUTE_COMPLETED: 'Завершен',
+}
+
+# Класс для представления маршрута
+class Route:
+    # Поля с координатами: вне процесса хранятся только в виде одной зашифрованной записи
+    ENCRYPTED_FIELDS = ('origin', 'current_location', 'pickup_locations', 'stops', 'eta', 'planned_polyline')
+
+    def __init__(self, driver_id, origin):
+        self.driver_id = driver_id
+        self.origin = origin
+        self.current_location = None  # Текущее местоположение водителя
+        self.pickup_locations = []
+        self.passenger_ids = []
+        # Остановки: пассажиры, живущие рядом, садятся в одной точке
+        # ({'location': центр, 'points': точки посадки, 'passenger_ids': пассажиры})
+        self.stops = []
+        self.status = ROUTE_OPEN
+        self.eta = {}  # ETA к каждой точке
+        self.notified_passengers = set()  # Пассажиры, которым отправлено уведомление
+        self.pickup_order = []  # Новый список для хранения порядка остановок
+        self.next_stop_index = 0  # Индекс следующей остановки для уведомления
+        self.eta_predictions = {}  # Первый прогноз прибытия к остановке по источникам, для оценки точности ETA
+        self.planned_duration = None  # Плановая длительность после оптимизации (секунды)
+        self.planned_polyline = None  # Полилиния оптимизированного маршрута
+        self.created_at = datetime.datetime.now().isoformat()
+        self.finished_at = None
+        self.completed_at = None
+        self.arrived_at = None  # Время прибытия в пункт назначения (только у маршрутов, выполненных до конца)
+        self.last_activity = time.time()  # Время последнего изменения, для вытеснения по TTL
+        self._stop_grid = None
+
+    @property
+    def is_open(self):
+        return self.status == ROUTE_OPEN
+
+    @property
+    def stop_locations(self):
+        return [stop['location'] for stop in self.stops]
+
+    # Сетка остановок: ячейка первой точки остановки -> индексы остановок (строится при первом обращении)
+    def _grid(self):
+        if self._stop_grid is None:
+            self._stop_grid = {}
+            for index, stop in enumerate(self.stops):
+                self._stop_grid.setdefault(grid_cell(stop['points'][0]), []).append(index)
+        return self._stop_grid
+
+    # Ближайшая остановка в пределах радиуса кластеризации (поиск по соседним ячейкам сетки)
+    def find_stop(self, location):
+        row, column = grid_cell(location)
+        grid = self._grid()
+        best_index, best_distance = None, STOP_CLUSTER_RADIUS
+        for d_row in (-1, 0, 1):
+            for d_column in (-1, 0, 1):
+                for index in grid.get((row + d_row, column + d_column), ()):
+                    distance = haversine_distance(location, self.stops[index]['location'])
+                    if distance <= best_distance:
+                        best_index, best_distance = index, distance
+        return best_index
+
+    # Остановки маршрута, какими они станут после добавления точки (без изменения маршрута)
+    def stop_locations_with(self, location):
+        locations = self.stop_locations
+        index = self.find_stop(location)
+        if index is None:
+            return locations + [location]
+        locations[index] = centroid(self.stops[index]['points'] + [location])
+        return locations
+
+    def add_passenger(self, location, passenger_id):
+        self.pickup_locations.append(location)
+        self.passenger_ids.append(passenger_id)
+        index = self.find_stop(location)
+        if index is None:
+            self.stops.append({'location': location, 'points': [location], 'passenger_ids': [passenger_id]})
+            self._grid().setdefault(grid_cell(location), []).append(len(self.stops) - 1)
+        else:
+            stop = self.stops[index]
+            stop['points'].append(location)
+            stop['passenger_ids'].append(passenger_id)
+            stop['location'] = centroid(stop['points'])
+
+    # Перестановка остановок в порядке оптимизированного маршрута; списки пассажиров следуют за остановками
+    def reorder_stops(self, order):
+        self.stops = [self.stops[i] for i in order]
+        self._sync_passengers()
+
+    def _sync_passengers(self):
+        self.pickup_locations = [point for stop in self.stops for point in stop['points']]
+        self.passenger_ids = [passenger_id for stop in self.stops for passenger_id in stop['passenger_ids']]
+        self._stop_grid = None
+
+    def stop_index_of(self, passenger_id):
+        return next((index for index, stop in enumerate(self.stops) if passenger_id in stop['passenger_ids']), None)
+
+    # Удаление пассажира (отмена поездки или неявка) за один проход по остановкам. Опустевшая остановка
+    # удаляется, индексы следующей остановки и прогнозов сдвигаются. Возвращает (индекс остановки, удалена ли она)
+    def remove_passenger(self, passenger_id):
+        index = self.stop_index_of(passenger_id)
+        if index is None:
+            return None, False
+        stop = self.stops[index]
+        position = stop['passenger_ids'].index(passenger_id)
+        del stop['passenger_ids'][position]
+        del stop['points'][position]
+        self.eta.pop(stop['location'], None)
+        self.eta_predictions.pop(str(index), None)
+        self.notified_passengers.discard(passenger_id)
+        removed = not stop['points']
+        if removed:
+            del self.stops[index]
+            if index < len(self.pickup_order):
+                del self.pickup_order[index]
+            if index < self.next_stop_index:
+                self.next_stop_index -= 1
+            self.eta_predictions = {
+                str(int(key) - (int(key) > index)): value for key, value in self.eta_predictions.items()
+            }
+        else:
+            stop['location'] = centroid(stop['points'])
+        self._sync_passengers()
+        return index, removed
+
+    # Доводка порядка после удаления остановки: лучший ход 2-opt среди ходов, разрывающих новое ребро
+    # на месте удаленной остановки (по расстоянию по прямой). Остальной порядок, полученный
+    # от Google Maps, не трогается. Возвращает позицию, с которой порядок изменился, или None
+    def repair_order(self, index, destination):
+        start = self.next_stop_index
+        if index < start:
+            return None
+        if self.current_location:
+            anchor = self.current_location
+        else:
+            anchor = self.stops[start - 1]['location'] if start else self.origin
+        tour = [anchor] + [stop['location'] for stop in self.stops[start:]] + [destination]
+        junction = index - start  # ребро tour[junction] -> tour[junction + 1]
+        best_delta, best_move = -1.0, None
+        for i in range(1, len(tour) - 2):
+            for j in range(i + 1, len(tour) - 1):
+                if junction not in (i - 1, j):
+                    continue
+                delta = (
+                    haversine_distance(tour[i - 1], tour[j]) + haversine_distance(tour[i], tour[j + 1])
+                    - haversine_distance(tour[i - 1], tour[i]) - haversine_distance(tour[j], tour[j + 1])
+                )
+                if delta < best_delta:
+                    best_delta, best_move = delta, (i, j)
+        if not best_move:
+            return None
+        i, j = best_move
+        first, last = start + i - 1, start + j
+        self.stops[first:last] = self.stops[first:last][::-1]
+        if last <= len(self.pickup_order):
+            self.pickup_order[first:last] = self.pickup_order[first:last][::-1]
+        self.eta_predictions = {key: value for key, value in self.eta_predictions.items() if not first <= int(key) < last}
+        self._sync_passengers()
+        return first
+
+    def to_dict(self):
+        data = {
+            name: value for name, value in self.__dict__.items()
+            if name not in self.ENCRYPTED_FIELDS and not name.startswith('_')
+        }
+        data['notified_passengers'] = list(self.notified_passengers)
+        data['record'] = encrypt_record({name: getattr(self, name) for name in self.ENCRYPTED_FIELDS})
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        route = cls.__new__(cls)
+        route.update_from_dict(data)
+        return route
+
+    # Обновление на месте, чтобы обработчики, уже получившие объект маршрута, видели новые данные
+    def update_from_dict(self, data):
+        data = dict(data)
+        self.__dict__.update(decrypt_record(data.pop('record')))
+        self.__dict__.update(data)
+        self.notified_passengers = set(data['notified_passengers'])
+        self.__dict__.setdefault('eta_predictions', {})
+        self.__dict__.setdefault('arrived_at', None)
+        self._stop_grid = None
+
+# Глобальный словарь маршрутов
+routes = {}
+
+# Блокировки маршрутов (по ID водителя): изменения одного маршрута выполняются последовательно
+route_locks = {}
+
+# Блокировка маршрута. В режиме нескольких воркеров дополнительно берется межпроцессная
+# блокировка в общем хранилище: при входе маршрут обновляется из хранилища, при выходе — публикуется.
+# route — маршрут водителя на момент входа: пока ожидали блокировку, маршрут могли завершить
+# или заменить новым, поэтому объект, полученный до блокировки, сверяется с ним
+class RouteLock:
+    def __init__(self, driver_id):
+        self.driver_id = driver_id
+        self.local_lock = route_locks.setdefault(driver_id, asyncio.Lock())
+        self.route = None
+
+    async def __aenter__(self):
+        await self.local_lock.acquire()
+        if sync.shared_store:
+            try:
+                await sync.shared_store.acquire_lease(f"route:{self.driver_id}", ROUTE_LEASE_TIMEOUT)
+                await refresh_route(self.driver_id)
+            except BaseException:
+                self.local_lock.release()
+                raise
+        self.route = routes.get(self.driver_id)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            route = routes.get(self.driver_id)
+            if route:
+                route.last_activity = time.time()
+            if sync.shared_store:
+                if route:
+                    publish_route(route)
+                sync.shared_store.release_lease(f"route:{self.driver_id}")
+        finally:
+            self.local_lock.release()
+
+def get_route_lock(driver_id):
+    return RouteLock(driver_id)
+
+# Обновление локальной копии маршрута из общего хранилища
+async def refresh_route(driver_id):
+    data = await asyncio.to_thread(sync.shared_store.get, 'route', driver_id)
+    if data:
+        apply_route_data(data)
+    else:
+        # Маршрут уже завершен другим воркером
+        route_lifecycle.forget(driver_id)
+
+def apply_route_data(data):
+    route = routes.get(data['driver_id'])
+    if route:
+        route.update_from_dict(data)
+    else:
+        route = routes[data['driver_id']] = Route.from_dict(data)
+    route_lifecycle.track(route)
+
+# Архив выполненных маршрутов на диске: по файлу на месяц, одна компактная JSON-строка на маршрут
+# (координаты внутри записи зашифрованы)
+# Файлы архива меняют и другие воркеры, поэтому дозапись и перезапись файла месяца сериализуются
+# межпроцессной блокировкой (flock на отдельном файле .lock: сам файл архива при перезаписи заменяется).
+# Запись на диск идет в отдельном потоке, по порядку, чтобы не задерживать обработку обновлений
+class RouteArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def path_for(self, moment):
+        return os.path.join(self.directory, f"routes-{moment.strftime('%Y-%m')}.jsonl")
+
+    @contextlib.contextmanager
+    def locked(self, path):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Запись маршрута в архив; возвращает future записи (ошибки записи попадают в лог)
+    def append(self, route):
+        line = json.dumps(route.to_dict(), separators=(',', ':'), ensure_ascii=False)
+        path = self.path_for(datetime.datetime.fromisoformat(route.completed_at))
+        return self._writer.submit(self._write, path, line, route.driver_id)
+
+    def _write(self, path, line, driver_id):
+        try:
+            with self.locked(path):
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+        except OSError:
+            logger.exception(f"Не удалось записать маршрут {driver_id} в архив")
+
+    def files(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'routes-*.jsonl')))
+
+    # Построчное чтение архива без загрузки файла целиком
+    def iter_records(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    # Маршруты, завершенные в полуинтервале [start, end), с расшифрованными полями. Файлы архива помесячные,
+    # месяцы вне периода не читаются; записи, которые не удалось расшифровать, пропускаются и попадают в skipped
+    def iter_routes(self, start, end, skipped=None):
+        first_month, last_month = start.strftime('%Y-%m'), (end - datetime.timedelta(microseconds=1)).strftime('%Y-%m')
+        for path in self.files():
+            month = os.path.basename(path)[len('routes-'):-len('.jsonl')]
+            if not first_month <= month <= last_month:
+                continue
+            for data in self.iter_records(path):
+                completed_at = data.get('completed_at')
+                if not completed_at or not start <= datetime.datetime.fromisoformat(completed_at) < end:
+                    continue
+                try:
+                    data.update(decrypt_record(data.pop('record')))
+                except Exception as e:
+                    logger.error(f"Не удалось расшифровать архивный маршрут {data.get('driver_id')}: {e}")
+                    if skipped is not None:
+                        skipped.append(data.get('driver_id'))
+                    continue
+                yield data
+
+    # Перезапись файла архива с преобразованием записей (например, при смене ключа шифрования).
+    # Дозапись других воркеров ждет блокировку и попадает уже в новый файл
+    def rewrite(self, path, transform):
+        changed = 0
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with self.locked(path):
+            with open(path, 'r', encoding='utf-8') as source, open(temp_path, 'w', encoding='utf-8') as target:
+                for line in source:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    new_record = transform(record)
+                    if new_record is not None:
+                        record = new_record
+                        changed += 1
+                    target.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n')
+            os.replace(temp_path, path)
+        return changed
+
+route_archive = RouteArchive(ROUTE_ARCHIVE_DIR)
+
+# Жизненный цикл маршрутов: в памяти хранятся только живые маршруты, открытые — в отдельном индексе,
+# выполненные и простаивающие маршруты уходят в архив
+class RouteLifecycle:
+    def __init__(self, archive):
+        self.archive = archive
+        self.open_routes = {}
+
+    def track(self, route):
+        if route.is_open:
+            self.open_routes[route.driver_id] = route
+        else:
+            self.open_routes.pop(route.driver_id, None)
+
+    def forget(self, driver_id):
+        routes.pop(driver_id, None)
+        self.open_routes.pop(driver_id, None)
+
+    def first_open(self):
+        return next(iter(self.open_routes.values()), None)
+
+    def create(self, route):
+        previous = routes.get(route.driver_id)
+        if previous:
+            self.complete(previous)
+        routes[route.driver_id] = route
+        self.track(route)
+        stats.route_created()
+        publish_route(route)
+
+    # Набор пассажиров завершен
+    def finish(self, route):
+        route.status = ROUTE_FINISHED
+        route.finished_at = datetime.datetime.now().isoformat()
+        self.track(route)
+
+    # Водитель начал передавать местоположение
+    def activate(self, route):
+        if route.status == ROUTE_FINISHED:
+            route.status = ROUTE_ACTIVE
+
+    # Маршрут завершен (arrived — водитель прибыл в пункт назначения): запись в архив и удаление из памяти
+    # Завершенным в статистике считается только маршрут, прошедший /finish (см. finish_route)
+    def complete(self, route, arrived=False):
+        route.status = ROUTE_COMPLETED
+        route.completed_at = datetime.datetime.now().isoformat()
+        if arrived:
+            route.arrived_at = route.completed_at
+        self.archive.append(route)
+        trip_recorder.close(route)
+        self.forget(route.driver_id)
+        publish_change('route', route.driver_id, None)
+
+route_lifecycle = RouteLifecycle(route_archive)
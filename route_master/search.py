@@ -0,0 +1,183 @@
+# Полнотекстовый поиск по тикетам: стемминг русских слов и инвертированный индекс
+import re
+import math
+import heapq
+import functools
+
+# Стеммер Snowball для русского языка (алгоритм Портера): отбрасывает окончания,
+# чтобы "автобус", "автобуса" и "автобусом" находились одним запросом
+VOWELS = 'аеиоуыэюя'
+
+# Окончания: 1 — только после "а" или "я" (сама буква остается), 2 — без условия
+def endings(first, second=()):
+    groups = {suffix: 1 for suffix in first}
+    groups.update({suffix: 2 for suffix in second})
+    return groups
+
+PERFECTIVE_GERUND = endings(['в', 'вши', 'вшись'], ['ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'])
+ADJECTIVE = endings([], [
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'
+])
+PARTICIPLE = endings(['ем', 'нн', 'вш', 'ющ', 'щ'], ['ивш', 'ывш', 'ующ'])
+REFLEXIVE = endings([], ['ся', 'сь'])
+VERB = endings(
+    ['ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'],
+    ['ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+     'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю']
+)
+NOUN = endings([], [
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+    'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я'
+])
+SUPERLATIVE = endings([], ['ейш', 'ейше'])
+DERIVATIONAL = endings([], ['ост', 'ость'])
+
+# Длина самого длинного окончания из группы, которое целиком лежит в области слова от start (0 — нет)
+def match_ending(word, start, group):
+    for length in range(min(6, len(word) - start), 0, -1):
+        kind = group.get(word[-length:])
+        if kind is None:
+            continue
+        if kind == 1 and (len(word) - length - 1 < start or word[-length - 1] not in 'ая'):
+            return 0
+        return length
+    return 0
+
+# Начало области после первой согласной, следующей за гласной (R1, а от R1 — R2)
+def region_after(word, start):
+    for index in range(start + 1, len(word)):
+        if word[index] not in VOWELS and word[index - 1] in VOWELS:
+            return index + 1
+    return len(word)
+
+@functools.lru_cache(maxsize=100000)
+def stem(word):
+    word = word.replace('ё', 'е')
+    rv = next((index + 1 for index, char in enumerate(word) if char in VOWELS), len(word))
+    r2 = region_after(word, region_after(word, 0))
+
+    # Шаг 1: деепричастие или (возвратная частица и) прилагательное, причастие, глагол, существительное
+    length = match_ending(word, rv, PERFECTIVE_GERUND)
+    if length:
+        word = word[:-length]
+    else:
+        length = match_ending(word, rv, REFLEXIVE)
+        if length:
+            word = word[:-length]
+        length = match_ending(word, rv, ADJECTIVE)
+        if length:
+            word = word[:-length]
+            length = match_ending(word, rv, PARTICIPLE)
+            if length:
+                word = word[:-length]
+        else:
+            length = match_ending(word, rv, VERB) or match_ending(word, rv, NOUN)
+            if length:
+                word = word[:-length]
+
+    # Шаг 2: конечное "и"
+    if word.endswith('и') and len(word) > rv:
+        word = word[:-1]
+
+    # Шаг 3: словообразовательный суффикс в R2
+    length = match_ending(word, r2, DERIVATIONAL)
+    if length:
+        word = word[:-length]
+
+    # Шаг 4: превосходная степень, двойное "н" и мягкий знак
+    length = match_ending(word, rv, SUPERLATIVE)
+    if length:
+        word = word[:-length]
+    if word.endswith('нн') and len(word) - 1 > rv:
+        word = word[:-1]
+    elif not length and word.endswith('ь') and len(word) > rv:
+        word = word[:-1]
+    return word
+
+# Служебные слова не индексируются: они есть почти в каждом тикете
+STOP_WORDS = frozenset(
+    'и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было '
+    'вот от меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до вас нибудь '
+    'опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была '
+    'сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним '
+    'здесь этом один почти мой тем чтобы нее были куда зачем всех никогда можно при наконец два об другой '
+    'хоть после над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо '
+    'свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между'.split()
+)
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Термы текста: слова в нижнем регистре, русские слова — основы после стемминга
+def tokenize(text):
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        terms.append(stem(word) if 'а' <= word[0] <= 'я' or word[0] == 'ё' else word)
+    return terms
+
+# Индексируемые поля тикета и их вес (совпадение в имени пользователя важнее)
+TICKET_SEARCH_FIELDS = (('message', 1), ('admin_reply', 1), ('user_name', 2))
+
+# Инвертированный индекс тикетов с ранжированием BM25: терм -> {ID тикета: вес терма в тикете}
+class TicketSearchIndex:
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}  # ID тикета -> {терм: вес}
+        self.lengths = {}
+        self.timestamps = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def clear(self):
+        self.__init__()
+
+    # Добавление или переиндексация тикета (после ответа администратора)
+    def add(self, ticket):
+        self.remove(ticket['id'])
+        terms = {}
+        for field, weight in TICKET_SEARCH_FIELDS:
+            for term in tokenize(ticket.get(field) or ''):
+                terms[term] = terms.get(term, 0) + weight
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[ticket['id']] = frequency
+        self.documents[ticket['id']] = terms
+        self.lengths[ticket['id']] = sum(terms.values())
+        self.timestamps[ticket['id']] = ticket['timestamp']
+        self.total_length += self.lengths[ticket['id']]
+
+    def remove(self, ticket_id):
+        terms = self.documents.pop(ticket_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            documents = self.postings[term]
+            del documents[ticket_id]
+            if not documents:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(ticket_id)
+        del self.timestamps[ticket_id]
+
+    # ID тикетов по убыванию релевантности (при равной — сначала более новые)
+    def search(self, query, limit):
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = self.total_length / count or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (count - len(documents) + 0.5) / (len(documents) + 0.5))
+            for ticket_id, frequency in documents.items():
+                norm = self.K1 * (1 - self.B + self.B * self.lengths[ticket_id] / average_length)
+                scores[ticket_id] = scores.get(ticket_id, 0) + idf * frequency * (self.K1 + 1) / (frequency + norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], self.timestamps[item[0]]))
+        return [ticket_id for ticket_id, _ in best]
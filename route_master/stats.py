@@ -0,0 +1,131 @@
+# Статистика для отчетов
+import json
+import datetime
+from . import sync
+from .config import STATS_DAILY_RETENTION, STATS_FILE, STATS_HOURLY_RETENTION
+from .sync import publish_change
+from .storage import write_json_atomic
+
+# Счетчики для отчетов: обновляются при каждом изменении тикетов и маршрутов
+# и сворачиваются в почасовые и посуточные агрегаты, чтобы /reports не пересчитывал историю
+class StatsAggregator:
+    BUCKET_FIELDS = (
+        'routes_created', 'routes_finished', 'passengers',
+        'duration_sum', 'duration_count',
+        'tickets_created', 'tickets_closed',
+        'response_sum', 'response_count'
+    )
+
+    def __init__(self):
+        self.tickets_total = 0
+        self.tickets_open = 0
+        self.hourly = {}
+        self.daily = {}
+        self.dirty = False  # Есть изменения, еще не записанные в файл (см. flush_stats)
+
+    # Начальные значения счетчиков тикетов (единственный проход по списку при запуске)
+    def init_tickets(self, tickets):
+        self.tickets_total = len(tickets)
+        self.tickets_open = sum(1 for t in tickets if t['status'] != 'Закрыт')
+
+    # Событие статистики: изменения текущих счетчиков и значения для агрегатов на момент at.
+    # В режиме нескольких воркеров события рассылаются остальным процессам
+    def _record(self, counters=None, **values):
+        event = {'at': datetime.datetime.now().isoformat(), 'counters': counters or {}, 'values': values}
+        self.apply(event)
+        publish_change('stats', None, event)
+
+    def apply(self, event):
+        self.dirty = True
+        for name, delta in event['counters'].items():
+            setattr(self, name, getattr(self, name) + delta)
+        at = datetime.datetime.fromisoformat(event['at'])
+        for buckets, key, retention in (
+            (self.hourly, at.strftime('%Y-%m-%dT%H'), STATS_HOURLY_RETENTION),
+            (self.daily, at.strftime('%Y-%m-%d'), STATS_DAILY_RETENTION)
+        ):
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = dict.fromkeys(self.BUCKET_FIELDS, 0)
+                # Ключи идут по возрастанию времени, поэтому удаляем самые старые
+                while len(buckets) > retention:
+                    del buckets[next(iter(buckets))]
+            for field, value in event['values'].items():
+                bucket[field] += value
+
+    def route_created(self):
+        self._record(routes_created=1)
+
+    # Пассажир покинул маршрут после завершения набора (при завершении он уже был учтен)
+    def passenger_removed(self):
+        self._record(passengers=-1)
+
+    def route_finished(self, route, total_duration=None):
+        values = {'routes_finished': 1, 'passengers': len(route.passenger_ids)}
+        if total_duration:
+            values['duration_sum'] = total_duration
+            values['duration_count'] = 1
+        self._record(**values)
+
+    def ticket_created(self):
+        self._record(counters={'tickets_total': 1, 'tickets_open': 1}, tickets_created=1)
+
+    def ticket_status_changed(self, old_status, new_status):
+        if old_status != 'Закрыт' and new_status == 'Закрыт':
+            self._record(counters={'tickets_open': -1}, tickets_closed=1)
+        elif old_status == 'Закрыт' and new_status != 'Закрыт':
+            self._record(counters={'tickets_open': 1}, tickets_closed=-1)
+
+    def ticket_answered(self, ticket):
+        created = datetime.datetime.fromisoformat(ticket['timestamp'])
+        response_time = int((datetime.datetime.now() - created).total_seconds())
+        self._record(response_sum=response_time, response_count=1)
+
+    # Сумма агрегатов по заданным корзинам
+    def _sum(self, buckets, keys):
+        total = dict.fromkeys(self.BUCKET_FIELDS, 0)
+        for key in keys:
+            bucket = buckets.get(key)
+            if bucket:
+                for field in self.BUCKET_FIELDS:
+                    total[field] += bucket[field]
+        return total
+
+    def last_hours(self, hours):
+        now = datetime.datetime.now()
+        keys = [(now - datetime.timedelta(hours=i)).strftime('%Y-%m-%dT%H') for i in range(hours)]
+        return self._sum(self.hourly, keys)
+
+    def last_days(self, days, offset=0):
+        now = datetime.datetime.now()
+        keys = [(now - datetime.timedelta(days=offset + i)).strftime('%Y-%m-%d') for i in range(days)]
+        return self._sum(self.daily, keys)
+
+    def to_dict(self):
+        return {'hourly': self.hourly, 'daily': self.daily}
+
+# Функции для работы со статистикой
+def load_stats(stats):
+    try:
+        with open(STATS_FILE, 'r') as f:
+            data = json.load(f)
+        stats.hourly = dict(sorted(data.get('hourly', {}).items()))
+        stats.daily = dict(sorted(data.get('daily', {}).items()))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+def save_stats(stats):
+    # В режиме нескольких воркеров файл пишет только первый воркер
+    if sync.worker_index:
+        return
+    write_json_atomic(STATS_FILE, stats.to_dict())
+
+# Запись статистики, если она изменилась с прошлой записи: не на каждое событие, а периодически
+# (вместе с вытеснением простаивающих маршрутов) и при остановке
+def flush_stats():
+    if stats.dirty:
+        stats.dirty = False
+        save_stats(stats)
+
+# Статистика (загружается при запуске, см. load_state)
+stats = StatsAggregator()
@@ -0,0 +1,277 @@
+# Белый список и тикеты поддержки в JSON-файлах
+import os
+import re
+import json
+import time
+import heapq
+import bisect
+from .config import (
+    MAIN_ADMIN_ID, ROLE_ALIASES, TICKETS_FILE, TICKET_PRIORITIES, TRIAGE_CLAIM_TIMEOUT, WHITELIST_FILE,
+    WHITELIST_ROLES_FILE
+)
+from . import sync
+from .sync import publish_changes
+from .search import TicketSearchIndex
+
+# Запись JSON-файла через временный файл, чтобы файл не оказался записан наполовину
+def write_json_atomic(path, data):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+# Функции для работы с белым списком
+def load_whitelist():
+    try:
+        with open(WHITELIST_FILE, 'r') as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        with open(WHITELIST_FILE, 'w') as f:
+            json.dump([], f)
+        return set()
+    except json.JSONDecodeError:
+        return set()
+
+# В режиме нескольких воркеров файлы белого списка, ролей и тикетов пишет только первый воркер:
+# он применяет изменения всех воркеров, поэтому файл отражает объединенное состояние
+def save_whitelist(whitelist):
+    if sync.worker_index:
+        return
+    write_json_atomic(WHITELIST_FILE, sorted(whitelist))
+
+# Изменение белого списка. Другим воркерам рассылаются только добавленные и удаленные ID,
+# чтобы одновременные изменения в разных воркерах не затирали друг друга
+def update_whitelist(added=(), removed=()):
+    added = [user_id for user_id in added if user_id not in whitelist]
+    removed = [user_id for user_id in removed if user_id in whitelist]
+    whitelist.difference_update(removed)
+    whitelist.update(added)
+    save_whitelist(whitelist)
+    publish_changes('whitelist', [(user_id, None) for user_id in removed] + [(user_id, user_id) for user_id in added])
+
+# Белый список (заполняется при запуске, см. load_state)
+whitelist = set()
+
+# Роли, назначенные при массовом импорте (ID пользователя -> роль): пользователь с назначенной ролью
+# входит только под ней, остальные выбирают роль сами
+def load_whitelist_roles():
+    try:
+        with open(WHITELIST_ROLES_FILE, 'r') as f:
+            return {int(user_id): role for user_id, role in json.load(f).items()}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_whitelist_roles(roles):
+    if sync.worker_index:
+        return
+    write_json_atomic(WHITELIST_ROLES_FILE, {str(user_id): role for user_id, role in roles.items()})
+
+# Изменение ролей ({ID: роль или None — снять роль}); рассылаются только изменившиеся роли
+def update_whitelist_roles(changes):
+    changes = {user_id: role for user_id, role in changes.items() if whitelist_roles.get(user_id) != role}
+    for user_id, role in changes.items():
+        if role:
+            whitelist_roles[user_id] = role
+        else:
+            whitelist_roles.pop(user_id, None)
+    save_whitelist_roles(whitelist_roles)
+    publish_changes('whitelist_roles', [(user_id, [user_id, role] if role else None) for user_id, role in changes.items()])
+
+whitelist_roles = {}
+
+# Разбор файла импорта белого списка (CSV или текст): строка "ID[,роль]", разделители — запятая,
+# точка с запятой, табуляция или пробел. Возвращает {ID: роль или None} и номера строк с ошибками
+def parse_whitelist_file(data):
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = data.decode('cp1251')
+    entries = {}
+    errors = []
+    for number, line in enumerate(text.splitlines(), 1):
+        cells = [cell.strip('"\'') for cell in re.split(r'[,;\t ]+', line.strip()) if cell.strip('"\'')]
+        if not cells:
+            continue
+        try:
+            user_id = int(cells[0])
+        except ValueError:
+            # Строка заголовка
+            if number > 1:
+                errors.append(number)
+            continue
+        role = None
+        if len(cells) > 1:
+            role = ROLE_ALIASES.get(cells[1].lower())
+            if role is None:
+                errors.append(number)
+                continue
+        entries[user_id] = role
+    return entries, errors
+
+# Разница между белым списком и файлом импорта: добавляемые, удаляемые (если файл заменяет список),
+# пользователи, у которых изменится роль, указанная в файле, и пользователи, с которых роль будет снята
+# (в файле роль не указана — только при замене списка). Главный администратор не удаляется
+def whitelist_diff(entries):
+    added = sorted(set(entries) - whitelist)
+    removed = sorted(whitelist - set(entries) - {MAIN_ADMIN_ID})
+    role_changes = sorted(user_id for user_id, role in entries.items() if role and whitelist_roles.get(user_id) != role)
+    roles_cleared = sorted(user_id for user_id, role in entries.items() if not role and user_id in whitelist_roles)
+    return added, removed, role_changes, roles_cleared
+
+# Применение импорта одним пакетом: каждый файл записывается один раз, другие воркеры получают изменения
+# одной транзакцией. Роли записываются первыми: роль пользователя не из белого списка ни на что не влияет.
+# При добавлении строка без роли оставляет роль пользователя как есть; при замене списка роль снимается
+def apply_whitelist_import(entries, removed, replace=False):
+    role_changes = {user_id: role for user_id, role in entries.items() if role}
+    if replace:
+        role_changes.update((user_id, None) for user_id in removed)
+        role_changes.update((user_id, None) for user_id, role in entries.items() if not role)
+    update_whitelist_roles(role_changes)
+    update_whitelist(added=entries, removed=removed)
+
+# Белый список в CSV для выгрузки
+def format_whitelist_csv():
+    lines = ["user_id,role"]
+    lines.extend(f"{user_id},{whitelist_roles.get(user_id, '')}" for user_id in sorted(whitelist))
+    return "\n".join(lines) + "\n"
+
+# Функции для работы с тикетами поддержки
+def load_tickets():
+    try:
+        with open(TICKETS_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        with open(TICKETS_FILE, 'w') as f:
+            json.dump([], f)
+        return []
+    except json.JSONDecodeError:
+        return []
+
+def save_tickets(tickets):
+    if sync.worker_index:
+        return
+    write_json_atomic(TICKETS_FILE, tickets)
+
+# Тикеты (заполняются при запуске, см. load_state)
+tickets = []
+
+# Индекс тикетов по ID и упорядоченный индекс открытых тикетов (сначала высокий приоритет, затем более старые)
+tickets_by_id = {}
+open_tickets_index = []
+# Полнотекстовый индекс по сообщению, ответу администратора и имени пользователя
+ticket_search = TicketSearchIndex()
+
+def ticket_sort_key(ticket):
+    priority = ticket.get('priority')
+    rank = TICKET_PRIORITIES.index(priority) if priority in TICKET_PRIORITIES else -1
+    return (-rank, ticket['timestamp'], ticket['id'])
+
+# Тикет ждет разбора: открыт и администратор еще не ответил
+def needs_triage(ticket):
+    return ticket['status'] != 'Закрыт' and not ticket.get('admin_reply')
+
+# Очередь разбора: куча тикетов, ждущих ответа (сначала высокий приоритет, затем более старые).
+# Удаление ленивое — запись помечается и выбрасывается, когда доходит до вершины кучи, поэтому
+# взятие следующего тикета и возврат в очередь стоят O(log n). Взятый тикет закреплен за
+# администратором и возвращается в очередь сам через TRIAGE_CLAIM_TIMEOUT
+class TriageQueue:
+    def __init__(self):
+        self.heap = []
+        self.entries = {}  # ID тикета -> запись в куче [ключ, удалена]
+        self.claims = {}  # ID тикета -> (ID администратора, время взятия)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.__init__()
+
+    def push(self, ticket):
+        if ticket['id'] in self.entries:
+            return
+        entry = [ticket_sort_key(ticket), False]
+        self.entries[ticket['id']] = entry
+        heapq.heappush(self.heap, entry)
+
+    def discard(self, ticket_id):
+        entry = self.entries.pop(ticket_id, None)
+        if entry:
+            entry[1] = True
+
+    # Приведение очереди в соответствие тикету после его изменения
+    def update(self, ticket):
+        if not needs_triage(ticket):
+            self.discard(ticket['id'])
+            self.claims.pop(ticket['id'], None)
+        elif ticket['id'] not in self.claims:
+            self.push(ticket)
+
+    # Самый срочный тикет закрепляется за администратором (None — очередь пуста)
+    def pop(self, admin_id):
+        self.release_expired()
+        while self.heap:
+            key, removed = heapq.heappop(self.heap)
+            if removed:
+                continue
+            ticket_id = key[2]
+            del self.entries[ticket_id]
+            self.claims[ticket_id] = (admin_id, time.time())
+            return tickets_by_id[ticket_id]
+        return None
+
+    def claim(self, ticket_id, admin_id):
+        self.discard(ticket_id)
+        self.claims[ticket_id] = (admin_id, time.time())
+
+    # Возврат взятого тикета в очередь
+    def requeue(self, ticket_id):
+        self.claims.pop(ticket_id, None)
+        ticket = tickets_by_id.get(ticket_id)
+        if ticket and needs_triage(ticket):
+            self.push(ticket)
+
+    def release_expired(self):
+        deadline = time.time() - TRIAGE_CLAIM_TIMEOUT
+        for ticket_id, (_, claimed_at) in list(self.claims.items()):
+            if claimed_at < deadline:
+                self.requeue(ticket_id)
+
+triage_queue = TriageQueue()
+
+def index_ticket(ticket):
+    tickets_by_id[ticket['id']] = ticket
+    if ticket['status'] != 'Закрыт':
+        key = ticket_sort_key(ticket)
+        position = bisect.bisect_left(open_tickets_index, key)
+        if position == len(open_tickets_index) or open_tickets_index[position] != key:
+            open_tickets_index.insert(position, key)
+    triage_queue.update(ticket)
+
+def unindex_open_ticket(ticket):
+    key = ticket_sort_key(ticket)
+    position = bisect.bisect_left(open_tickets_index, key)
+    if position < len(open_tickets_index) and open_tickets_index[position] == key:
+        del open_tickets_index[position]
+
+def apply_ticket_data(data):
+    ticket = tickets_by_id.get(data['id'])
+    if ticket:
+        unindex_open_ticket(ticket)
+        ticket.update(data)
+    else:
+        ticket = data
+        tickets.append(ticket)
+    index_ticket(ticket)
+    ticket_search.add(ticket)
+
+# Замена тикетов загруженными из файла с перестроением индексов (списки меняются на месте,
+# чтобы модули, импортировавшие их, видели новые данные)
+def set_tickets(loaded):
+    tickets[:] = loaded
+    tickets_by_id.clear()
+    open_tickets_index.clear()
+    ticket_search.clear()
+    triage_queue.clear()
+    for ticket in tickets:
+        index_ticket(ticket)
+        ticket_search.add(ticket)
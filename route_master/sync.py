@@ -0,0 +1,199 @@
+# Режим нескольких воркеров: общее хранилище и публикация изменений
+import os
+import asyncio
+import json
+import time
+import threading
+import sqlite3
+import concurrent.futures
+from .config import logger
+
+# Общее хранилище и номер воркера (None — обычный режим одного процесса)
+shared_store = None
+worker_index = None
+
+# Общее хранилище состояния для режима нескольких воркеров (SQLite в режиме WAL):
+# текущие значения сущностей, журнал изменений для уведомления других воркеров, позиции воркеров в журнале
+# и межпроцессные блокировки. Запись идет в отдельном потоке со своим соединением: транзакции
+# (BEGIN IMMEDIATE ждет чужую запись до 30 с) не задерживают цикл событий и выполняются в порядке вызова.
+# Публикация и освобождение блокировки не ждут записи, остальные операции записи возвращают future.
+# Чтение — отдельным соединением; из асинхронного кода его вызывают через asyncio.to_thread
+class SharedStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = self.connect()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entities (kind TEXT, key TEXT, data TEXT, PRIMARY KEY (kind, key));
+            CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, key TEXT, data TEXT, worker INTEGER);
+            CREATE TABLE IF NOT EXISTS cursors (worker INTEGER PRIMARY KEY, change_id INTEGER);
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL);
+        """)
+        self._lock = threading.Lock()
+        self._write_connection = self.connect()
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.owner = f"{os.getpid()}"
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # Выполнение функции в потоке записи; ошибки операций, результат которых не ждут, попадают в лог
+    def _submit(self, function, *args):
+        future = self._writer.submit(function, *args)
+        future.add_done_callback(log_write_error)
+        return future
+
+    # Транзакция записи (только в потоке записи)
+    def _transaction(self, statements):
+        connection = self._write_connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            before = connection.total_changes
+            for query, parameters in statements:
+                connection.execute(query, parameters)
+            connection.execute("COMMIT")
+            return connection.total_changes - before
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get(self, kind, key):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT data FROM entities WHERE kind = ? AND key = ?", (kind, str(key))
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self, kind):
+        with self._lock:
+            rows = self.connection.execute("SELECT data FROM entities WHERE kind = ?", (kind,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # Запись сущности и уведомления об изменении одной транзакцией. Данные сериализуются сразу,
+    # чтобы в хранилище попало состояние на момент вызова
+    def publish(self, kind, key, data, worker):
+        return self.publish_many(kind, [(key, data)], worker)
+
+    # Запись нескольких сущностей одного типа и уведомлений о них одной транзакцией.
+    # Изменения без ключа (события статистики) попадают только в журнал
+    def publish_many(self, kind, items, worker):
+        statements = []
+        for key, data in items:
+            payload = json.dumps(data)
+            if key is not None:
+                if data is None:
+                    statements.append(("DELETE FROM entities WHERE kind = ? AND key = ?", (kind, str(key))))
+                else:
+                    statements.append((
+                        "INSERT OR REPLACE INTO entities (kind, key, data) VALUES (?, ?, ?)", (kind, str(key), payload)
+                    ))
+            statements.append((
+                "INSERT INTO changes (kind, key, data, worker) VALUES (?, ?, ?, ?)",
+                (kind, None if key is None else str(key), payload, worker)
+            ))
+        return self._submit(self._transaction, statements)
+
+    # Изменения журнала после last_id; None, если часть из них уже удалена из журнала
+    # (воркер отстал и должен перечитать состояние целиком)
+    def changes_since(self, last_id):
+        with self._lock:
+            self.connection.execute("BEGIN")
+            try:
+                first_id = self.connection.execute("SELECT MIN(id) FROM changes").fetchone()[0]
+                rows = self.connection.execute(
+                    "SELECT id, kind, key, data, worker FROM changes WHERE id > ? ORDER BY id", (last_id,)
+                ).fetchall()
+            finally:
+                self.connection.execute("COMMIT")
+        if first_id is not None and first_id > last_id + 1:
+            return None
+        return rows
+
+    def last_change_id(self):
+        with self._lock:
+            row = self.connection.execute("SELECT MAX(id) FROM changes").fetchone()
+        return row[0] or 0
+
+    # Позиция воркера в журнале: до нее записи журнала можно удалять
+    def set_cursor(self, worker, change_id):
+        return self._submit(self._transaction, [(
+            "INSERT OR REPLACE INTO cursors (worker, change_id) VALUES (?, ?)", (worker, change_id)
+        )])
+
+    # Удаление записей журнала, которые все воркеры уже прочитали. Журнал не растет больше max_keep записей,
+    # даже если воркер завис: такой воркер, продолжив работу, перечитает состояние целиком
+    def prune_changes(self, max_keep):
+        return self._submit(self._transaction, [(
+            "DELETE FROM changes WHERE id <= MAX("
+            "(SELECT COALESCE(MIN(change_id), 0) FROM cursors), (SELECT MAX(id) FROM changes) - ?)",
+            (max_keep,)
+        )])
+
+    # Полная замена сущностей одного типа без записи в журнал (заполнение хранилища при запуске)
+    def replace_all(self, kind, items):
+        statements = [("DELETE FROM entities WHERE kind = ?", (kind,))]
+        statements.extend(
+            ("INSERT INTO entities (kind, key, data) VALUES (?, ?, ?)", (kind, str(key), json.dumps(data)))
+            for key, data in items
+        )
+        return self._submit(self._transaction, statements)
+
+    # Пакет сохраненных сущностей одного типа (ключ и исходный JSON) с ключами после last_key
+    def raw_batch(self, kind, last_key, batch_size):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT key, data FROM entities WHERE kind = ? AND key > ? ORDER BY key LIMIT ?",
+                (kind, last_key, batch_size)
+            ).fetchall()
+
+    # Замена данных, только если сущность не изменилась с момента чтения; future с числом замен
+    def compare_and_set(self, kind, rows):
+        return self._submit(self._transaction, [
+            ("UPDATE entities SET data = ? WHERE kind = ? AND key = ? AND data = ?", (new, kind, key, old))
+            for key, old, new in rows
+        ])
+
+    # Очистка блокировок и позиций воркеров при запуске
+    def reset_workers(self):
+        return self._submit(self._transaction, [("DELETE FROM leases", ()), ("DELETE FROM cursors", ())])
+
+    def _try_lease(self, name, timeout):
+        now = time.time()
+        cursor = self._write_connection.execute(
+            "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+            "WHERE leases.expires < ?",
+            (name, self.owner, now + timeout, now)
+        )
+        return cursor.rowcount == 1
+
+    async def acquire_lease(self, name, timeout):
+        while not await asyncio.wrap_future(self._writer.submit(self._try_lease, name, timeout)):
+            await asyncio.sleep(0.02)
+
+    def release_lease(self, name):
+        return self._submit(self._transaction, [
+            ("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+        ])
+
+def log_write_error(future):
+    if not future.cancelled() and future.exception():
+        logger.error("Не удалось записать изменение в общее хранилище", exc_info=future.exception())
+
+# Публикация изменения в общее хранилище (в режиме одного процесса ничего не делает)
+def publish_change(kind, key, data):
+    if shared_store:
+        shared_store.publish(kind, key, data, worker_index)
+
+# Публикация изменений нескольких сущностей (например, ID белого списка) одной транзакцией
+def publish_changes(kind, items):
+    if shared_store and items:
+        shared_store.publish_many(kind, items, worker_index)
+
+def publish_route(route):
+    publish_change('route', route.driver_id, route.to_dict())
+
+def publish_ticket(ticket):
+    publish_change('ticket', ticket['id'], ticket)
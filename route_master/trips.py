@@ -0,0 +1,245 @@
+# Запись поездок и модель времени в пути, обученная на них
+import os
+import asyncio
+import json
+import copy
+import math
+import glob
+import time
+import datetime
+import threading
+import struct
+import contextlib
+import concurrent.futures
+from .config import (
+    FALLBACK_DETOUR_FACTOR, FALLBACK_SPEED_KMH, ROUTE_IDLE_TTL, TRAVEL_MODEL_CELL_SIZE,
+    TRAVEL_MODEL_FILE, TRAVEL_MODEL_MAX_ERROR, TRAVEL_MODEL_MAX_GAP, TRAVEL_MODEL_MIN_ARRIVALS,
+    TRAVEL_MODEL_MIN_COVERAGE, TRAVEL_MODEL_MIN_SECONDS, TRAVEL_MODEL_SPEED_RANGE, TRIP_TRACES_DIR,
+    logger, workplace_location
+)
+from .crypto import keyring
+from .geo import haversine_distance, parse_coordinates
+from .sync import publish_change
+from .storage import write_json_atomic
+
+# Запись поездок: журнал на маршрут, в который дописываются отметки местоположения водителя.
+# Отметка (время, широта, долгота) упакована в 16 байт и зашифрована текущим ключом; в журнале она
+# хранится двоичным кадром с длиной впереди, файл начинается с MAGIC (журналы без него — прежние,
+# текстовые, по строке base64 на отметку). Отметки копятся в памяти и дописываются в файлы в отдельном
+# потоке, чтобы обновление живого местоположения не ждало диск. После завершения маршрута журнал
+# переименовывается и ждет агрегатора, который удаляет его после обучения
+class TripRecorder:
+    RECORD = struct.Struct('<dff')
+    FRAME = struct.Struct('<H')
+    MAGIC = b'RMT1'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._pending = {}  # путь журнала -> кадры, ожидающие записи
+        self._flush_scheduled = False
+        self._lock = threading.Lock()
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def path_for(self, route, suffix='.trip'):
+        started = int(datetime.datetime.fromisoformat(route.created_at).timestamp())
+        return os.path.join(self.directory, f"{route.driver_id}-{started}{suffix}")
+
+    def record(self, route, latitude, longitude):
+        frame = keyring.encrypt_bytes(self.RECORD.pack(time.time(), latitude, longitude))
+        with self._lock:
+            self._pending.setdefault(self.path_for(route), []).append(self.FRAME.pack(len(frame)) + frame)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self._writer.submit(self.flush)
+
+    # Запись накопленных кадров (в потоке записи): один вызов write на журнал
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_scheduled = False
+        for path, frames in pending.items():
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path, 'ab') as f:
+                    if f.tell() == 0:
+                        f.write(self.MAGIC)
+                    f.write(b''.join(frames))
+            except OSError:
+                logger.exception(f"Не удалось записать журнал поездки {path}")
+
+    # Переименование выполняется в потоке записи после уже накопленных отметок
+    def close(self, route):
+        self._writer.submit(self._close, self.path_for(route), self.path_for(route, '.done'))
+
+    def _close(self, path, done_path):
+        self.flush()
+        try:
+            if os.path.exists(path):
+                os.replace(path, done_path)
+        except OSError:
+            logger.exception(f"Не удалось закрыть журнал поездки {path}")
+
+    # Журналы, готовые к обучению: завершенные и брошенные (маршрут не завершился, например, при сбое)
+    def finished(self):
+        deadline = time.time() - ROUTE_IDLE_TTL
+        paths = glob.glob(os.path.join(self.directory, '*.done'))
+        paths += [path for path in glob.glob(os.path.join(self.directory, '*.trip')) if os.path.getmtime(path) < deadline]
+        return sorted(paths)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(self.MAGIC):
+            return [self.RECORD.unpack(keyring.decrypt(line.strip().decode())) for line in data.splitlines() if line.strip()]
+        points = []
+        offset = len(self.MAGIC)
+        while offset < len(data):
+            (length,) = self.FRAME.unpack_from(data, offset)
+            offset += self.FRAME.size
+            points.append(self.RECORD.unpack(keyring.decrypt_bytes(data[offset:offset + length])))
+            offset += length
+        return points
+
+trip_recorder = TripRecorder(TRIP_TRACES_DIR)
+
+# Модель времени в пути, обученная на записанных поездках: средняя скорость в ячейках сетки
+# по дню недели и часу, а также средняя скорость по всему городу для ячеек без данных.
+# Для каждого источника ETA накапливается ошибка первого прогноза прибытия к остановке
+class TravelModel:
+    def __init__(self, path):
+        self.path = path
+        self.cells = {}  # "строка:столбец:день недели:час" -> [метры, секунды]
+        self.hours = {}  # "день недели:час" -> [метры, секунды]
+        self.accuracy = {}  # источник ETA -> [прибытий, сумма модулей ошибки, сумма ошибки]
+        self._lock = threading.Lock()
+
+    def load(self, with_accuracy=True):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self.cells = data.get('cells', {})
+        self.hours = data.get('hours', {})
+        if with_accuracy:
+            self.accuracy = data.get('accuracy', {})
+
+    def save(self):
+        with self._lock:
+            data = {'cells': self.cells, 'hours': self.hours, 'accuracy': dict(self.accuracy)}
+            write_json_atomic(self.path, data)
+
+    # Шаг сетки по долготе считается по широте пункта назначения, чтобы столбцы не смещались с широтой
+    def cell(self, latitude, longitude):
+        lat_step = TRAVEL_MODEL_CELL_SIZE / 111320
+        lng_step = lat_step / math.cos(math.radians(parse_coordinates(workplace_location)[0]))
+        return int(latitude // lat_step), int(longitude // lng_step)
+
+    # Обучение на одной поездке: скорость отрезка между соседними отметками относится к ячейке его середины
+    def learn(self, points):
+        for (t1, lat1, lng1), (t2, lat2, lng2) in zip(points, points[1:]):
+            seconds = t2 - t1
+            if not 0 < seconds <= TRAVEL_MODEL_MAX_GAP:
+                continue
+            meters = haversine_distance(f"{lat1},{lng1}", f"{lat2},{lng2}")
+            min_speed, max_speed = TRAVEL_MODEL_SPEED_RANGE
+            if not min_speed <= meters / seconds <= max_speed:
+                continue
+            moment = datetime.datetime.fromtimestamp(t1)
+            row, column = self.cell((lat1 + lat2) / 2, (lng1 + lng2) / 2)
+            time_key = f"{moment.weekday()}:{moment.hour}"
+            for table, key in ((self.cells, f"{row}:{column}:{time_key}"), (self.hours, time_key)):
+                totals = table.setdefault(key, [0.0, 0.0])
+                totals[0] += meters
+                totals[1] += seconds
+
+    # Обучение на всех готовых журналах. Журналы удаляются только после сохранения модели; если сохранить
+    # не удалось, модель возвращается к прежнему состоянию, а журналы остаются до следующего запуска.
+    # Журнал, который не удалось прочитать, переименовывается в .failed, чтобы не разбирать его каждый раз
+    def learn_from(self, recorder):
+        previous = copy.deepcopy((self.cells, self.hours))
+        learned = []
+        for path in recorder.finished():
+            try:
+                points = recorder.read(path)
+            except Exception:
+                logger.exception(f"Не удалось обработать журнал поездки {path}")
+                with contextlib.suppress(OSError):
+                    os.replace(path, f"{path}.failed")
+                continue
+            self.learn(points)
+            learned.append(path)
+        try:
+            self.save()
+        except OSError:
+            self.cells, self.hours = previous
+            raise
+        for path in learned:
+            os.remove(path)
+        return len(learned)
+
+    @staticmethod
+    def speed(totals):
+        if totals and totals[1] >= TRAVEL_MODEL_MIN_SECONDS:
+            return totals[0] / totals[1]
+        return None
+
+    # Время в пути (секунды) и доля пути, покрытая ячейками с данными. Путь — прямая с поправкой
+    # на извилистость дорог, разбитая на шаги размером с ячейку
+    def estimate(self, point_a, point_b, moment=None):
+        moment = moment or datetime.datetime.now()
+        time_key = f"{moment.weekday()}:{moment.hour}"
+        lat1, lng1 = parse_coordinates(point_a)
+        lat2, lng2 = parse_coordinates(point_b)
+        distance = haversine_distance(point_a, point_b)
+        steps = max(1, math.ceil(distance / TRAVEL_MODEL_CELL_SIZE))
+        step_distance = distance * FALLBACK_DETOUR_FACTOR / steps
+        default_speed = self.speed(self.hours.get(time_key)) or FALLBACK_SPEED_KMH * 1000 / 3600
+        seconds, covered = 0.0, 0
+        for step in range(steps):
+            fraction = (step + 0.5) / steps
+            row, column = self.cell(lat1 + (lat2 - lat1) * fraction, lng1 + (lng2 - lng1) * fraction)
+            speed = self.speed(self.cells.get(f"{row}:{column}:{time_key}"))
+            if speed:
+                covered += 1
+            seconds += step_distance / (speed or default_speed)
+        return int(seconds), covered / steps
+
+    # Оценка по модели, если ячейки с данными покрывают достаточную часть пути
+    def covered_estimate(self, point_a, point_b):
+        seconds, coverage = self.estimate(point_a, point_b)
+        return seconds if coverage >= TRAVEL_MODEL_MIN_COVERAGE else None
+
+    # Модель подтвердила точность на фактических прибытиях
+    @property
+    def trusted(self):
+        count, abs_sum, _ = self.accuracy.get('model', (0, 0, 0))
+        return count >= TRAVEL_MODEL_MIN_ARRIVALS and abs_sum / count <= TRAVEL_MODEL_MAX_ERROR
+
+    # Ошибка прогноза (факт минус прогноз, секунды); в режиме нескольких воркеров рассылается остальным
+    def record_accuracy(self, source, error):
+        event = {'source': source, 'error': error}
+        self.apply_accuracy(event)
+        publish_change('eta_accuracy', None, event)
+
+    def apply_accuracy(self, event):
+        with self._lock:
+            totals = self.accuracy.setdefault(event['source'], [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += abs(event['error'])
+            totals[2] += event['error']
+
+# Модель (загружается при запуске, см. load_state)
+travel_model = TravelModel(TRAVEL_MODEL_FILE)
+
+# Периодическое обучение модели времени в пути на завершенных поездках (JobQueue)
+async def learn_travel_model(context):
+    try:
+        learned = await asyncio.to_thread(travel_model.learn_from, trip_recorder)
+    except Exception:
+        logger.exception("Не удалось обучить модель времени в пути")
+        return
+    if learned:
+        publish_change('travel_model', None, learned)
+        logger.info(f"Модель времени в пути обучена на {learned} поездках")
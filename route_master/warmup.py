@@ -0,0 +1,129 @@
+# Прогрев перед сменой: перед началом смены водители и пассажиры почти одновременно отправляют точки
+# и /finish. Заранее, по маршрутам за прошлый день, запрашиваются время в пути между остановками
+# и до места работы и планы маршрутов, а адреса из файла импорта без координат геокодируются,
+# чтобы в пиковые минуты запросы обслуживались из кэша маршрутов и справочника адресов
+import asyncio
+import time
+import datetime
+from .config import (
+    GAZETTEER_IMPORT_FILE, WARMUP_HISTORY_DAYS, WARMUP_LEAD_MINUTES, WARMUP_MAX_GEOCODES,
+    WARMUP_MAX_MATRIX_ELEMENTS, logger, workplace_location
+)
+from .sync import publish_change
+from .maps import MapsUnavailable, call_maps, get_coordinates, gmaps, plan_route, route_cache
+from .gazetteer import gazetteer, save_gazetteer
+from .routes import route_archive
+
+# Время запуска прогрева перед сменой (местное время)
+def warmup_time(shift):
+    hour, minute = (int(value) for value in shift.split(':'))
+    moment = datetime.datetime.combine(datetime.date.today(), datetime.time(hour, minute))
+    moment -= datetime.timedelta(minutes=WARMUP_LEAD_MINUTES)
+    return moment.time().replace(tzinfo=datetime.datetime.now().astimezone().tzinfo)
+
+# Маршруты из архива за последние WARMUP_HISTORY_DAYS дней: (начало, остановки) без повторов,
+# сначала маршруты с большим числом пассажиров
+def recent_routes(now):
+    found = {}
+    for data in route_archive.iter_routes(now - datetime.timedelta(days=WARMUP_HISTORY_DAYS), now):
+        stops = [stop['location'] for stop in data['stops']]
+        key = route_cache.plan_key(data['origin'], workplace_location, stops)
+        if key is not None and key not in found:
+            found[key] = (data['origin'], stops, len(data['passenger_ids']))
+    return [(origin, stops) for origin, stops, _ in sorted(found.values(), key=lambda item: item[2], reverse=True)]
+
+# Время в пути от начала и остановок каждого маршрута до остановок и места работы (Distance Matrix,
+# не больше 25 точек и 100 элементов в запросе). Запрашиваются только точки, для которых в кэше
+# нет хотя бы одного участка; возвращает число запрошенных элементов
+def prefetch_legs(routes, departure):
+    requested = 0
+    for origin, stops in routes:
+        destinations = stops + [workplace_location]
+        origins = [
+            point for point in [origin] + stops
+            if any(route_cache.get_leg(point, destination) is None for destination in destinations)
+        ]
+        for start in range(0, len(destinations), 25):
+            destination_chunk = destinations[start:start + 25]
+            step = max(1, min(25, 100 // len(destination_chunk)))
+            for origin_start in range(0, len(origins), step):
+                origin_chunk = origins[origin_start:origin_start + step]
+                if requested + len(origin_chunk) * len(destination_chunk) > WARMUP_MAX_MATRIX_ELEMENTS:
+                    logger.warning("Прогрев: достигнут лимит элементов Distance Matrix")
+                    return requested
+                result = call_maps(
+                    gmaps.distance_matrix,
+                    origins=origin_chunk,
+                    destinations=destination_chunk,
+                    mode="driving",
+                    departure_time=departure
+                )
+                requested += len(origin_chunk) * len(destination_chunk)
+                for row_point, row in zip(origin_chunk, result['rows']):
+                    for column_point, element in zip(destination_chunk, row['elements']):
+                        if element['status'] == 'OK':
+                            duration = element.get('duration_in_traffic', element['duration'])['value']
+                            route_cache.put_leg(row_point, column_point, duration)
+    return requested
+
+# Прогрев кэша маршрутов (в отдельном потоке): время в пути, затем планы маршрутов
+def warm_up_route_cache(departure):
+    routes = recent_routes(datetime.datetime.now())
+    try:
+        elements = prefetch_legs(routes, departure)
+    except MapsUnavailable:
+        logger.warning("Прогрев: Google Maps недоступен, время в пути не запрошено")
+        elements = 0
+    plans = 0
+    for origin, stops in routes:
+        if route_cache.get_plan(origin, workplace_location, stops) is None:
+            plan_route(origin, workplace_location, stops)
+            plans += 1
+    route_cache.save()
+    return {'routes': len(routes), 'elements': elements, 'plans': plans}
+
+# Геокодирование адресов из файла импорта справочника (в отдельном потоке); возвращает [(адрес, координаты)]
+def geocode_pending_addresses():
+    if not GAZETTEER_IMPORT_FILE:
+        return []
+    try:
+        addresses = gazetteer.pending_addresses(GAZETTEER_IMPORT_FILE)
+    except OSError:
+        logger.exception("Прогрев: не удалось прочитать файл импорта справочника адресов")
+        return []
+    found = []
+    for address in addresses[:WARMUP_MAX_GEOCODES]:
+        location = get_coordinates(address)
+        if location:
+            found.append((address, location))
+    return found
+
+# Прогрев перед сменой (JobQueue, первым воркером); context.job.data — начало смены "ЧЧ:ММ"
+async def warm_up_before_shift(context):
+    started = time.perf_counter()
+    hits, misses = route_cache.take_counters()
+    # Ближайшее начало смены (смена может начаться уже после полуночи)
+    hour, minute = (int(value) for value in context.job.data.split(':'))
+    departure = datetime.datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if departure <= datetime.datetime.now():
+        departure += datetime.timedelta(days=1)
+    try:
+        found = await asyncio.to_thread(geocode_pending_addresses)
+        for address, location in found:
+            gazetteer.add(address, location)
+            publish_change('gazetteer', None, [address, location])
+        if found:
+            await asyncio.to_thread(save_gazetteer)
+        result = await asyncio.to_thread(warm_up_route_cache, departure)
+        # Запросы самого прогрева не попадают в счетчики следующего
+        route_cache.take_counters()
+    except Exception:
+        logger.exception(f"Не удалось выполнить прогрев перед сменой {context.job.data}")
+        return
+    publish_change('route_cache', None, None)
+    logger.info(
+        f"Прогрев перед сменой {context.job.data} за {time.perf_counter() - started:.1f} с: "
+        f"адресов геокодировано {len(found)}, маршрутов {result['routes']}, "
+        f"элементов Distance Matrix {result['elements']}, планов запрошено {result['plans']}; "
+        f"с прошлого прогрева планы из кэша {hits}, запросов к Google Maps {misses}"
+    )
@@ -0,0 +1,114 @@
+# Предохранитель Google Maps: размыкание после серии сбоев, резервный режим и проверка восстановления
+import threading
+import time
+
+import googlemaps
+import pytest
+
+from route_master import maps
+from route_master.maps import CircuitBreaker, MapsUnavailable, call_maps, plan_directions
+
+ORIGIN = '51.200000,71.300000'
+DESTINATION = '51.128000,71.430000'
+WAYPOINTS = ['51.150000,71.350000', '51.190000,71.310000', '51.170000,71.400000']
+
+
+class FakeMaps:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+
+    def directions(self, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return [{
+            'waypoint_order': [2, 0, 1],
+            'legs': [{'duration': {'value': 300}}] * 4,
+            'overview_polyline': {'points': 'abc'},
+        }]
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=3600, probe=lambda: None)
+    monkeypatch.setattr(maps, 'maps_breaker', breaker)
+    return breaker
+
+
+def use_maps(monkeypatch, error=None):
+    client = FakeMaps(error)
+    monkeypatch.setattr(maps, 'gmaps', client)
+    return client
+
+
+def test_opens_after_threshold_timeouts(monkeypatch, breaker):
+    client = use_maps(monkeypatch, googlemaps.exceptions.Timeout())
+    for _ in range(breaker.failure_threshold - 1):
+        with pytest.raises(googlemaps.exceptions.Timeout):
+            call_maps(client.directions)
+        assert breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(googlemaps.exceptions.Timeout):
+        call_maps(client.directions)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(MapsUnavailable):
+        call_maps(client.directions)
+    assert client.calls == breaker.failure_threshold
+
+
+def test_open_breaker_falls_back_without_calling_maps(monkeypatch, breaker):
+    client = use_maps(monkeypatch, googlemaps.exceptions.Timeout())
+    for _ in range(breaker.failure_threshold):
+        plan = plan_directions(ORIGIN, DESTINATION, WAYPOINTS)
+        assert plan['polyline'] is None
+    assert breaker.state == CircuitBreaker.OPEN
+
+    client.error = None
+    plan = plan_directions(ORIGIN, DESTINATION, WAYPOINTS)
+    assert client.calls == breaker.failure_threshold
+    assert sorted(plan['order']) == [0, 1, 2]
+    assert plan['duration'] > 0
+    assert plan['polyline'] is None
+
+
+def test_bad_request_does_not_open_breaker(monkeypatch, breaker):
+    client = use_maps(monkeypatch, googlemaps.exceptions.ApiError('INVALID_REQUEST'))
+    for _ in range(breaker.failure_threshold + 1):
+        plan_directions(ORIGIN, DESTINATION, WAYPOINTS)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert client.calls == breaker.failure_threshold + 1
+
+
+def test_success_resets_failure_count(monkeypatch, breaker):
+    client = use_maps(monkeypatch, googlemaps.exceptions.Timeout())
+    for _ in range(breaker.failure_threshold - 1):
+        plan_directions(ORIGIN, DESTINATION, WAYPOINTS)
+    client.error = None
+    assert plan_directions(ORIGIN, DESTINATION, WAYPOINTS)['order'] == [2, 0, 1]
+    client.error = googlemaps.exceptions.Timeout()
+    for _ in range(breaker.failure_threshold - 1):
+        plan_directions(ORIGIN, DESTINATION, WAYPOINTS)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.parametrize('probe_fails', [False, True])
+def test_half_open_probe(probe_fails):
+    probed = threading.Event()
+
+    def probe():
+        probed.set()
+        if probe_fails:
+            raise googlemaps.exceptions.Timeout()
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0, probe=probe)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    # Запрос не ждет проверки: он сразу уходит в резервный режим, а проверка идет в фоне
+    assert not breaker.allow_request()
+    assert probed.wait(5)
+    for _ in range(500):
+        if breaker.state != CircuitBreaker.HALF_OPEN:
+            break
+        time.sleep(0.01)
+    assert breaker.state == (CircuitBreaker.OPEN if probe_fails else CircuitBreaker.CLOSED)
+    assert breaker.allow_request() == (not probe_fails)
@@ -0,0 +1,107 @@
+# Планирование маршрутов больше лимита Directions API по частям и сшивка полилиний
+import random
+import threading
+
+import googlemaps
+import pytest
+
+from route_master import maps
+from route_master.config import MAPS_MAX_WAYPOINTS
+from route_master.maps import plan_large_route, stitch_polylines
+
+ORIGIN = '51.200000,71.300000'
+DESTINATION = '51.128000,71.430000'
+
+
+def coordinates(location):
+    latitude, longitude = location.split(',')
+    return float(latitude), float(longitude)
+
+
+def decode(polyline):
+    return [(round(point['lat'], 5), round(point['lng'], 5)) for point in googlemaps.convert.decode_polyline(polyline)]
+
+
+# Directions API без сети: точки части в обратном порядке, минута на каждый отрезок
+@pytest.fixture
+def directions(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def plan_directions(origin, destination, waypoints):
+        with lock:
+            calls.append((origin, destination, list(waypoints)))
+        order = list(range(len(waypoints)))[::-1]
+        path = [origin] + [waypoints[i] for i in order] + [destination]
+        polyline = googlemaps.convert.encode_polyline([coordinates(location) for location in path])
+        return {'order': order, 'duration': 60 * (len(waypoints) + 1), 'polyline': polyline}
+
+    monkeypatch.setattr(maps, 'plan_directions', plan_directions)
+    return calls
+
+
+def stops(count, seed=3):
+    rng = random.Random(seed)
+    return [f"{51.05 + rng.random() * 0.2:.5f},{71.3 + rng.random() * 0.3:.5f}" for _ in range(count)]
+
+
+@pytest.mark.parametrize('count', [MAPS_MAX_WAYPOINTS + 1, 2 * MAPS_MAX_WAYPOINTS, 2 * MAPS_MAX_WAYPOINTS + 1, 97])
+def test_chunked_order_covers_every_stop(directions, count):
+    pickup_locations = stops(count)
+    plan = plan_large_route(ORIGIN, DESTINATION, pickup_locations)
+    assert sorted(plan['order']) == list(range(count))
+    assert all(len(waypoints) <= MAPS_MAX_WAYPOINTS for _, _, waypoints in directions)
+    # Отрезков на один больше, чем точек: каждая часть добавляет отрезок до фиксированной точки-стыка
+    assert plan['duration'] == 60 * (count + 1)
+
+
+def test_chunks_are_linked(directions):
+    pickup_locations = stops(60)
+    plan = plan_large_route(ORIGIN, DESTINATION, pickup_locations)
+    requests = sorted(directions, key=lambda call: call[0] != ORIGIN)
+    assert requests[0][0] == ORIGIN
+    ends = {destination for _, destination, _ in requests}
+    assert DESTINATION in ends
+    # Конец каждой части, кроме последней, — начало следующей
+    for origin, _, _ in requests[1:]:
+        assert origin in ends
+    # Точка-стык не запрашивается как промежуточная и стоит в общем порядке один раз
+    waypoints = [location for _, _, chunk in requests for location in chunk]
+    junctions = [destination for _, destination, _ in requests if destination != DESTINATION]
+    assert sorted(waypoints + junctions) == sorted(pickup_locations)
+
+
+def test_stitched_polyline_follows_order(directions):
+    pickup_locations = stops(60)
+    plan = plan_large_route(ORIGIN, DESTINATION, pickup_locations)
+    expected = [ORIGIN] + [pickup_locations[i] for i in plan['order']] + [DESTINATION]
+    assert decode(plan['polyline']) == [coordinates(location) for location in expected]
+
+
+def test_chunk_without_answer_is_estimated(monkeypatch, directions):
+    planned = maps.plan_directions
+
+    def flaky(origin, destination, waypoints):
+        plan = planned(origin, destination, waypoints)
+        if origin == ORIGIN:
+            return {'order': list(range(len(waypoints))), 'duration': None, 'polyline': None}
+        return plan
+
+    monkeypatch.setattr(maps, 'plan_directions', flaky)
+    pickup_locations = stops(60)
+    plan = plan_large_route(ORIGIN, DESTINATION, pickup_locations)
+    assert sorted(plan['order']) == list(range(60))
+    assert plan['polyline'] is None
+    assert plan['duration'] > 0
+
+
+def test_stitch_polylines_drops_shared_point():
+    first = googlemaps.convert.encode_polyline([(51.2, 71.3), (51.19, 71.31)])
+    second = googlemaps.convert.encode_polyline([(51.19, 71.31), (51.18, 71.32)])
+    assert decode(stitch_polylines([first, second])) == [(51.2, 71.3), (51.19, 71.31), (51.18, 71.32)]
+
+
+def test_stitch_polylines_without_part():
+    part = googlemaps.convert.encode_polyline([(51.2, 71.3), (51.19, 71.31)])
+    assert stitch_polylines([part, None]) is None
+    assert stitch_polylines([]) is None
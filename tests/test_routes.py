@@ -0,0 +1,112 @@
+# Удаление пассажира из маршрута и локальная доводка порядка остановок
+import random
+
+from route_master.geo import haversine_distance
+from route_master.routes import Route
+
+DESTINATION = '51.128000,71.430000'
+
+
+def point(latitude, longitude):
+    return f"{latitude:.6f},{longitude:.6f}"
+
+
+# Маршрут после оптимизации: по пассажиру на остановку, остановки далеко друг от друга
+def finished_route(points, next_stop_index=0):
+    route = Route(1, '51.200000,71.300000')
+    for passenger_id, location in enumerate(points, start=100):
+        route.add_passenger(location, passenger_id)
+    route.pickup_order = list(range(len(route.stops)))
+    route.next_stop_index = next_stop_index
+    return route
+
+
+def tour_length(route, destination):
+    tour = [route.origin] + route.stop_locations + [destination]
+    return sum(haversine_distance(a, b) for a, b in zip(tour, tour[1:]))
+
+
+def drop(route, passenger_id):
+    index, removed = route.remove_passenger(passenger_id)
+    if removed:
+        route.repair_order(index, DESTINATION)
+    return index, removed
+
+
+def assert_consistent(route, passenger_ids, pickup_order):
+    assert sorted(route.passenger_ids) == sorted(passenger_ids)
+    assert sorted(route.pickup_order) == sorted(pickup_order)
+    assert len(route.pickup_order) == len(route.stops)
+    assert route.passenger_ids == [passenger_id for stop in route.stops for passenger_id in stop['passenger_ids']]
+    assert route.pickup_locations == [location for stop in route.stops for location in stop['points']]
+    for stop in route.stops:
+        assert len(stop['points']) == len(stop['passenger_ids']) > 0
+
+
+def test_remove_passenger_from_shared_stop_keeps_stop():
+    route = finished_route([point(51.15, 71.35), point(51.17, 71.37)])
+    route.add_passenger(point(51.1501, 71.3501), 200)
+    index, removed = route.remove_passenger(100)
+    assert (index, removed) == (0, False)
+    assert route.stops[0]['passenger_ids'] == [200]
+    assert route.stops[0]['location'] == point(51.1501, 71.3501)
+    assert route.pickup_order == [0, 1]
+
+
+def test_remove_unknown_passenger():
+    route = finished_route([point(51.15, 71.35)])
+    assert route.remove_passenger(999) == (None, False)
+    assert route.passenger_ids == [100]
+
+
+def test_remove_passenger_shifts_indexes():
+    route = finished_route([point(51.15 + 0.01 * k, 71.35) for k in range(4)], next_stop_index=2)
+    route.eta_predictions = {'0': 'a', '1': 'b', '2': 'c', '3': 'd'}
+    assert route.remove_passenger(101) == (1, True)
+    assert route.next_stop_index == 1
+    assert route.eta_predictions == {'0': 'a', '1': 'c', '2': 'd'}
+    assert route.pickup_order == [0, 2, 3]
+
+
+def test_repair_order_undoes_crossing():
+    # Зигзаг: после удаления средней остановки выгоднее пройти две следующие в обратном порядке
+    points = [point(51.20, 71.33), point(51.19, 71.31), point(51.17, 71.36), point(51.165, 71.33), point(51.14, 71.42)]
+    route = finished_route(points)
+    index, removed = route.remove_passenger(101)
+    assert removed
+    before = tour_length(route, DESTINATION)
+    changed_from = route.repair_order(index, DESTINATION)
+    assert changed_from is not None
+    assert tour_length(route, DESTINATION) < before
+    assert_consistent(route, [100, 102, 103, 104], [0, 2, 3, 4])
+
+
+def test_repair_order_skips_visited_stops():
+    route = finished_route([point(51.15 + 0.01 * k, 71.35) for k in range(3)], next_stop_index=2)
+    route.remove_passenger(100)
+    assert route.repair_order(0, DESTINATION) is None
+
+
+def test_order_stays_permutation_after_drops():
+    rng = random.Random(7)
+    for _ in range(200):
+        count = rng.randint(2, 12)
+        points = [point(51.05 + rng.random() * 0.2, 71.3 + rng.random() * 0.3) for _ in range(count)]
+        route = finished_route(points, next_stop_index=rng.randint(0, count - 1))
+        passenger_ids = list(route.passenger_ids)
+        pickup_order = list(route.pickup_order)
+        visited = route.stops[:route.next_stop_index]
+        for passenger_id in rng.sample(passenger_ids, rng.randint(1, count - 1)):
+            stop_position = route.pickup_order[route.stop_index_of(passenger_id)]
+            before = tour_length(route, DESTINATION)
+            index, removed = drop(route, passenger_id)
+            passenger_ids.remove(passenger_id)
+            if removed:
+                pickup_order.remove(stop_position)
+                if index < len(visited):
+                    del visited[index]
+                else:
+                    # Удаление остановки по неравенству треугольника не удлиняет маршрут, доводка тоже
+                    assert tour_length(route, DESTINATION) <= before + 1e-6
+            assert_consistent(route, passenger_ids, pickup_order)
+            assert route.stops[:route.next_stop_index] == visited
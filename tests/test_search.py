@@ -0,0 +1,73 @@
+# Поиск по тикетам: стемминг русских слов и ранжирование BM25
+from route_master.search import TicketSearchIndex, stem, tokenize
+
+
+def ticket(ticket_id, message, timestamp=0, **fields):
+    return {'id': ticket_id, 'message': message, 'timestamp': timestamp, **fields}
+
+
+def test_stem_joins_word_forms():
+    for forms in (
+        ['автобус', 'автобуса', 'автобусом', 'автобусы'],
+        ['водитель', 'водителя', 'водителем'],
+        ['остановка', 'остановке', 'остановку'],
+        ['опоздал', 'опоздала'],
+    ):
+        assert len({stem(form) for form in forms}) == 1, forms
+
+
+def test_stem_treats_yo_as_ye():
+    assert stem('ещё') == stem('еще')
+
+
+def test_tokenize_skips_stop_words_and_keeps_latin():
+    assert tokenize('Водитель не приехал на остановку, GPS 123') == ['водител', 'приеха', 'остановк', 'gps', '123']
+
+
+def test_search_matches_other_word_form():
+    index = TicketSearchIndex()
+    index.add(ticket(1, 'Автобус опоздал на остановку'))
+    index.add(ticket(2, 'Не работает приложение'))
+    assert index.search('автобусом', 10) == [1]
+    assert index.search('остановке', 10) == [1]
+    assert index.search('опоздала', 10) == [1]
+
+
+def test_search_ranks_by_bm25():
+    index = TicketSearchIndex()
+    index.add(ticket(1, 'Водитель опоздал, водитель не отвечает, водитель грубит'))
+    index.add(ticket(2, 'Водитель опоздал на остановку и уехал без пассажиров, приложение зависло'))
+    index.add(ticket(3, 'Приложение зависло'))
+    # Чаще встречающийся терм в коротком тикете весит больше
+    assert index.search('водителя', 10) == [1, 2]
+    # Редкий терм ("остановк") важнее частого ("водител")
+    assert index.search('водитель остановка', 10)[0] == 2
+
+
+def test_search_weights_user_name():
+    index = TicketSearchIndex()
+    index.add(ticket(1, 'Иванов просил перезвонить'))
+    index.add(ticket(2, 'Просил перезвонить', user_name='Иванов'))
+    assert index.search('Иванов', 10) == [2, 1]
+
+
+def test_search_prefers_newer_on_equal_score():
+    index = TicketSearchIndex()
+    index.add(ticket(1, 'Автобус сломался', timestamp=100))
+    index.add(ticket(2, 'Автобус сломался', timestamp=200))
+    assert index.search('автобус', 10) == [2, 1]
+    assert index.search('автобус', 1) == [2]
+
+
+def test_reindex_and_remove():
+    index = TicketSearchIndex()
+    index.add(ticket(1, 'Автобус сломался'))
+    index.add(ticket(1, 'Опоздание', admin_reply='Водитель заменен'))
+    assert len(index) == 1
+    assert index.search('автобус', 10) == []
+    assert index.search('водителя', 10) == [1]
+    index.remove(1)
+    assert len(index) == 0
+    assert index.postings == {}
+    assert index.total_length == 0
+    assert index.search('водителя', 10) == []
@@ -0,0 +1,125 @@
+# Очередь разбора тикетов: взятие, возврат и ленивое удаление
+import time
+
+import pytest
+
+from route_master import storage
+from route_master.config import TRIAGE_CLAIM_TIMEOUT
+from route_master.storage import TriageQueue
+
+
+@pytest.fixture
+def tickets(monkeypatch):
+    by_id = {}
+    monkeypatch.setattr(storage, 'tickets_by_id', by_id)
+
+    def make(ticket_id, timestamp, priority='Средний', status='Открыт', **fields):
+        by_id[ticket_id] = {'id': ticket_id, 'timestamp': timestamp, 'priority': priority, 'status': status, **fields}
+        return by_id[ticket_id]
+    return make
+
+
+def drain(queue, admin_id):
+    popped = []
+    while (ticket := queue.pop(admin_id)) is not None:
+        popped.append(ticket['id'])
+    return popped
+
+
+def test_pop_order_priority_then_age(tickets):
+    queue = TriageQueue()
+    for ticket in (tickets(1, 30), tickets(2, 10, 'Низкий'), tickets(3, 20, 'Высокий'), tickets(4, 5)):
+        queue.push(ticket)
+    assert drain(queue, 100) == [3, 4, 1, 2]
+
+
+def test_claimed_ticket_is_not_handed_out_twice(tickets):
+    queue = TriageQueue()
+    for ticket_id in range(1, 4):
+        queue.push(tickets(ticket_id, ticket_id))
+    first = queue.pop(100)
+    second = queue.pop(200)
+    assert first['id'] == 1 and second['id'] == 2
+    assert queue.claims[1][0] == 100 and queue.claims[2][0] == 200
+    # Изменение взятого тикета (например, смена приоритета) не возвращает его в очередь
+    first['priority'] = 'Высокий'
+    queue.update(first)
+    assert drain(queue, 300) == [3]
+    assert queue.pop(300) is None
+
+
+def test_claim_by_id_removes_ticket_from_queue(tickets):
+    queue = TriageQueue()
+    for ticket_id in range(1, 4):
+        queue.push(tickets(ticket_id, ticket_id))
+    queue.claim(1, 100)
+    assert len(queue) == 2
+    assert drain(queue, 200) == [2, 3]
+
+
+def test_requeue_returns_ticket(tickets):
+    queue = TriageQueue()
+    queue.push(tickets(1, 1))
+    queue.push(tickets(2, 2))
+    assert queue.pop(100)['id'] == 1
+    queue.requeue(1)
+    assert 1 not in queue.claims
+    assert queue.pop(200)['id'] == 1
+
+
+def test_requeue_skips_answered_ticket(tickets):
+    queue = TriageQueue()
+    ticket = tickets(1, 1)
+    queue.push(ticket)
+    queue.pop(100)
+    ticket['admin_reply'] = 'Готово'
+    queue.requeue(1)
+    assert queue.pop(200) is None
+
+
+def test_expired_claim_returns_to_queue(tickets):
+    queue = TriageQueue()
+    queue.push(tickets(1, 1))
+    queue.push(tickets(2, 2))
+    queue.pop(100)
+    queue.pop(100)
+    queue.claims[1] = (100, time.time() - TRIAGE_CLAIM_TIMEOUT - 1)
+    assert queue.pop(200)['id'] == 1
+    assert queue.claims[1][0] == 200
+    assert queue.pop(200) is None
+
+
+def test_lazy_deletion(tickets):
+    queue = TriageQueue()
+    for ticket_id in range(1, 5):
+        queue.push(tickets(ticket_id, ticket_id))
+    queue.discard(1)
+    answered = tickets(3, 3, admin_reply='Ответ')
+    queue.update(answered)
+    assert len(queue) == 2
+    # Записи остаются в куче помеченными и выбрасываются только при взятии
+    assert len(queue.heap) == 4
+    assert drain(queue, 100) == [2, 4]
+    assert queue.heap == []
+
+
+def test_discarded_ticket_can_be_pushed_again(tickets):
+    queue = TriageQueue()
+    ticket = tickets(1, 1)
+    queue.push(ticket)
+    queue.discard(1)
+    queue.push(ticket)
+    assert len(queue) == 1
+    assert drain(queue, 100) == [1]
+    assert queue.pop(100) is None
+
+
+def test_closing_claimed_ticket_releases_claim(tickets):
+    queue = TriageQueue()
+    ticket = tickets(1, 1)
+    queue.push(ticket)
+    queue.pop(100)
+    ticket['status'] = 'Закрыт'
+    queue.update(ticket)
+    assert queue.claims == {}
+    assert len(queue) == 0